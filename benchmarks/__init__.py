@@ -0,0 +1,3 @@
+"""
+Microbenchmarks of the ETL, run with python -m benchmarks.<module>
+"""
@@ -0,0 +1,51 @@
+"""
+Throughput of the row by row loaders for different numbers of rows per commit, against a simulated
+connection whose commit waits like a database flushing its log.
+
+    python -m benchmarks.bench_commit_batching
+"""
+import time
+
+from etl.load import load_monitoring_locations_pg_by_row
+from etl.test.fake_data import TEST_DATA
+from etl.transform import transform_mon_loc_data
+
+COMMIT_SECONDS = 0.002
+STATEMENT_SECONDS = 0.0001
+
+
+class SimulatedCursor:
+
+    @staticmethod
+    def execute(statement, params=None):
+        if not statement.startswith(('SAVEPOINT', 'ROLLBACK')):
+            time.sleep(STATEMENT_SECONDS)
+
+
+class SimulatedConnection:
+
+    def __init__(self):
+        self.commits = 0
+
+    @staticmethod
+    def cursor():
+        return SimulatedCursor()
+
+    def commit(self):
+        time.sleep(COMMIT_SECONDS)
+        self.commits += 1
+
+
+def main(rows=2000, batch_sizes=(1, 10, 100, 1000)):
+    mon_locs = [dict(transform_mon_loc_data(TEST_DATA), SITE_NO=f'CA-{site}') for site in range(rows)]
+    print(f'{rows} rows, {COMMIT_SECONDS * 1000:.1f} ms per commit, {STATEMENT_SECONDS * 1000:.1f} ms per statement')
+    for commit_every in batch_sizes:
+        connect = SimulatedConnection()
+        start = time.perf_counter()
+        load_monitoring_locations_pg_by_row(connect, mon_locs, commit_every=commit_every)
+        elapsed = time.perf_counter() - start
+        print(f'commit every {commit_every:>5}: {rows / elapsed:9.0f} rows/s, {connect.commits} commits')
+
+
+if __name__ == '__main__':
+    main()
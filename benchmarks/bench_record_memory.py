@@ -0,0 +1,65 @@
+"""
+Memory held by a whole synthetic registry once transformed, as dicts from transform_mon_loc_data
+against the MonitoringLocation records with interned low cardinality values the pipeline holds,
+measured with tracemalloc.
+
+    python -m benchmarks.bench_record_memory [sites]
+"""
+import gc
+import json
+import sys
+import tracemalloc
+
+from etl.record import InternPool, MonitoringLocation
+from etl.test.fake_data import TEST_DATA
+from etl.transform import transform_mon_loc_data, transform_mon_loc_values
+
+PAGE_SIZE = 1000
+AGENCIES = 60
+
+
+def synthetic_pages(sites):
+    """
+    Pages decoded from JSON like the registry's, so that every record has its own copy of every string.
+    """
+    for start in range(0, sites, PAGE_SIZE):
+        page = []
+        for site in range(start, min(sites, start + PAGE_SIZE)):
+            agency = site % AGENCIES
+            page.append(dict(
+                TEST_DATA,
+                agency={'agency_cd': f'AG{agency}', 'agency_nm': f'Agency number {agency} of the registry',
+                        'agency_med': f'Agency {agency}'},
+                site_no=f'{agency}-{site:09d}', site_name=f'Well {site}',
+                dec_lat_va=f'{30 + site % 1700 / 100:.8f}', dec_long_va=f'{-120 + site % 5300 / 100:.8f}',
+                insert_user=f'user{agency}@agency.gov', update_user=f'user{agency}@agency.gov',
+                altitude_units={'unit_id': 1}, well_depth_units={'unit_id': 1}))
+        yield json.loads(json.dumps(page))
+
+
+def measure(name, build, sites):
+    gc.collect()
+    tracemalloc.start()
+    registry = build(synthetic_pages(sites))
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'{name:>26}: {len(registry)} sites, held {current / 2 ** 20:8.1f} MiB, peak {peak / 2 ** 20:8.1f} MiB')
+
+
+def as_dicts(pages):
+    return [transform_mon_loc_data(ml_data) for page in pages for ml_data in page]
+
+
+def as_records(pages):
+    pool = InternPool()
+    return [MonitoringLocation.from_values(transform_mon_loc_values(ml_data), pool)
+            for page in pages for ml_data in page]
+
+
+def main(sites=500000):
+    measure('dicts', as_dicts, sites)
+    measure('interned slotted records', as_records, sites)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,32 @@
+"""
+Transforming a page of monitoring locations one record at a time into dicts
+against transform_page building one list per column, and the rows each produces for executemany.
+
+    python -m benchmarks.bench_transform_page
+"""
+import timeit
+
+from etl.test.fake_data import TEST_DATA
+from etl.transform import transform_mon_loc_data, transform_page
+
+
+def by_row(records):
+    return [tuple(transform_mon_loc_data(ml_data).values()) for ml_data in records]
+
+
+def by_page(records):
+    return list(transform_page(records).rows())
+
+
+def main(page_size=1000, pages=20, repeat=5):
+    records = [dict(TEST_DATA, site_no=f'CA-{site}', wl_well_type='Trend', qw_well_chars='Background')
+               for site in range(page_size)]
+    assert by_row(records) == by_page(records)
+    print(f'{pages} pages of {page_size} records, best of {repeat}')
+    for name, transform in (('per row dicts', by_row), ('column batch', by_page)):
+        best = min(timeit.repeat(lambda: [transform(records) for _ in range(pages)], number=1, repeat=repeat))
+        print(f'{name:>14}: {best * 1e6 / (page_size * pages):6.2f} us/record')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""
+Per record cost of transform_mon_loc_data as generated from FIELD_SPEC
+against the hand written mapping it replaced, copied here for comparison.
+The generated transform also parses the two timestamps, which the hand written one did not,
+so the hand written one is timed followed by date_format to do the same work.
+
+    python -m benchmarks.bench_transform_spec
+"""
+import timeit
+
+from etl.test.fake_data import TEST_DATA
+from etl.transform import transform_mon_loc_data, transform_mon_loc_values, to_flag, map_qw_well_chars, \
+    map_well_purpose, map_wl_well_chars, map_well_type, date_format
+
+
+def handwritten_transform(ml_data):
+    """
+    Map the fields from the API JSON response to
+    the fields in the WELL_REGISTRY_STG table with
+    appropriate foreign key values.
+    """
+    mapped_data = dict()
+
+    mapped_data['AGENCY_CD'] = ml_data['agency']['agency_cd']
+    mapped_data['AGENCY_NM'] = ml_data['agency']['agency_nm']
+    mapped_data['AGENCY_MED'] = ml_data['agency']['agency_med']
+
+    mapped_data['SITE_NO'] = ml_data['site_no']
+    mapped_data['SITE_NAME'] = ml_data['site_name']
+    mapped_data['DEC_LAT_VA'] = ml_data['dec_lat_va']
+    mapped_data['DEC_LONG_VA'] = ml_data['dec_long_va']
+    mapped_data['HORZ_DATUM'] = ml_data['horizontal_datum']
+    mapped_data['ALT_VA'] = ml_data['alt_va']
+    mapped_data['ALT_DATUM_CD'] = ml_data['altitude_datum']
+    try:
+        mapped_data['NAT_AQUIFER_CD'] = ml_data['nat_aqfr']['nat_aqfr_cd']
+        mapped_data['NAT_AQFR_DESC'] = ml_data['nat_aqfr']['nat_aqfr_desc']
+    except (AttributeError, KeyError, TypeError):
+        mapped_data['NAT_AQUIFER_CD'] = None
+        mapped_data['NAT_AQFR_DESC'] = None
+    mapped_data['LOCAL_AQUIFER_NAME'] = ml_data['local_aquifer_name']
+    mapped_data['AQFR_CHAR'] = ml_data['aqfr_type']
+    mapped_data['QW_SN_FLAG'] = to_flag(ml_data['qw_sn_flag'])
+    mapped_data['QW_BASELINE_FLAG'] = to_flag(ml_data['qw_baseline_flag'])
+    mapped_data['QW_WELL_CHARS'] = map_qw_well_chars(ml_data['qw_well_chars'])
+    mapped_data['QW_WELL_PURPOSE'] = map_well_purpose(ml_data['qw_well_purpose'])
+    mapped_data['QW_SYS_NAME'] = ml_data['qw_network_name']
+    mapped_data['WL_SN_FLAG'] = to_flag(ml_data['wl_sn_flag'])
+    mapped_data['WL_BASELINE_FLAG'] = to_flag(ml_data['wl_baseline_flag'])
+    mapped_data['WL_WELL_CHARS'] = map_wl_well_chars(ml_data['wl_well_chars'])
+    mapped_data['WL_WELL_PURPOSE'] = map_well_purpose(ml_data['wl_well_purpose'])
+    mapped_data['WL_SYS_NAME'] = ml_data['wl_network_name']
+    mapped_data['DATA_PROVIDER'] = None
+    mapped_data['DISPLAY_FLAG'] = to_flag(ml_data['display_flag'])
+    mapped_data['WL_DATA_PROVIDER'] = None
+    mapped_data['QW_DATA_PROVIDER'] = None
+    mapped_data['LITH_DATA_PROVIDER'] = None
+    mapped_data['CONST_DATA_PROVIDER'] = None
+    mapped_data['WELL_DEPTH'] = ml_data['well_depth']
+    mapped_data['LINK'] = ml_data['link']
+    mapped_data['INSERT_DATE'] = ml_data['insert_date']
+    mapped_data['UPDATE_DATE'] = ml_data['update_date']
+    mapped_data['WL_WELL_PURPOSE_NOTES'] = ml_data['wl_well_purpose_notes']
+    mapped_data['QW_WELL_PURPOSE_NOTES'] = ml_data['qw_well_purpose_notes']
+    mapped_data['INSERT_USER_ID'] = ml_data['insert_user']
+    mapped_data['UPDATE_USER_ID'] = ml_data['update_user']
+    mapped_data['WL_WELL_TYPE'] = map_well_type(ml_data['wl_well_type'])
+    mapped_data['QW_WELL_TYPE'] = map_well_type(ml_data['qw_well_type'])
+    mapped_data['LOCAL_AQUIFER_CD'] = None
+    mapped_data['REVIEW_FLAG'] = None
+    try:
+        mapped_data['STATE_CD'] = ml_data['state']['state_cd']
+    except (AttributeError, KeyError, TypeError):
+        mapped_data['STATE_CD'] = None
+    try:
+        mapped_data['COUNTY_CD'] = ml_data['county']['county_cd']
+    except (AttributeError, KeyError, TypeError):
+        mapped_data['COUNTY_CD'] = None
+    try:
+        mapped_data['COUNTRY_CD'] = ml_data['country']['country_cd']
+    except (AttributeError, KeyError, TypeError):
+        mapped_data['COUNTRY_CD'] = None
+    mapped_data['WELL_DEPTH_UNITS'] = ml_data['well_depth_units']['unit_id'] if ml_data['well_depth_units'] else None
+    mapped_data['ALT_UNITS'] = ml_data['altitude_units']['unit_id'] if ml_data['altitude_units'] else None
+    mapped_data['SITE_TYPE'] = ml_data['site_type']
+    mapped_data['HORZ_METHOD'] = ml_data['horz_method']
+    mapped_data['HORZ_ACY'] = ml_data['horz_acy']
+    mapped_data['ALT_METHOD'] = ml_data['alt_method']
+    mapped_data['ALT_ACY'] = ml_data['alt_acy']
+
+    return mapped_data
+
+
+
+def main(records=20000, repeat=5):
+    pages = [
+        [dict(TEST_DATA, site_no=f'CA-{site}', wl_well_type='Trend', qw_well_chars='Background')
+         for site in range(records)],
+        [dict(TEST_DATA, site_no=f'CA-{site}', nat_aqfr=None, state=None, county=None, country=None)
+         for site in range(records)],
+    ]
+    for page in pages:
+        # the generated transform also parses the timestamps, which the hand written one left as text
+        assert [date_format(handwritten_transform(ml_data)) for ml_data in page] == \
+            [transform_mon_loc_data(ml_data) for ml_data in page]
+    print(f'{records} records with every nested object, then {records} without, best of {repeat}')
+    for name, transform in (('hand written', lambda ml_data: date_format(handwritten_transform(ml_data))),
+                            ('generated dict', transform_mon_loc_data),
+                            ('generated tuple', transform_mon_loc_values)):
+        timings = [min(timeit.repeat(lambda: [transform(ml_data) for ml_data in page], number=1, repeat=repeat))
+                   for page in pages]
+        print(f'{name:>15}: ' + ', '.join(f'{best * 1e6 / records:5.2f}' for best in timings) + ' us/record')
+
+
+if __name__ == '__main__':
+    main()
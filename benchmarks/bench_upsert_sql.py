@@ -0,0 +1,73 @@
+"""
+Per row cost of building upsert statements: the literal SQL generator that load.py used to have
+against the cached templates that only produce bind values.
+
+    python -m benchmarks.bench_upsert_sql
+"""
+import timeit
+
+from etl.load import oracle_upsert_template, pg_upsert_template, pg_columns
+from etl.test.fake_data import TEST_DATA
+from etl.transform import transform_mon_loc_data
+
+
+def _manipulate_values(y, is_timestamp):
+    """
+    The literal value rendering load.py used before the templates, kept here for comparison.
+    """
+    try:
+        z = y.strip()
+    except AttributeError:
+        z = y
+    if is_timestamp:
+        return f"to_timestamp('{z}', 'YYYY-MM-DD\"T\"HH24:MI:SS.ff6\"Z\"')"
+    if z is None:
+        return 'NULL'
+    elif z is False:
+        return '0'
+    elif z is True:
+        return '1'
+    elif len(str(z)) == 0:
+        return "''"
+    else:
+        if isinstance(z, str):
+            z = z.translate(str.maketrans({"'": "''"}))
+        return f"'{z}'"
+
+
+def legacy_upsert_sql(mon_loc):
+    mon_loc_db = [(k, _manipulate_values(v, k in ['INSERT_DATE', 'UPDATE_DATE'])) for k, v in mon_loc.items()]
+    all_columns = ','.join(col for (col, _) in mon_loc_db)
+    all_values = ','.join(value for (_, value) in mon_loc_db)
+    update_query = ','.join(f"{k}={v}" for (k, v) in mon_loc_db if k not in ['AGENCY_CD', 'SITE_NO'])
+    return (
+        f"MERGE INTO GW_DATA_PORTAL.WELL_REGISTRY_STG a "
+        f"USING (SELECT '{mon_loc['AGENCY_CD']}' AGENCY_CD, '{mon_loc['SITE_NO']}' "
+        f"SITE_NO FROM DUAL) b ON (a.AGENCY_CD = b.AGENCY_CD AND a.SITE_NO = b.SITE_NO) "
+        f"WHEN MATCHED THEN UPDATE SET {update_query} "
+        f"WHEN NOT MATCHED THEN INSERT ({all_columns}) VALUES ({all_values})"
+    )
+
+
+def templated_oracle(mon_loc):
+    template = oracle_upsert_template(tuple(mon_loc.keys()))
+    return template.statement, template.binds(mon_loc)
+
+
+def templated_pg(mon_loc):
+    template = pg_upsert_template(pg_columns(mon_loc))
+    return template.execute_prepared, template.binds(mon_loc)
+
+
+def main(rows=10000, repeat=5):
+    mon_locs = [dict(transform_mon_loc_data(TEST_DATA), SITE_NO=f'CA-{site}') for site in range(rows)]
+    print(f'{rows} rows, best of {repeat}')
+    for name, build in (('literal SQL', legacy_upsert_sql),
+                        ('Oracle template', templated_oracle),
+                        ('PostGIS template', templated_pg)):
+        best = min(timeit.repeat(lambda: [build(mon_loc) for mon_loc in mon_locs], number=1, repeat=repeat))
+        print(f'{name:>16}: {best * 1e6 / rows:8.2f} us/row')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+"""
+Functions to retrieve data from the Well Registry API on an asyncio event loop
+"""
+
+import asyncio
+import json
+import logging
+
+from collections import deque
+from json.decoder import JSONDecodeError
+from time import monotonic
+
+import aiohttp
+from requests import Response
+from requests.exceptions import RequestException
+from requests.exceptions import HTTPError
+
+from .extract import Extract, FetchAttempts
+
+
+class AsyncExtract(Extract):
+    """
+    Extract counterpart that keeps up to FETCH_WORKERS page requests in flight on a single event loop.
+    Network, status code and JSON errors are reported with the same exceptions and tolerances as Extract.
+    The adaptive page size and the response cache of Extract are not supported.
+    """
+    def __init__(self):
+        Extract.__init__(self)
+        """Number of page requests kept in flight at once."""
+        self.FETCH_WORKERS = 16
+
+    async def get_monitoring_locations(self, registry_ml_endpoint):
+        """
+        Get the monitoring location data.
+        """
+        results = []
+        try:
+            async for page in self.aiter_pages(registry_ml_endpoint):
+                results.extend(page)
+        except RequestException:
+            return []
+
+        logging.info(f'Finished retrieving {len(results)} monitoring locations.')
+        return results
+
+    def iter_pages(self, registry_ml_endpoint):
+        """
+        Yield the pages from synchronous code by driving aiter_pages on a private event loop.
+        Requests already in flight progress whenever the next page is awaited.
+        """
+        loop = asyncio.new_event_loop()
+        pages = self.aiter_pages(registry_ml_endpoint)
+        try:
+            while True:
+                try:
+                    yield loop.run_until_complete(pages.__anext__())
+                except StopAsyncIteration:
+                    break
+        finally:
+            loop.run_until_complete(pages.aclose())
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            loop.close()
+
+    async def aiter_pages(self, registry_ml_endpoint):
+        """
+        Yield the monitoring location data one page of records at a time, in offset order.
+        The first page supplies the registry count used to plan the offsets of all the other pages.
+        Raises RequestException when a page cannot be fetched; the pages already yielded are still valid.
+        """
+        if self.FETCH_LIMIT_ADAPTIVE:
+            logging.warning('The adaptive page size does not apply to the async fetch engine.')
+        if self.FETCH_CACHE_DIR is not None:
+            logging.warning('The response cache does not apply to the async fetch engine.')
+        url = self.construct_url(registry_ml_endpoint)
+
+        async with self.session() as session:
+            logging.info(f'Retrieving monitoring locations: {url}')
+            try:
+                payload = await self.fetch_record_block(url, session)
+            except RequestException:
+                logging.error(f'Unrecoverable error fetching data from {url}')
+                raise
+
+            total = payload.get('count')
+            count = len(payload.get('results'))
+            yield payload.get('results')
+
+            urls = []
+            # the offsets are planned only while the registry returns whole pages
+            if payload.get('next') is not None and payload.get('next') != '' and total is not None \
+                    and count >= self.FETCH_LIMIT:
+                while len(urls) * self.FETCH_LIMIT + self.FETCH_LIMIT < total:
+                    url = self.construct_url(url)
+                    urls.append(url)
+                logging.info(f'Fetching {len(urls)} more pages of {total} monitoring locations '
+                             f'with {self.FETCH_WORKERS} requests in flight.')
+
+            json_fail_count = 0
+            pending = deque()
+            try:
+                for fetches, page_url in enumerate(urls, 1):
+                    pending.append((page_url, asyncio.ensure_future(self.fetch_record_block(page_url, session))))
+                    if fetches % self.FETCHES_PER_LOG == 0:
+                        logging.info(f'Retrieving monitoring locations: {page_url}')
+                    if len(pending) >= max(self.FETCH_WORKERS, 1):
+                        page_url, task = pending.popleft()
+                        payload, json_fail_count = await self._page_result(page_url, task, json_fail_count)
+                        count += len(payload.get('results', []))
+                        yield payload.get('results', [])
+                while pending:
+                    page_url, task = pending.popleft()
+                    payload, json_fail_count = await self._page_result(page_url, task, json_fail_count)
+                    count += len(payload.get('results', []))
+                    yield payload.get('results', [])
+            finally:
+                for _, task in pending:
+                    task.cancel()
+
+            # follow the offsets serially when there was no count, the registry caps the page size
+            # or the registry grew during extraction
+            while payload.get('next') is not None and payload.get('next') != '':
+                url = self.construct_url(url, None, self.next_offset(url, payload))
+                if count % (self.FETCHES_PER_LOG * self.FETCH_LIMIT) == 0:
+                    logging.info(f'Retrieving monitoring locations: {url}')
+                task = asyncio.ensure_future(self.fetch_record_block(url, session))
+                payload, json_fail_count = await self._page_result(url, task, json_fail_count)
+                if 'next' not in payload:
+                    payload['next'] = self.construct_url(url)  # an undecodable page does not end the registry
+                count += len(payload.get('results', []))
+                yield payload.get('results', [])
+
+        logging.info(f'Finished streaming {count} monitoring locations.')
+        logging.info(self.retry_policy().summary())
+
+    async def _page_result(self, url, task, json_fail_count):
+        """
+        Wait for a page request, applying the same JSON tolerance as the serial extraction.
+        A page that could not be decoded within tolerance is returned as an empty page.
+        """
+        try:
+            return await task, json_fail_count
+        except JSONDecodeError as json_err:
+            return {'results': []}, self.tolerate_json_error(json_err, json_fail_count)
+        except RequestException:
+            logging.error(f'Unrecoverable error fetching data from {url}')
+            raise
+
+    def session(self):
+        """
+        Helper method that facilitates IoC.
+        The connector allows every request in flight to hold its own connection.
+        """
+        connector = aiohttp.TCPConnector(limit=max(self.FETCH_WORKERS, 1))
+        if self.FETCH_METRICS is None:
+            return aiohttp.ClientSession(connector=connector)
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_response_chunk_received.append(self._record_chunk)
+        return aiohttp.ClientSession(connector=connector, trace_configs=[trace_config])
+
+    async def _record_chunk(self, session, context, params):
+        self.FETCH_METRICS.record_bytes(len(params.chunk))
+
+    async def fetch_record_block(self, url, session):
+        attempts = FetchAttempts(self, url)
+        while True:
+            # if this is a retry then pause for a delay to see if it recovers
+            delay = attempts.delay()
+            if delay is not None:
+                await asyncio.sleep(delay)
+                self.retry_policy().slept(delay)
+            try:
+                payload = await self.timed_fetch(url, session)
+            except (RequestException, JSONDecodeError) as err:
+                attempts.failed(err)
+                continue
+            return attempts.succeeded(payload)
+
+    async def timed_fetch(self, url, session):
+        """
+        try_fetch, recording the latency and outcome of the request when there are FETCH_METRICS.
+        """
+        if self.FETCH_METRICS is None:
+            return await self.try_fetch(url, session)
+        started = monotonic()
+        try:
+            payload = await self.try_fetch(url, session)
+        except Exception as err:
+            self.FETCH_METRICS.record(monotonic() - started, err)
+            raise
+        self.FETCH_METRICS.record(monotonic() - started)
+        return payload
+
+    @staticmethod
+    async def try_fetch(url, session):
+        """
+        Fetch and decode one page, translating aiohttp failures into the requests exceptions Extract handles.
+        """
+        try:
+            async with session.get(url) as response:
+                # status codes above 203 are reduced content status codes - that is bad
+                if response.status >= 204:  # trap bad status code
+                    raise HTTPError(f'{response.status} Error for url: {url}', response=_status_response(response))
+                text = await response.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+            raise RequestException(str(err))
+
+        # the JSONDecodeError from loads already carries the response text as its doc
+        return json.loads(text)
+
+
+def _status_response(response):
+    """
+    Describe an aiohttp response as a requests Response so that error handling can inspect it.
+    """
+    status_response = Response()
+    status_response.status_code = response.status
+    status_response.headers.update(response.headers)
+    status_response.url = str(response.url)
+    return status_response
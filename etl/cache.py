@@ -0,0 +1,206 @@
+"""
+On disk cache of Well Registry API responses, revalidated with conditional requests
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from collections import OrderedDict
+
+from requests import Response, Session
+from requests.structures import CaseInsensitiveDict
+
+
+class ResponseCache:
+    """
+    Response bodies stored in a directory with their ETag and Last-Modified validators.
+    The directory is kept below max_bytes by evicting the least recently used entries.
+    Responses without validators are only stored when a TTL is configured, and are then fresh for ttl seconds.
+    """
+    BODY = '.body'
+    META = '.json'
+
+    def __init__(self, directory, max_bytes, ttl=None, clock=time.time):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.evicted = 0
+        os.makedirs(directory, exist_ok=True)
+        self.entries = self._scan()
+
+    def _scan(self):
+        """
+        Index the entries left by earlier runs, least recently used first.
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(self.BODY):
+                path = os.path.join(self.directory, name)
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, name[:-len(self.BODY)], stat.st_size))
+        return OrderedDict((key, size) for _, key, size in sorted(entries))
+
+    @staticmethod
+    def key(url):
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+    def _path(self, key, suffix):
+        return os.path.join(self.directory, key + suffix)
+
+    def get(self, url):
+        """
+        The cached (body, meta) for the URL, or None. A hit makes the entry the most recently used.
+        """
+        key = self.key(url)
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+        try:
+            with open(self._path(key, self.META), 'r') as meta_file:
+                meta = json.load(meta_file)
+            with open(self._path(key, self.BODY), 'rb') as body_file:
+                body = body_file.read()
+            os.utime(self._path(key, self.BODY))
+        except (OSError, ValueError):
+            self._remove(key)
+            return None
+        if meta.get('url') != url:  # a hash collision is served as a miss
+            return None
+        return body, meta
+
+    def is_fresh(self, meta):
+        """
+        True when an entry without validators is younger than the TTL and may be used without asking the server.
+        """
+        return self.ttl is not None and not meta.get('etag') and not meta.get('last_modified') \
+            and self.clock() - meta.get('stored_at', 0) < self.ttl
+
+    def put(self, url, response):
+        """
+        Store a successful response when it can be revalidated or a TTL applies.
+        """
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if etag is None and last_modified is None and self.ttl is None:
+            return
+        meta = {
+            'url': url,
+            'etag': etag,
+            'last_modified': last_modified,
+            'stored_at': self.clock(),
+            'encoding': response.encoding,
+            'content_type': response.headers.get('Content-Type'),
+        }
+        key = self.key(url)
+        body = response.content
+        self._write(self._path(key, self.BODY), body)
+        self._write(self._path(key, self.META), json.dumps(meta).encode('utf-8'))
+        with self.lock:
+            self.entries[key] = len(body)
+            self.entries.move_to_end(key)
+            evict = []
+            total = sum(self.entries.values())
+            while total > self.max_bytes and len(self.entries) > 1:
+                old_key, size = self.entries.popitem(last=False)
+                evict.append(old_key)
+                total -= size
+            self.evicted += len(evict)
+        for old_key in evict:
+            self._remove(old_key)
+
+    def _write(self, path, data):
+        """
+        Replace the file in one step so that concurrent readers never see a partial body.
+        """
+        handle, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(handle, 'wb') as temp_file:
+            temp_file.write(data)
+        os.replace(temp_path, path)
+
+    def _remove(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+        for suffix in (self.BODY, self.META):
+            try:
+                os.remove(self._path(key, suffix))
+            except OSError:
+                pass
+
+    def count(self, outcome):
+        with self.lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+
+    def summary(self):
+        return f'Response cache hits: {self.hits}, not modified: {self.revalidated}, ' \
+               f'misses: {self.misses}, evicted: {self.evicted}'
+
+
+class CachingSession(Session):
+    """
+    Session that answers GET requests from a ResponseCache.
+    Cached entries are sent back to the server with If-None-Match/If-Modified-Since,
+    and a 304 Not Modified is answered with the body from disk.
+    """
+    def __init__(self, cache):
+        Session.__init__(self)
+        self.cache = cache
+
+    def send(self, request, **kwargs):
+        if request.method != 'GET':
+            return Session.send(self, request, **kwargs)
+
+        cached = self.cache.get(request.url)
+        if cached is not None:
+            body, meta = cached
+            if self.cache.is_fresh(meta):
+                self.cache.count('hits')
+                return _cached_response(request, body, meta)
+            if meta.get('etag'):
+                request.headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                request.headers['If-Modified-Since'] = meta['last_modified']
+
+        response = Session.send(self, request, **kwargs)
+
+        if response.status_code == 304 and cached is not None:
+            self.cache.count('revalidated')
+            response.close()
+            return _cached_response(request, *cached)
+        self.cache.count('misses')
+        if response.status_code == 200:
+            self.cache.put(request.url, response)
+        return response
+
+    def close(self):
+        logging.info(self.cache.summary())
+        Session.close(self)
+
+
+def _cached_response(request, body, meta):
+    """
+    Build the response the server would have sent from a cache entry.
+    """
+    response = Response()
+    response.status_code = 200
+    response.reason = 'OK'
+    response._content = body  # pylint: disable=protected-access
+    response.encoding = meta.get('encoding')
+    response.headers = CaseInsensitiveDict()
+    for header, name in (('Content-Type', 'content_type'), ('ETag', 'etag'), ('Last-Modified', 'last_modified')):
+        if meta.get(name):
+            response.headers[header] = meta[name]
+    response.url = request.url
+    response.request = request
+    response.from_cache = True
+    return response
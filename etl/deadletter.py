@@ -0,0 +1,106 @@
+"""
+Local file of the transformed monitoring locations a run could not load, for replaying them later
+"""
+
+import json
+import logging
+import os
+import tempfile
+
+from datetime import datetime
+
+from .partition import RemoteLoadError
+from .transform import date_format
+
+
+def error_class(error):
+    """
+    Name of the class of an error, also for errors raised in a load worker process.
+    """
+    return getattr(error, 'error_class', type(error).__name__)
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def write_dead_letters(path, letters):
+    """
+    Replace the dead letter file with one JSON line per (sink name, row, error), the error given by its class
+    and message. An empty file is still written, so the file always holds the failures still outstanding.
+    Returns the number of rows written.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    handle, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    count = 0
+    with os.fdopen(handle, 'w') as temp_file:
+        for sink_name, mon_loc, error in letters:
+            message = error.message if isinstance(error, RemoteLoadError) else str(error)
+            temp_file.write(json.dumps({'sink': sink_name, 'error_class': error_class(error), 'error': message,
+                                        'row': dict(mon_loc)}, default=_encode))
+            temp_file.write('\n')
+            count += 1
+    os.replace(temp_path, path)
+    logging.info(f'Wrote {count} failed monitoring locations to {path}')
+    return count
+
+
+def read_dead_letters(path):
+    """
+    The (sink name, row, error) of every line of a dead letter file, with the timestamps of the rows
+    as datetimes again and the error rebuilt as a RemoteLoadError. Unreadable lines are skipped with a warning.
+    """
+    letters = []
+    with open(path, 'r') as dead_letter_file:
+        for number, line in enumerate(dead_letter_file, 1):
+            if not line.strip():
+                continue
+            try:
+                letter = json.loads(line)
+                letters.append((letter['sink'], date_format(letter['row']),
+                                RemoteLoadError(letter['error_class'], letter['error'])))
+            except (ValueError, KeyError, TypeError) as err:
+                logging.warning(f'Skipping unreadable line {number} of {path}: {err}')
+    return letters
+
+
+def carry_over_dead_letters(letters, sinks):
+    """
+    The letters of an earlier run that a run without replay must keep: those of databases it did not load
+    and those of rows it neither loaded nor failed again, a new failure replacing the old letter.
+    """
+    by_name = {sink.name: sink for sink in sinks}
+    kept = []
+    for sink_name, mon_loc, error in letters:
+        sink = by_name.get(sink_name)
+        key = (mon_loc['AGENCY_CD'], mon_loc['SITE_NO'])
+        if sink is None or (key not in sink.touched and key not in sink.failed_rows):
+            kept.append((sink_name, mon_loc, error))
+    if kept:
+        logging.info(f'Kept {len(kept)} dead letters of earlier runs not loaded again')
+    return kept
+
+
+def replay_dead_letters(letters, sinks, fingerprint=None):
+    """
+    Load the rows of dead letters again, each into the sink that failed it, and wait for the sinks to finish,
+    refreshing their materialized views. Returns the letters of sinks that are not among sinks, left as they are.
+    """
+    by_name = {sink.name: sink for sink in sinks}
+    for sink in sinks:
+        sink.start()
+    try:
+        for sink_name, mon_loc, _ in letters:
+            if sink_name in by_name:
+                by_name[sink_name].put(mon_loc, None if fingerprint is None else fingerprint(mon_loc))
+    finally:
+        for sink in sinks:
+            sink.close()
+        for sink in sinks:
+            sink.join()
+    kept = [letter for letter in letters if letter[0] not in by_name]
+    if kept:
+        logging.warning(f'Kept {len(kept)} dead letters of databases not loaded in this run')
+    return kept
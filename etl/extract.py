@@ -4,12 +4,18 @@ Functions to retrieve data from the Well Registry API
 
 import logging
 
-from time import sleep
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
 from json.decoder import JSONDecodeError
 from requests import Session
+from requests.adapters import HTTPAdapter
 from requests.exceptions import RequestException
 from requests.exceptions import HTTPError
 
+from .cache import CachingSession, ResponseCache
+from .retry import ExponentialBackoff
+
 
 class Extract:
     def __init__(self):
@@ -21,114 +27,286 @@ class Extract:
         self.FETCH_TRIES_FOR_STATUS_CODE = 2
         """Number of times to retry when there is the JSON fails to decode."""
         self.FETCH_TRIES_FOR_JSON = 2
+        """Number of times to try a request the registry answers with 429 Too Many Requests."""
+        self.FETCH_TRIES_FOR_RATE_LIMIT = 5
         """Number of times to accept a missing data for aborting the ETL."""
         self.FETCH_JSON_ERROR_TOLERANCE = 2
-        """Number of seconds to wait before a retry is attempted."""
+        """Number of seconds to wait before a retry is attempted, doubled for each further retry with full jitter."""
         self.FETCH_RETRY_DELAY = 10
+        """Largest number of seconds to wait before a retry, including waits asked for by Retry-After."""
+        self.FETCH_RETRY_MAX_DELAY = 120
+        """Number of retries allowed for all requests of the run together."""
+        self.FETCH_RETRY_BUDGET = 100
+        """Retry policy shared by all requests, None builds an ExponentialBackoff from the settings above."""
+        self.FETCH_RETRY_POLICY = None
+        """Directory of the on disk response cache, None fetches every page from the registry."""
+        self.FETCH_CACHE_DIR = None
+        """Largest number of bytes of response bodies kept in the cache directory."""
+        self.FETCH_CACHE_MAX_BYTES = 256 * 1024 * 1024
+        """Seconds a cached response without ETag or Last-Modified is used without asking the registry."""
+        self.FETCH_CACHE_TTL = None
         """Number of fetches per info log."""
         self.FETCHES_PER_LOG = 128
+        """Number of pages to fetch concurrently, 1 fetches the pages one after another."""
+        self.FETCH_WORKERS = 1
+        """Tune the number of records per request while fetching pages one after another."""
+        self.FETCH_LIMIT_ADAPTIVE = False
+        """Smallest number of records per request the adaptive page size may choose."""
+        self.FETCH_LIMIT_MIN = 8
+        """Largest number of records per request the adaptive page size may choose."""
+        self.FETCH_LIMIT_MAX = 1024
+        """Number of seconds the adaptive page size aims for each request to take."""
+        self.FETCH_TARGET_SECONDS = 2.0
+        """Largest response body in bytes the adaptive page size aims for."""
+        self.FETCH_MAX_PAGE_BYTES = 4 * 1024 * 1024
+        """RequestMetrics every request to the registry is recorded in, None records nothing."""
+        self.FETCH_METRICS = None
 
     def get_monitoring_locations(self, registry_ml_endpoint):
         """
         Get the monitoring location data.
         """
-        # initialize state of errors, URL, and results
+        results = []
+        try:
+            for page in self.iter_pages(registry_ml_endpoint):
+                results.extend(page)
+        except RequestException:
+            return []
+
+        logging.info(f'Finished retrieving {len(results)} monitoring locations.')
+        return results
+
+    def iter_monitoring_locations(self, registry_ml_endpoint):
+        """
+        Yield the monitoring location data one record at a time, fetching pages as they are needed.
+        """
+        for page in self.iter_pages(registry_ml_endpoint):
+            yield from page
+
+    def iter_pages(self, registry_ml_endpoint):
+        """
+        Yield the monitoring location data one page of records at a time, as soon as each page is decoded.
+        Pages are fetched concurrently when FETCH_WORKERS is more than one; either way they arrive in offset order.
+        Raises RequestException when a page cannot be fetched; the pages already yielded are still valid.
+        """
+        if self.FETCH_WORKERS > 1:
+            if self.FETCH_LIMIT_ADAPTIVE:
+                logging.warning('The adaptive page size only applies when FETCH_WORKERS is 1.')
+            return self.iter_pages_parallel(registry_ml_endpoint)
+        return self.iter_pages_serial(registry_ml_endpoint)
+
+    def iter_pages_serial(self, registry_ml_endpoint, session=None, offset=None):
+        """
+        Yield the pages one after another, following the offsets until the registry reports no next page.
+        An endpoint that already carries an offset resumes with the page after it on the given open session,
+        at the given offset of that page when it is known.
+        Each offset is the one next_offset finds, so no records are skipped when the registry caps the page size.
+        """
+        # initialize state of errors, URL, and record count
         json_fail_count = 0
         fetches = 0
-        url = self.construct_url(registry_ml_endpoint)
-        results = []
+        count = 0
+        tuner = self.page_size_tuner() if self.FETCH_LIMIT_ADAPTIVE else None
+        url = self.construct_url(registry_ml_endpoint, tuner.limit if tuner else None, offset)
+        session_owned = session is None
 
-        with self.session() as session:
+        with self.session() if session is None else _Borrowed(session) as session:
+            if tuner is not None and hasattr(session, 'hooks'):
+                session.hooks['response'].append(tuner.record_response)
             while url:
                 if fetches % self.FETCHES_PER_LOG == 0:
                     logging.info(f'Retrieving monitoring locations: {url}')
+                next_limit = None
+                offset = None
                 try:
                     fetches += 1
+                    started = monotonic()
                     payload = self.fetch_record_block(url, session)
-                    results.extend(payload.get('results'))
-                    if payload.get('next') is None or payload.get('next') == '':
+                    page = payload.get('results')
+                    more = payload.get('next') is not None and payload.get('next') != ''
+                    if tuner is not None:
+                        next_limit = tuner.observe(monotonic() - started, len(page), more)
+                    count += len(page)
+                    yield page
+                    if not more:
                         break
+                    offset = self.next_offset(url, payload)
                 except JSONDecodeError as json_err:
-                    json_fail_count += 1
-                    if json_fail_count >= self.FETCH_JSON_ERROR_TOLERANCE:
-                        logging.error('Abort: JSON errors exceeded. Set FETCH_JSON_ERROR_TOLERANCE to fine tune.')
-                        raise JSONDecodeError('JSON errors exceeded.', json_err.doc, json_err.pos)
-                    else:
-                        logging.warning(
-                            f'JSON error occurred, {self.FETCH_JSON_ERROR_TOLERANCE-json_fail_count} before abort.')
-                except RequestException:
+                    json_fail_count = self.tolerate_json_error(json_err, json_fail_count)
+                except RequestException as re:
+                    if tuner is not None and tuner.is_overload(re) and tuner.back_off():
+                        # ask for the same offset again with fewer records
+                        url = self.replace_limit(url, tuner.limit)
+                        continue
                     logging.error(f'Unrecoverable error fetching data from {url}')
-                    return []
+                    raise
+                url = self.construct_url(url, next_limit, offset)
+
+        if tuner is not None:
+            logging.info(f'Adaptive page sizes used (records per request x requests): {tuner.summary()}')
+        logging.info(f'Finished streaming {count} monitoring locations.')
+        if session_owned:
+            logging.info(self.retry_policy().summary())
+
+    def iter_pages_parallel(self, registry_ml_endpoint):
+        """
+        Yield the pages in offset order while FETCH_WORKERS threads fetch the pages ahead of them.
+        The first page supplies the registry count used to plan the offsets of all the other pages.
+        Each page keeps the retry behavior of fetch_record_block and all threads share one pooled session.
+        When the registry returns fewer records than FETCH_LIMIT the offsets cannot be planned,
+        so the pages are fetched serially.
+        """
+        url = self.construct_url(registry_ml_endpoint)
+
+        with self.session() as session:
+            logging.info(f'Retrieving monitoring locations: {url}')
+            try:
+                payload = self.fetch_record_block(url, session)
+            except RequestException:
+                logging.error(f'Unrecoverable error fetching data from {url}')
+                raise
+
+            total = payload.get('count')
+            records = len(payload.get('results'))
+            yield payload.get('results')
+            if payload.get('next') is None or payload.get('next') == '':
+                return
+            if total is None:
+                logging.warning('The registry did not report a count, fetching the remaining pages serially.')
+                yield from self.iter_pages_serial(url, session, self.next_offset(url, payload))
+                return
+            if records < self.FETCH_LIMIT:
+                logging.warning(f'The registry caps pages at {records} records, fetching the remaining pages serially.')
+                yield from self.iter_pages_serial(url, session, self.next_offset(url, payload))
+                return
+
+            urls = []
+            while len(urls) * self.FETCH_LIMIT + self.FETCH_LIMIT < total:
                 url = self.construct_url(url)
+                urls.append(url)
+            logging.info(f'Fetching {len(urls)} more pages of {total} monitoring locations '
+                         f'with {self.FETCH_WORKERS} workers.')
 
-        logging.info(f'Finished retrieving {len(results)} monitoring locations.')
-        return results
+            json_fail_count = 0
+            count = len(payload.get('results'))
+            pending = deque()
+            with ThreadPoolExecutor(max_workers=self.FETCH_WORKERS) as executor:
+                try:
+                    for fetches, page_url in enumerate(urls, 1):
+                        # keep a bounded window of pages in flight so memory stays flat
+                        pending.append((page_url, executor.submit(self.fetch_record_block, page_url, session)))
+                        if fetches % self.FETCHES_PER_LOG == 0:
+                            logging.info(f'Retrieving monitoring locations: {page_url}')
+                        if len(pending) >= 2 * self.FETCH_WORKERS:
+                            page_url, future = pending.popleft()
+                            payload, json_fail_count = self._page_result(page_url, future, json_fail_count)
+                            count += len(payload.get('results', []))
+                            yield payload.get('results', [])
+                    while pending:
+                        page_url, future = pending.popleft()
+                        payload, json_fail_count = self._page_result(page_url, future, json_fail_count)
+                        count += len(payload.get('results', []))
+                        yield payload.get('results', [])
+                finally:
+                    for _, future in pending:
+                        future.cancel()
+
+            # records added to the registry after the count was taken are picked up serially
+            if payload.get('next') is not None and payload.get('next') != '':
+                logging.info('The registry grew during extraction, fetching the remaining pages serially.')
+                for page in self.iter_pages_serial(url, session, self.next_offset(url, payload)):
+                    count += len(page)
+                    yield page
+
+        logging.info(f'Finished streaming {count} monitoring locations.')
+        logging.info(self.retry_policy().summary())
+
+    def _page_result(self, url, future, json_fail_count):
+        """
+        Wait for a page fetched by a worker, applying the same JSON tolerance as the serial extraction.
+        A page that could not be decoded within tolerance is returned as an empty page.
+        """
+        try:
+            return future.result(), json_fail_count
+        except JSONDecodeError as json_err:
+            return {'results': []}, self.tolerate_json_error(json_err, json_fail_count)
+        except RequestException:
+            logging.error(f'Unrecoverable error fetching data from {url}')
+            raise
+
+    def tolerate_json_error(self, json_err, json_fail_count):
+        """
+        Count a page that could not be decoded, aborting when FETCH_JSON_ERROR_TOLERANCE is reached.
+        """
+        json_fail_count += 1
+        if json_fail_count >= self.FETCH_JSON_ERROR_TOLERANCE:
+            logging.error('Abort: JSON errors exceeded. Set FETCH_JSON_ERROR_TOLERANCE to fine tune.')
+            raise JSONDecodeError('JSON errors exceeded.', json_err.doc, json_err.pos)
+        logging.warning(f'JSON error occurred, {self.FETCH_JSON_ERROR_TOLERANCE-json_fail_count} before abort.')
+        return json_fail_count
 
-    # noinspection PyMethodMayBeStatic
-    # pylint: disable=no-self-use
     def session(self):
         """
         Helper method that facilitates IoC.
-        Self-Use warning is disabled because an instance method is required to perform IoC.
+        The connection pool is sized so that every fetch worker can keep its own connection alive.
+        With a cache directory the session answers from the response cache whenever the registry allows it.
+        """
+        if self.FETCH_CACHE_DIR is None:
+            session = Session()
+        else:
+            session = CachingSession(
+                ResponseCache(self.FETCH_CACHE_DIR, self.FETCH_CACHE_MAX_BYTES, self.FETCH_CACHE_TTL))
+        if self.FETCH_WORKERS > 1:
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.FETCH_WORKERS)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+        if self.FETCH_METRICS is not None:
+            session.hooks['response'].append(self.FETCH_METRICS.record_response)
+        return session
+
+    def retry_policy(self):
+        """
+        The retry policy of the run, built on first use so that its settings can be changed until then.
         """
-        return Session()
+        if self.FETCH_RETRY_POLICY is None:
+            self.FETCH_RETRY_POLICY = ExponentialBackoff(
+                self.FETCH_RETRY_DELAY, self.FETCH_RETRY_MAX_DELAY, self.FETCH_RETRY_BUDGET)
+        return self.FETCH_RETRY_POLICY
+
+    def page_size_tuner(self):
+        """
+        Helper method that facilitates IoC for the adaptive page size.
+        """
+        return PageSizeTuner(self.FETCH_LIMIT, self.FETCH_LIMIT_MIN, self.FETCH_LIMIT_MAX,
+                             self.FETCH_TARGET_SECONDS, self.FETCH_MAX_PAGE_BYTES)
 
     def fetch_record_block(self, url, session):
-        attempt_count_net = 1
-        attempt_count_status = 1
-        attempt_count_json = 1
-        attempts_remain = True
-        recent_json_error = None
-        payload = None
-
-        while attempts_remain:
+        attempts = FetchAttempts(self, url)
+        while True:
             # if this is a retry then pause for a delay to see if it recovers
-            if attempt_count_net + attempt_count_status + attempt_count_json > 3:
-                logging.warning(f'Retrying request in {self.FETCH_RETRY_DELAY} seconds')
-                sleep(self.FETCH_RETRY_DELAY)
-
+            delay = attempts.delay()
+            if delay is not None:
+                self.retry_policy().sleep(delay)
             try:
-                payload = self.try_fetch(url, session)
-                attempts_remain = False  # indicate that we are done
-            except HTTPError as se:  # trap http status error before the more general RequestException
-                attempt_count_status += 1
-                logging.warning(f'HTTP status code, {se.response.status_code}, from URL: {url}')
-            except RequestException as re:  # trap network issues
-                attempt_count_net += 1
-                if re.response is None:
-                    logging.warning(f'No response entity from URL: {url}')
-                else:
-                    logging.warning(f'Exception requesting URL: {url}')
-            except JSONDecodeError as json_err:  # trap JSON parsing errors
-                recent_json_error = json_err
-                attempt_count_json += 1
-                logging.warning(f'JSON parsing error in response from: {url}')
-                logging.warning(json_err)
-                logging.warning(json_err.doc)
-
-            # exit loop if done/success or too many tries of any type
-            attempts_remain &= attempt_count_net <= self.FETCH_TRIES_FOR_NETWORK_ERROR \
-                and attempt_count_status <= self.FETCH_TRIES_FOR_STATUS_CODE \
-                and attempt_count_json <= self.FETCH_TRIES_FOR_JSON
-
-        # allow for the caller to know how often the JSON was bad
-        if attempt_count_json > self.FETCH_TRIES_FOR_JSON:
-            doc = recent_json_error.doc if recent_json_error is not None else ''
-            pos = recent_json_error.pos if recent_json_error is not None else 0
-            raise JSONDecodeError("Exceeded JSON Tries.", doc, pos)
-
-        if attempt_count_net > self.FETCH_TRIES_FOR_NETWORK_ERROR \
-                or attempt_count_status > self.FETCH_TRIES_FOR_STATUS_CODE:
-            logging.warning('Retrying failed')
-            raise RequestException()
-
-        if payload is None:  # ideally we should not raise this exception
-            raise ValueError("Response was never set and this should not happen.")
-
-        # if this is a retry then pause for a delay to see if it recovers
-        if attempt_count_net + attempt_count_status + attempt_count_json > 3:
-            logging.info('Retrying succeeded')
+                payload = self.timed_fetch(url, session)
+            except (RequestException, JSONDecodeError) as err:
+                attempts.failed(err)
+                continue
+            return attempts.succeeded(payload)
 
+    def timed_fetch(self, url, session):
+        """
+        try_fetch, recording the latency and outcome of the request when there are FETCH_METRICS.
+        """
+        if self.FETCH_METRICS is None:
+            return self.try_fetch(url, session)
+        started = monotonic()
+        try:
+            payload = self.try_fetch(url, session)
+        except Exception as err:
+            self.FETCH_METRICS.record(monotonic() - started, err)
+            raise
+        self.FETCH_METRICS.record(monotonic() - started)
         return payload
 
     @staticmethod
@@ -151,9 +329,12 @@ class Extract:
 
         return json
 
-    def construct_url(self, endpoint):
+    def construct_url(self, endpoint, limit=None, offset=None):
         """
         Construct the URL with a smaller limit than the 1024 default.
+        The offset becomes the given one, when given, or advances by the limit the given URL asked for.
+        A new limit, when given, only applies to the constructed URL so the offsets stay contiguous
+        as the page size changes.
         """
         url = endpoint
 
@@ -162,18 +343,236 @@ class Extract:
                 url += '?'
             else:
                 url += '&'
-            url += 'limit=' + str(self.FETCH_LIMIT)
+            url += 'limit=' + str(self.FETCH_LIMIT if limit is None else limit)
+            limit = None
 
-        offset = 'offset'
-        if offset in url:
-            start = url.index(offset) + len(offset) + 1
-            try:
-                end = url.index('&', start)
-            except ValueError:
-                end = len(url)
-            offset_num = int(url[start:end]) + self.FETCH_LIMIT
+        if 'offset' in url:
+            start, end = _query_value_span(url, 'offset')
+            offset_num = (int(url[start:end]) + _current_limit(url, self.FETCH_LIMIT)) if offset is None else offset
             url = url[:start] + str(offset_num) + url[end:len(url)]
         else:
             url += '&offset=0'
 
+        if limit is not None:
+            url = self.replace_limit(url, limit)
+
         return url
+
+    @staticmethod
+    def next_offset(url, payload):
+        """
+        Offset of the page after the page fetched from url: the offset of the registry's next link
+        when it carries one, else the offset of url plus the records of the page, which are fewer than
+        the limit asked for when the registry caps the page size. None for an empty page.
+        """
+        next_url = payload.get('next')
+        if next_url and 'offset=' in next_url:
+            start, end = _query_value_span(next_url, 'offset')
+            return int(next_url[start:end])
+        records = len(payload.get('results') or [])
+        if records == 0 or 'offset' not in url:
+            return None
+        start, end = _query_value_span(url, 'offset')
+        return int(url[start:end]) + records
+
+    @staticmethod
+    def replace_limit(url, limit):
+        """
+        Change the number of records the URL asks for without moving its offset.
+        """
+        start, end = _query_value_span(url, 'limit')
+        return url[:start] + str(limit) + url[end:len(url)]
+
+
+class FetchAttempts:
+    """
+    The tries of one request to the registry, shared by the fetch_record_block of Extract and AsyncExtract,
+    which only differ in how they fetch and wait. Counts the failures of each kind, asks the retry policy
+    how long to wait before the next try and raises the error to report once the tries or the budget run out.
+    """
+    def __init__(self, extract, url):
+        self.extract = extract
+        self.url = url
+        self.attempt_count_net = 1
+        self.attempt_count_status = 1
+        self.attempt_count_json = 1
+        self.attempt_count_rate = 1
+        self.recent_error = None
+        self.recent_json_error = None
+        self.recent_request_error = None
+
+    @property
+    def retries(self):
+        return self.attempt_count_net + self.attempt_count_status + self.attempt_count_json \
+            + self.attempt_count_rate - 4
+
+    def delay(self):
+        """
+        Seconds to wait before the next try, None before the first one.
+        Raises the last failure as if its tries were exceeded when the run-wide retry budget is spent.
+        """
+        if self.retries == 0:
+            return None
+        delay = self.extract.retry_policy().delay(self.retries, getattr(self.recent_request_error, 'response', None))
+        if delay is None:
+            logging.warning('Not retrying, the retry budget is spent. Set FETCH_RETRY_BUDGET to fine tune.')
+            if self.recent_error is self.recent_json_error:
+                raise JSONDecodeError("Retry budget exhausted.", self.recent_json_error.doc,
+                                      self.recent_json_error.pos)
+            raise RequestException(response=getattr(self.recent_request_error, 'response', None))
+        logging.warning(f'Retrying request in {delay:.1f} seconds')
+        return delay
+
+    def failed(self, error):
+        """
+        Count a failed try, raising the error to report once the tries of its kind are exceeded.
+        """
+        extract = self.extract
+        if isinstance(error, HTTPError):  # trap http status error before the more general RequestException
+            self.recent_error = self.recent_request_error = error
+            if error.response.status_code == 429:  # rate limited, wait as long as the registry asks
+                self.attempt_count_rate += 1
+            else:
+                self.attempt_count_status += 1
+            logging.warning(f'HTTP status code, {error.response.status_code}, from URL: {self.url}')
+        elif isinstance(error, RequestException):  # trap network issues
+            self.recent_error = self.recent_request_error = error
+            self.attempt_count_net += 1
+            if error.response is None:
+                logging.warning(f'No response entity from URL: {self.url}')
+            else:
+                logging.warning(f'Exception requesting URL: {self.url}')
+        else:  # trap JSON parsing errors
+            self.recent_error = self.recent_json_error = error
+            self.attempt_count_json += 1
+            logging.warning(f'JSON parsing error in response from: {self.url}')
+            logging.warning(error)
+            logging.warning(error.doc)
+
+        # allow for the caller to know how often the JSON was bad
+        if self.attempt_count_json > extract.FETCH_TRIES_FOR_JSON:
+            raise JSONDecodeError("Exceeded JSON Tries.", error.doc, error.pos)
+
+        if self.attempt_count_net > extract.FETCH_TRIES_FOR_NETWORK_ERROR \
+                or self.attempt_count_status > extract.FETCH_TRIES_FOR_STATUS_CODE \
+                or self.attempt_count_rate > extract.FETCH_TRIES_FOR_RATE_LIMIT:
+            logging.warning('Retrying failed')
+            # the response of the last failure, if any, lets the caller tell overload from a bad request
+            raise RequestException(response=getattr(error, 'response', None))
+
+    def succeeded(self, payload):
+        if payload is None:  # ideally we should not raise this exception
+            raise ValueError("Response was never set and this should not happen.")
+        if self.retries > 0:
+            logging.info('Retrying succeeded')
+        return payload
+
+
+class PageSizeTuner:
+    """
+    Chooses the number of records per request from the latency and body size of the pages fetched so far.
+    Each change is damped to at most double or half the current limit, and the limit is kept within bounds.
+    """
+    def __init__(self, limit, min_limit, max_limit, target_seconds, max_bytes=None):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_seconds = target_seconds
+        self.max_bytes = max_bytes
+        self.limit = min(max(limit, min_limit), max_limit)
+        self.last_bytes = None
+        self.requests_per_limit = Counter()
+
+    # pylint: disable=unused-argument
+    def record_response(self, response, *args, **kwargs):
+        """
+        Response hook for the requests session that remembers the size of the latest body.
+        """
+        self.last_bytes = len(response.content) if response.content is not None else None
+
+    def observe(self, seconds, records, more=False):
+        """
+        Record a page fetched with the current limit and return the limit for the next request.
+        more tells whether the registry has records after the page.
+        """
+        self.requests_per_limit[self.limit] += 1
+        nbytes, self.last_bytes = self.last_bytes, None
+        if records < self.limit:
+            if more and records > 0:  # the registry caps the page size, asking for more records is wasted
+                self.max_limit = max(self.min_limit, records)
+                if self.limit > self.max_limit:
+                    logging.info(f'Page size changed from {self.limit} to {self.max_limit} records, '
+                                 f'the registry caps pages at {records} records.')
+                    self.limit = self.max_limit
+            # a short last page is the end of the registry and says little about cost
+            return self.limit
+
+        proposed = self.limit * 2 if seconds <= 0 else int(self.limit * self.target_seconds / seconds)
+        if self.max_bytes and nbytes:
+            proposed = min(proposed, int(self.max_bytes * self.limit / nbytes))
+        proposed = max(self.limit // 2, min(self.limit * 2, proposed))
+        proposed = max(self.min_limit, min(self.max_limit, proposed))
+
+        if proposed != self.limit:
+            logging.info(f'Page size changed from {self.limit} to {proposed} records '
+                         f'after a {seconds:.2f} second response of {nbytes} bytes.')
+            self.limit = proposed
+        return self.limit
+
+    def back_off(self):
+        """
+        Halve the limit after a failed request and keep it from growing back to a size that overloaded the registry.
+        Returns False once the limit is already at its minimum.
+        """
+        if self.limit <= self.min_limit:
+            return False
+        self.limit = max(self.min_limit, self.limit // 2)
+        self.max_limit = self.limit
+        logging.warning(f'Page size reduced to {self.limit} records after a failed request.')
+        return True
+
+    @staticmethod
+    def is_overload(request_error):
+        """
+        True when the failure looks like the registry struggling with the page: no response or a 5xx status.
+        """
+        response = request_error.response
+        return response is None or response.status_code >= 500
+
+    def summary(self):
+        return ', '.join(f'{limit} x{requests}' for limit, requests in sorted(self.requests_per_limit.items()))
+
+
+def _query_value_span(url, name):
+    """
+    Start and end index of the value of a query parameter in the URL.
+    """
+    start = url.index(name) + len(name) + 1
+    try:
+        end = url.index('&', start)
+    except ValueError:
+        end = len(url)
+    return start, end
+
+
+def _current_limit(url, default):
+    """
+    Number of records the URL asks for, or the default when the URL does not say.
+    """
+    if 'limit' not in url:
+        return default
+    start, end = _query_value_span(url, 'limit')
+    return int(url[start:end])
+
+
+class _Borrowed:
+    """
+    Context manager that lends an already open session without closing it on exit.
+    """
+    def __init__(self, session):
+        self.session = session
+
+    def __enter__(self):
+        return self.session
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
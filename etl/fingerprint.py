@@ -0,0 +1,92 @@
+"""
+Content fingerprints of transformed monitoring locations, used to skip upserts of unchanged rows
+"""
+
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+
+
+def row_fingerprint(mon_loc):
+    """
+    Digest of a transformed monitoring location. Equal rows have equal digests whatever their key order.
+    """
+    if not isinstance(mon_loc, dict):
+        mon_loc = dict(mon_loc)
+    canonical = json.dumps(mon_loc, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.blake2b(canonical.encode('utf-8'), digest_size=16).hexdigest()
+
+
+class FingerprintIndex:
+    """
+    SQLite index of the fingerprint last committed to each sink for every (AGENCY_CD, SITE_NO).
+    Fingerprints are recorded only after the sink committed the row, and written to the index
+    in batches, so a crash at worst causes some unchanged rows to be upserted again.
+    """
+    def __init__(self, path, flush_every=1000):
+        self.path = path
+        self.flush_every = flush_every
+        self.lock = threading.Lock()
+        self.pending = []
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS fingerprint ('
+            'sink TEXT NOT NULL, agency_cd TEXT NOT NULL, site_no TEXT NOT NULL, digest TEXT NOT NULL, '
+            'PRIMARY KEY (sink, agency_cd, site_no)) WITHOUT ROWID')
+        self.connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def unchanged(self, sink, mon_loc, digest):
+        """
+        True when the sink already holds this exact row and the upsert can be skipped.
+        """
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT digest FROM fingerprint WHERE sink = ? AND agency_cd = ? AND site_no = ?',
+                (sink, mon_loc['AGENCY_CD'], mon_loc['SITE_NO'])).fetchone()
+        return row is not None and row[0] == digest
+
+    def record(self, sink, mon_loc, digest):
+        """
+        Remember the row the sink just committed.
+        """
+        with self.lock:
+            self.pending.append((sink, mon_loc['AGENCY_CD'], mon_loc['SITE_NO'], digest))
+            full = len(self.pending) >= self.flush_every
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, []
+            if pending:
+                self.connection.executemany(
+                    'INSERT OR REPLACE INTO fingerprint (sink, agency_cd, site_no, digest) VALUES (?, ?, ?, ?)',
+                    pending)
+                self.connection.commit()
+
+    def clear(self, sink):
+        """
+        Forget every fingerprint of the sink, so that each row is upserted once more and the index is rebuilt
+        from what the database commits. Fingerprints cannot be computed from the rows in the database,
+        whose values are typed and formatted by the database, so rows edited there are only caught this way.
+        """
+        self.flush()
+        with self.lock:
+            dropped = self.connection.execute('DELETE FROM fingerprint WHERE sink = ?', (sink,)).rowcount
+            self.connection.commit()
+        logging.info(f'Fingerprint index for {sink} cleared, {dropped} rows will be loaded again.')
+        return dropped
+
+    def close(self):
+        self.flush()
+        self.connection.close()
@@ -1,14 +1,31 @@
 """
 Load data from the new Well Registry to NGWMN
 """
+import weakref
+import zlib
+
+from functools import lru_cache
+from io import StringIO
+from itertools import islice
+
 import cx_Oracle
 import psycopg2
 
 
-def _manipulate_values(y, is_timestamp):
+TIME_COLUMNS = ['INSERT_DATE', 'UPDATE_DATE']
+KEY_COLUMNS = ['AGENCY_CD', 'SITE_NO']
+PG_EXCLUDED_COLUMNS = ['INSERT_USER_ID', 'UPDATE_USER_ID', 'REVIEW_FLAG']
+PG_STAGING_TABLE = '"WELL_REGISTRY_LOAD"'
+PG_GEOM = 'ST_SetSRID(ST_MakePoint("DEC_LONG_VA"::double precision, "DEC_LAT_VA"::double precision), 4269)'
+ORACLE_STATEMENT_CACHE_SIZE = 40
+COMMIT_EVERY = 100
+ORACLE_MV_METHODS = {'fast': 'F', 'complete': 'C', 'force': '?'}
+
+
+def _bind_value(y):
     """
     Make various translations to make sure
-    the data is Oracle friendly.
+    the data is database friendly when sent as a bind variable.
     """
     # remove leading and trailing spaces
     try:
@@ -16,68 +33,106 @@ def _manipulate_values(y, is_timestamp):
     except AttributeError:
         z = y
 
-    # deal with datetimes
-    if is_timestamp:
-        return f"to_timestamp('{z}', 'YYYY-MM-DD\"T\"HH24:MI:SS.ff6\"Z\"')"
-
-    # deal with everything else
-    if z is None:
-        return 'NULL'
-    elif z is False:
+    if z is False:
         return '0'
     elif z is True:
         return '1'
-    elif len(str(z)) == 0:
-        return "''"
-    else:
-        if isinstance(z, str):
-            # Escape single quotes
-            z = z.translate(str.maketrans({"'": "''"}))
-        return f"'{z}'"
+    return z
 
 
-TIME_COLUMNS = ['INSERT_DATE', 'UPDATE_DATE']
+class UpsertTemplate:
+    """
+    An upsert statement with a placeholder per bind value, built once per column set.
+    bind_columns lists the column of each placeholder in order, so a row only has to produce its bind values.
+    An Oracle template carries the input sizes that bind the timestamp columns as TIMESTAMP,
+    a PostGIS template the text to prepare it as a server side statement.
+    """
+    def __init__(self, columns, statement, bind_columns, name=None, prepare=None, input_sizes=None):
+        self.columns = columns
+        self.statement = statement
+        self.bind_columns = bind_columns
+        self.input_sizes = input_sizes
+        self.name = name
+        self.prepare = prepare
+        self.execute_prepared = None if name is None else \
+            f'EXECUTE {name} ({",".join(["%s"] * len(bind_columns))})'
 
+    def binds(self, mon_loc):
+        return tuple([_bind_value(mon_loc[col]) for col in self.bind_columns])
 
-def _generate_upsert_sql(mon_loc):
+
+@lru_cache(maxsize=32)
+def oracle_upsert_template(columns):
     """
-    Generate SQL to insert/update for Oracle.
+    MERGE into the Oracle staging table with one positional bind per column.
+    Every value is bound once in the USING clause, so the same text serves every row
+    and stays in the cx_Oracle statement cache. Timestamps are bound as datetimes,
+    with a TIMESTAMP input size so that their fractional seconds are kept.
     """
-    mon_loc_db = [(k, _manipulate_values(v, k in TIME_COLUMNS)) for k, v in mon_loc.items()]
-    all_columns = ','.join(col for (col, _) in mon_loc_db)
-    all_values = ','.join(value for (_, value) in mon_loc_db)
-    update_query = ','.join(f"{k}={v}" for (k, v) in mon_loc_db if k not in ['AGENCY_CD', 'SITE_NO'])
+    source = ','.join(f':{position} {col}' for position, col in enumerate(columns, 1))
+    all_columns = ','.join(columns)
+    all_values = ','.join(f'b.{col}' for col in columns)
+    update_query = ','.join(f'a.{col}=b.{col}' for col in columns if col not in KEY_COLUMNS)
 
     statement = (
         f"MERGE INTO GW_DATA_PORTAL.WELL_REGISTRY_STG a "
-        f"USING (SELECT '{mon_loc['AGENCY_CD']}' AGENCY_CD, '{mon_loc['SITE_NO']}' "
-        f"SITE_NO FROM DUAL) b ON (a.AGENCY_CD = b.AGENCY_CD AND a.SITE_NO = b.SITE_NO) "
+        f"USING (SELECT {source} FROM DUAL) b "
+        f"ON (a.AGENCY_CD = b.AGENCY_CD AND a.SITE_NO = b.SITE_NO) "
         f"WHEN MATCHED THEN UPDATE SET {update_query} "
         f"WHEN NOT MATCHED THEN INSERT ({all_columns}) VALUES ({all_values})"
     )
-    return statement
+    input_sizes = [cx_Oracle.TIMESTAMP if col in TIME_COLUMNS else None for col in columns]
+    return UpsertTemplate(columns, statement, columns, input_sizes=input_sizes)
 
 
-def _generate_upsert_pgsql(mon_loc):
+@lru_cache(maxsize=32)
+def pg_upsert_template(columns):
     """
-    Generate SQL to insert/update for PostGIS
+    INSERT ... ON CONFLICT into PostGIS with one placeholder per column, plus the longitude
+    and latitude once more to build GEOM. The same statement is also written with $n parameters
+    to be prepared once per connection.
     """
-    mon_loc_db = [(k, _manipulate_values(v, k in TIME_COLUMNS)) for k, v in mon_loc.items()]
-    all_columns = '"' + '","'.join(col for (col, _) in mon_loc_db if col not in ['INSERT_USER_ID', 'UPDATE_USER_ID', 'REVIEW_FLAG'])
-    all_columns += '","GEOM"'
-    all_values = ','.join(value for (key, value) in mon_loc_db if key not in ['INSERT_USER_ID', 'UPDATE_USER_ID', 'REVIEW_FLAG'])
-    geom_col = f" ST_SetSRID(ST_MakePoint({mon_loc['DEC_LONG_VA']},{mon_loc['DEC_LAT_VA']}),4269) "
-    all_values += "," + geom_col
-    update_query = ','.join(f'"{k}"={v}' for (k, v) in mon_loc_db if k not in ['AGENCY_CD', 'SITE_NO', 'INSERT_USER_ID', 'UPDATE_USER_ID', 'REVIEW_FLAG'])
-    update_query += ', "GEOM"=' + geom_col
+    bind_columns = columns + ('DEC_LONG_VA', 'DEC_LAT_VA')
+    all_columns = ','.join(f'"{col}"' for col in columns)
+    update_query = ','.join(f'"{col}"=EXCLUDED."{col}"' for col in columns if col not in KEY_COLUMNS)
 
-    print(f'The update query looks like this: {update_query}')
+    def text(placeholders):
+        values = ','.join(placeholders[:len(columns)])
+        geom = f'ST_SetSRID(ST_MakePoint({placeholders[-2]}::double precision, ' \
+               f'{placeholders[-1]}::double precision), 4269)'
+        return (
+            f'INSERT INTO "GW_DATA_PORTAL"."WELL_REGISTRY_MAIN" ({all_columns},"GEOM") VALUES ({values},{geom}) '
+            f'ON CONFLICT("AGENCY_CD", "SITE_NO") DO UPDATE SET {update_query},"GEOM"=EXCLUDED."GEOM"'
+        )
+
+    name = f'well_registry_upsert_{zlib.crc32(all_columns.encode("utf-8")):08x}'
+    statement = text(['%s'] * len(bind_columns))
+    prepare = f'PREPARE {name} AS ' + text([f'${position}' for position in range(1, len(bind_columns) + 1)])
+    return UpsertTemplate(columns, statement, bind_columns, name, prepare)
+
+
+def pg_columns(mon_loc):
+    """
+    The columns of a transformed monitoring location that exist in PostGIS.
+    """
+    return tuple(col for col in mon_loc.keys() if col not in PG_EXCLUDED_COLUMNS)
 
-    statement = (
-        f'INSERT INTO "GW_DATA_PORTAL"."WELL_REGISTRY_MAIN" ({all_columns}) VALUES ({all_values}) '
-        f'ON CONFLICT("AGENCY_CD", "SITE_NO") DO UPDATE SET {update_query}'
-    )
-    return statement
+
+# names of the statements prepared on each PostGIS connection
+_PG_PREPARED = weakref.WeakKeyDictionary()
+
+
+def execute_pg_upsert(connect, cursor, mon_loc):
+    """
+    Upsert one row into PostGIS through a server side prepared statement,
+    preparing it the first time its column set is used on the connection.
+    """
+    template = pg_upsert_template(pg_columns(mon_loc))
+    prepared = _PG_PREPARED.setdefault(connect, set())
+    if template.name not in prepared:
+        cursor.execute(template.prepare)
+        prepared.add(template.name)
+    cursor.execute(template.execute_prepared, template.binds(mon_loc))
 
 
 class NoDb:
@@ -104,7 +159,9 @@ def make_oracle(host, port, database, user, password):
     if host is None:
         return NoDb()
     connect_str = f'{host}:{port}/{database}'
-    return cx_Oracle.connect(user, password, connect_str, encoding='UTF-8')
+    connect = cx_Oracle.connect(user, password, connect_str, encoding='UTF-8')
+    connect.stmtcachesize = ORACLE_STATEMENT_CACHE_SIZE
+    return connect
 
 
 def make_postgres(host, port, database, user, password):
@@ -113,7 +170,9 @@ def make_postgres(host, port, database, user, password):
     """
     if host is None:
         return NoDb()
-    return psycopg2.connect(host=host, port=port, database=database, user=user, password=password)
+    # timestamps are bound as aware datetimes in UTC, a UTC session stores them in timestamp columns unshifted
+    return psycopg2.connect(host=host, port=port, database=database, user=user, password=password,
+                            options='-c timezone=UTC')
 
 
 def load_monitoring_location(connect, mon_loc):
@@ -121,175 +180,335 @@ def load_monitoring_location(connect, mon_loc):
     Connect to the database and run the upsert SQL into Oracle.
 
     """
+    template = oracle_upsert_template(tuple(mon_loc.keys()))
     cursor = connect.cursor()
-    cursor.execute(_generate_upsert_sql(mon_loc))
+    cursor.setinputsizes(*template.input_sizes)
+    cursor.execute(template.statement, template.binds(mon_loc))
     connect.commit()
 
 
+def load_monitoring_locations(connect, mon_locs, chunk_size=500):
+    """
+    Upsert monitoring locations into Oracle with one array DML MERGE per chunk of rows,
+    committing once per chunk. Rows Oracle rejects do not stop the rest of their chunk.
+    Returns (AGENCY_CD, SITE_NO, error) of every rejected row.
+    """
+    failed_locations = []
+    cursor = connect.cursor()
+    mon_locs = iter(mon_locs)
+    chunk = list(islice(mon_locs, chunk_size))
+    while chunk:
+        template = oracle_upsert_template(tuple(chunk[0].keys()))
+        cursor.setinputsizes(*template.input_sizes)
+        cursor.executemany(template.statement, [template.binds(mon_loc) for mon_loc in chunk], batcherrors=True)
+        for error in cursor.getbatcherrors():
+            mon_loc = chunk[error.offset]
+            failed_locations.append((mon_loc['AGENCY_CD'], mon_loc['SITE_NO'], cx_Oracle.DatabaseError(error)))
+        connect.commit()
+        chunk = list(islice(mon_locs, chunk_size))
+    return failed_locations
+
+
 def load_monitoring_location_pg(connect, mon_loc):
     """
     Connect to the database and run the upsert SQL into PostGIS.
     """
     cursor = connect.cursor()
-    cursor.execute(_generate_upsert_pgsql(mon_loc))
+    execute_pg_upsert(connect, cursor, mon_loc)
+    connect.commit()
+
+
+def _execute_oracle_upsert(connect, cursor, mon_loc):
+    template = oracle_upsert_template(tuple(mon_loc.keys()))
+    cursor.setinputsizes(*template.input_sizes)
+    cursor.execute(template.statement, template.binds(mon_loc))
+
+
+def _load_by_row(connect, mon_locs, upsert, errors, commit_every):
+    """
+    Upsert monitoring locations one at a time, each under a savepoint, committing every commit_every rows.
+    A rejected row is rolled back to its savepoint alone, so the rest of its transaction still commits.
+    Returns (AGENCY_CD, SITE_NO, error) of every rejected row.
+    """
+    failed_locations = []
+    cursor = connect.cursor()
+    uncommitted = 0
+    for mon_loc in mon_locs:
+        cursor.execute('SAVEPOINT row_upsert')
+        try:
+            upsert(connect, cursor, mon_loc)
+        except errors as err:
+            cursor.execute('ROLLBACK TO SAVEPOINT row_upsert')
+            failed_locations.append((mon_loc['AGENCY_CD'], mon_loc['SITE_NO'], err))
+        uncommitted += 1
+        if uncommitted >= commit_every:
+            connect.commit()
+            uncommitted = 0
+    if uncommitted:
+        connect.commit()
+    return failed_locations
+
+
+def load_monitoring_locations_by_row(connect, mon_locs, commit_every=COMMIT_EVERY):
+    """
+    Upsert monitoring locations into Oracle one MERGE at a time, committing every commit_every rows.
+    """
+    return _load_by_row(connect, mon_locs, _execute_oracle_upsert, cx_Oracle.DatabaseError, commit_every)
+
+
+def load_monitoring_locations_pg_by_row(connect, mon_locs, commit_every=COMMIT_EVERY):
+    """
+    Upsert monitoring locations into PostGIS one prepared statement at a time, committing every commit_every rows.
+    """
+    return _load_by_row(connect, mon_locs, execute_pg_upsert, psycopg2.DatabaseError, commit_every)
+
+
+def _copy_text(value):
+    """
+    Format a value for the text format of COPY.
+    """
+    z = _bind_value(value)
+    if z is None:
+        return '\\N'
+    return str(z).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+@lru_cache(maxsize=32)
+def _generate_staged_upsert_pgsql(columns, one_key=False):
+    """
+    Generate the set based upsert of the staged rows into PostGIS, building GEOM in SQL.
+    With one_key the upsert is limited to the row of one (AGENCY_CD, SITE_NO).
+    """
+    all_columns = ','.join(f'"{col}"' for col in columns)
+    update_query = ','.join(f'"{col}"=EXCLUDED."{col}"' for col in columns if col not in KEY_COLUMNS)
+    where = ' WHERE "AGENCY_CD" = %s AND "SITE_NO" = %s' if one_key else ''
+    return (
+        f'INSERT INTO "GW_DATA_PORTAL"."WELL_REGISTRY_MAIN" ({all_columns},"GEOM") '
+        f'SELECT {all_columns},{PG_GEOM} FROM {PG_STAGING_TABLE}{where} '
+        f'ON CONFLICT("AGENCY_CD", "SITE_NO") DO UPDATE SET {update_query},"GEOM"=EXCLUDED."GEOM"'
+    )
+
+
+def load_monitoring_locations_pg(connect, mon_locs):
+    """
+    Bulk upsert monitoring locations into PostGIS. The rows are streamed with COPY into a temporary
+    staging table and one INSERT ... SELECT ... ON CONFLICT upserts them all, building GEOM in SQL.
+    When the set based upsert fails, the staged rows are upserted one at a time under savepoints,
+    and when COPY itself fails the rows are loaded with load_monitoring_locations_pg_by_row.
+    Returns (AGENCY_CD, SITE_NO, error) of every rejected row.
+    """
+    # a key may only be upserted once per statement, the last version of a row wins
+    by_key = {(mon_loc['AGENCY_CD'], mon_loc['SITE_NO']): mon_loc for mon_loc in mon_locs}
+    if not by_key:
+        return []
+    columns = pg_columns(next(iter(by_key.values())))
+    all_columns = ','.join(f'"{col}"' for col in columns)
+
+    buffer = StringIO()
+    for mon_loc in by_key.values():
+        buffer.write('\t'.join(_copy_text(mon_loc[col]) for col in columns))
+        buffer.write('\n')
+    buffer.seek(0)
+
+    cursor = connect.cursor()
+    try:
+        cursor.execute(f'CREATE TEMPORARY TABLE {PG_STAGING_TABLE} ON COMMIT DROP AS '
+                       f'SELECT {all_columns} FROM "GW_DATA_PORTAL"."WELL_REGISTRY_MAIN" WITH NO DATA')
+        cursor.copy_expert(f'COPY {PG_STAGING_TABLE} ({all_columns}) FROM STDIN', buffer)
+    except psycopg2.DatabaseError:
+        connect.rollback()
+        return load_monitoring_locations_pg_by_row(connect, by_key.values())
+
+    failed_locations = []
+    cursor.execute('SAVEPOINT bulk_upsert')
+    try:
+        cursor.execute(_generate_staged_upsert_pgsql(columns))
+    except psycopg2.DatabaseError:
+        cursor.execute('ROLLBACK TO SAVEPOINT bulk_upsert')
+        statement = _generate_staged_upsert_pgsql(columns, one_key=True)
+        for agency_cd, site_no in by_key:
+            cursor.execute('SAVEPOINT row_upsert')
+            try:
+                cursor.execute(statement, (agency_cd, site_no))
+            except psycopg2.DatabaseError as err:
+                cursor.execute('ROLLBACK TO SAVEPOINT row_upsert')
+                failed_locations.append((agency_cd, site_no, err))
     connect.commit()
+    return failed_locations
+
+
+def refresh_well_registry_mv(connect, method=None, atomic_refresh=True, parallelism=0):
+    """
+    Refresh the well_registry_mv materialized view. method is one of ORACLE_MV_METHODS,
+    by default the refresh method the materialized view was defined with.
+    Without atomic_refresh a complete refresh truncates the view and loads it direct path,
+    which is faster but leaves it empty while it runs.
+    """
+    cursor = connect.cursor()
+    cursor.execute("begin dbms_mview.refresh(list => 'GW_DATA_PORTAL.WELL_REGISTRY_MV', method => :method, "
+                   f"atomic_refresh => {'TRUE' if atomic_refresh else 'FALSE'}, parallelism => :parallelism); end;",
+                   method=None if method is None else ORACLE_MV_METHODS[method], parallelism=parallelism)
 
 
-def refresh_well_registry_mv(connect):
+def refresh_well_registry_pg(connect, keys=None):
     """
-    Refresh the well_registry_mv materialized view
+    Refresh the well_registry_mv table in postgres. Without keys the table is rebuilt from scratch.
+    With the (AGENCY_CD, SITE_NO) of the rows loaded during the run only those rows are rewritten:
+    they are deleted along with the rows that vanished from WELL_REGISTRY and the rows whose UPDATE_DATE
+    differs from WELL_REGISTRY, left stale by an earlier refresh that failed, then every row of WELL_REGISTRY
+    missing from the table is copied in. Returns (rows deleted, rows inserted).
     """
     cursor = connect.cursor()
-    cursor.execute("begin dbms_mview.refresh('GW_DATA_PORTAL.WELL_REGISTRY_MV'); end;")
+    if keys is None:
+        cursor.execute(DELETE_MV)
+        deleted = cursor.rowcount
+    else:
+        buffer = StringIO()
+        for agency_cd, site_no in keys:
+            buffer.write(f'{_copy_text(agency_cd)}\t{_copy_text(site_no)}\n')
+        buffer.seek(0)
+        cursor.execute(f'CREATE TEMPORARY TABLE {PG_MV_KEYS_TABLE} ON COMMIT DROP AS '
+                       f'SELECT "AGENCY_CD", "SITE_NO" FROM "GW_DATA_PORTAL"."WELL_REGISTRY_MV" WITH NO DATA')
+        cursor.copy_expert(f'COPY {PG_MV_KEYS_TABLE} ("AGENCY_CD", "SITE_NO") FROM STDIN', buffer)
+        cursor.execute(f'ANALYZE {PG_MV_KEYS_TABLE}')
+        cursor.execute(DELETE_MV_KEYS)
+        deleted = cursor.rowcount
+        cursor.execute(DELETE_MV_VANISHED)
+        deleted += cursor.rowcount
+        cursor.execute(DELETE_MV_STALE)
+        deleted += cursor.rowcount
+    cursor.execute(INSERT_MV if keys is None else INSERT_MV_MISSING)
+    inserted = cursor.rowcount
+    connect.commit()
+    return deleted, inserted
 
 
-def refresh_well_registry_pg(connect):
+def _quote_ident(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _pg_role(role):
+    return 'PUBLIC' if role.upper() == 'PUBLIC' else _quote_ident(role)
+
+
+def swap_well_registry_pg(connect):
     """
-    Refresh the well_registry_mv table in postgres
+    Rebuild the well_registry_mv table in postgres without rewriting it in place. A shadow table
+    is filled from WELL_REGISTRY, given the indexes, constraints, grants, triggers, row level security
+    policies and owner of the table once its rows are in, analyzed, and renamed over it. It is all one
+    transaction, so a failed rebuild leaves nothing behind, and the exclusive lock readers wait on is only
+    taken by the final drop and rename. Views and foreign keys depending on the table would be dropped
+    with it, so the swap is refused with a ProgrammingError naming them before any work is done.
+    Returns the number of rows of the new table.
     """
     cursor = connect.cursor()
-    cursor.execute(DELETE_MV)
-    cursor.execute(INSERT_MV)
+    cursor.execute(SELECT_MV_DEPENDENTS)
+    dependents = [dependent for dependent, in cursor.fetchall()]
+    if dependents:
+        connect.rollback()
+        raise psycopg2.ProgrammingError(
+            f'WELL_REGISTRY_MV cannot be swapped, dropping it would drop {", ".join(dependents)}; '
+            f'use the delta or full refresh')
+
+    cursor.execute(f'CREATE TABLE {PG_MV_SHADOW_TABLE} (LIKE {PG_MV_TABLE} '
+                   f'INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING STORAGE INCLUDING COMMENTS)')
+    cursor.execute(INSERT_MV.replace(PG_MV_TABLE, PG_MV_SHADOW_TABLE, 1))
+    inserted = cursor.rowcount
+
+    cursor.execute(SELECT_MV_INDEXES)
+    renames = []
+    for position, (name, definition, constraint_type) in enumerate(cursor.fetchall()):
+        shadow_name = f'WELL_REGISTRY_MV_SWAP_{position}'
+        unique = 'UNIQUE ' if definition.startswith('CREATE UNIQUE ') else ''
+        cursor.execute(f'CREATE {unique}INDEX {_quote_ident(shadow_name)} ON {PG_MV_SHADOW_TABLE} '
+                       f'USING {definition.split(" USING ", 1)[1]}')
+        if constraint_type is not None:
+            cursor.execute(f'ALTER TABLE {PG_MV_SHADOW_TABLE} ADD CONSTRAINT {_quote_ident(shadow_name)} '
+                           f'{"PRIMARY KEY" if constraint_type == "p" else "UNIQUE"} '
+                           f'USING INDEX {_quote_ident(shadow_name)}')
+        renames.append((shadow_name, name))
+    cursor.execute(SELECT_MV_GRANTS)
+    for grantee, privilege in cursor.fetchall():
+        cursor.execute(f'GRANT {privilege} ON {PG_MV_SHADOW_TABLE} TO {_pg_role(grantee)}')
+    # the triggers are created once the rows are in, so that they do not fire for the rebuild
+    cursor.execute(SELECT_MV_TRIGGERS)
+    for definition, table in cursor.fetchall():
+        cursor.execute(definition.replace(f' ON {table} ', f' ON {PG_MV_SHADOW_TABLE} ', 1))
+    cursor.execute(SELECT_MV_POLICIES)
+    for name, permissive, roles, command, using, check in cursor.fetchall():
+        cursor.execute(f'CREATE POLICY {_quote_ident(name)} ON {PG_MV_SHADOW_TABLE} AS {permissive} FOR {command} '
+                       f'TO {", ".join(_pg_role(role) for role in roles)}'
+                       f'{"" if using is None else f" USING ({using})"}'
+                       f'{"" if check is None else f" WITH CHECK ({check})"}')
+    cursor.execute(SELECT_MV_TABLE_OPTIONS)
+    owner, row_security, force_row_security, current_user = cursor.fetchone()
+    if row_security:
+        cursor.execute(f'ALTER TABLE {PG_MV_SHADOW_TABLE} ENABLE ROW LEVEL SECURITY')
+    if force_row_security:
+        cursor.execute(f'ALTER TABLE {PG_MV_SHADOW_TABLE} FORCE ROW LEVEL SECURITY')
+    cursor.execute(f'ANALYZE {PG_MV_SHADOW_TABLE}')
+    if owner != current_user:
+        cursor.execute(f'ALTER TABLE {PG_MV_SHADOW_TABLE} OWNER TO {_quote_ident(owner)}')
+
+    # a long running reader makes the swap fail instead of queueing every other reader behind it
+    cursor.execute(f"SET LOCAL lock_timeout = '{PG_MV_SWAP_LOCK_TIMEOUT}'")
+    cursor.execute(f'DROP TABLE {PG_MV_TABLE}')
+    cursor.execute(f'ALTER TABLE {PG_MV_SHADOW_TABLE} RENAME TO "WELL_REGISTRY_MV"')
+    for shadow_name, name in renames:
+        cursor.execute(f'ALTER INDEX "GW_DATA_PORTAL".{_quote_ident(shadow_name)} RENAME TO {_quote_ident(name)}')
     connect.commit()
+    return inserted
+
 
+MV_COLUMNS = ('AGENCY_CD', 'AGENCY_NM', 'AGENCY_MED', 'SITE_NO', 'SITE_NAME', 'DISPLAY_FLAG', 'DEC_LAT_VA',
+    'DEC_LONG_VA', 'HORZ_DATUM', 'HORZ_METHOD', 'HORZ_ACY', 'ALT_VA', 'ALT_UNITS', 'ALT_UNITS_NM',
+    'ALT_DATUM_CD', 'ALT_METHOD', 'ALT_ACY', 'WELL_DEPTH', 'WELL_DEPTH_UNITS', 'WELL_DEPTH_UNITS_NM',
+    'NAT_AQUIFER_CD', 'NAT_AQFR_DESC', 'COUNTRY_CD', 'COUNTRY_NM', 'STATE_CD', 'STATE_NM', 'COUNTY_CD',
+    'COUNTY_NM', 'LOCAL_AQUIFER_CD', 'LOCAL_AQUIFER_NAME', 'SITE_TYPE', 'AQFR_CHAR', 'QW_SYS_NAME',
+    'QW_SN_FLAG', 'QW_SN_DESC', 'QW_BASELINE_FLAG', 'QW_BASELINE_DESC', 'QW_WELL_CHARS', 'QW_WELL_CHARS_DESC',
+    'QW_WELL_TYPE', 'QW_WELL_TYPE_DESC', 'QW_WELL_PURPOSE', 'QW_WELL_PURPOSE_DESC', 'QW_WELL_PURPOSE_NOTES',
+    'WL_SYS_NAME', 'WL_SN_FLAG', 'WL_SN_DESC', 'WL_BASELINE_FLAG', 'WL_BASELINE_DESC', 'WL_WELL_CHARS',
+    'WL_WELL_CHARS_DESC', 'WL_WELL_TYPE', 'WL_WELL_TYPE_DESC', 'WL_WELL_PURPOSE', 'WL_WELL_PURPOSE_DESC',
+    'WL_WELL_PURPOSE_NOTES', 'GEOM', 'INSERT_DATE', 'UPDATE_DATE', 'DATA_PROVIDER', 'WL_DATA_PROVIDER',
+    'QW_DATA_PROVIDER', 'LITH_DATA_PROVIDER', 'CONST_DATA_PROVIDER', 'WL_DATA_FLAG', 'QW_DATA_FLAG',
+    'LOG_DATA_FLAG', 'LINK',
+)
+"""
+Columns of WELL_REGISTRY_MV, copied from WELL_REGISTRY.
+"""
+_MV_COLUMN_LIST = ','.join(f'"{col}"' for col in MV_COLUMNS)
+PG_MV_TABLE = '"GW_DATA_PORTAL"."WELL_REGISTRY_MV"'
+PG_MV_SHADOW_TABLE = '"GW_DATA_PORTAL"."WELL_REGISTRY_MV_SWAP"'
+PG_MV_KEYS_TABLE = '"WELL_REGISTRY_MV_KEYS"'
+PG_MV_SWAP_LOCK_TIMEOUT = '10s'
 
 DELETE_MV = 'delete from "GW_DATA_PORTAL"."WELL_REGISTRY_MV";'
-INSERT_MV = 'insert into "GW_DATA_PORTAL"."WELL_REGISTRY_MV" ( \
-              "AGENCY_CD", \
-              "AGENCY_NM", \
-              "AGENCY_MED", \
-              "SITE_NO", \
-              "SITE_NAME", \
-              "DISPLAY_FLAG", \
-              "DEC_LAT_VA", \
-              "DEC_LONG_VA", \
-              "HORZ_DATUM", \
-              "HORZ_METHOD", \
-              "HORZ_ACY", \
-              "ALT_VA", \
-              "ALT_UNITS", \
-              "ALT_UNITS_NM", \
-              "ALT_DATUM_CD", \
-              "ALT_METHOD", \
-              "ALT_ACY", \
-              "WELL_DEPTH", \
-              "WELL_DEPTH_UNITS", \
-              "WELL_DEPTH_UNITS_NM", \
-              "NAT_AQUIFER_CD", \
-              "NAT_AQFR_DESC", \
-              "COUNTRY_CD", \
-              "COUNTRY_NM", \
-              "STATE_CD", \
-              "STATE_NM", \
-              "COUNTY_CD", \
-              "COUNTY_NM", \
-              "LOCAL_AQUIFER_CD", \
-              "LOCAL_AQUIFER_NAME", \
-              "SITE_TYPE", \
-              "AQFR_CHAR", \
-              "QW_SYS_NAME", \
-              "QW_SN_FLAG", \
-              "QW_SN_DESC", \
-              "QW_BASELINE_FLAG", \
-              "QW_BASELINE_DESC", \
-              "QW_WELL_CHARS", \
-              "QW_WELL_CHARS_DESC", \
-              "QW_WELL_TYPE", \
-              "QW_WELL_TYPE_DESC", \
-              "QW_WELL_PURPOSE", \
-              "QW_WELL_PURPOSE_DESC", \
-              "QW_WELL_PURPOSE_NOTES", \
-              "WL_SYS_NAME", \
-              "WL_SN_FLAG", \
-              "WL_SN_DESC", \
-              "WL_BASELINE_FLAG", \
-              "WL_BASELINE_DESC", \
-              "WL_WELL_CHARS", \
-              "WL_WELL_CHARS_DESC", \
-              "WL_WELL_TYPE", \
-              "WL_WELL_TYPE_DESC", \
-              "WL_WELL_PURPOSE", \
-              "WL_WELL_PURPOSE_DESC", \
-              "WL_WELL_PURPOSE_NOTES", \
-              "GEOM", \
-              "INSERT_DATE", \
-              "UPDATE_DATE", \
-              "DATA_PROVIDER", \
-              "WL_DATA_PROVIDER", \
-              "QW_DATA_PROVIDER", \
-              "LITH_DATA_PROVIDER", \
-              "CONST_DATA_PROVIDER", \
-              "WL_DATA_FLAG", \
-              "QW_DATA_FLAG", \
-              "LOG_DATA_FLAG", \
-              "LINK" \
-  ) \
-  select      "AGENCY_CD", \
-              "AGENCY_NM", \
-              "AGENCY_MED", \
-              "SITE_NO", \
-              "SITE_NAME", \
-              "DISPLAY_FLAG", \
-              "DEC_LAT_VA", \
-              "DEC_LONG_VA", \
-              "HORZ_DATUM", \
-              "HORZ_METHOD", \
-              "HORZ_ACY", \
-              "ALT_VA", \
-              "ALT_UNITS", \
-              "ALT_UNITS_NM", \
-              "ALT_DATUM_CD", \
-              "ALT_METHOD", \
-              "ALT_ACY", \
-              "WELL_DEPTH", \
-              "WELL_DEPTH_UNITS", \
-              "WELL_DEPTH_UNITS_NM", \
-              "NAT_AQUIFER_CD", \
-              "NAT_AQFR_DESC", \
-              "COUNTRY_CD", \
-              "COUNTRY_NM", \
-              "STATE_CD", \
-              "STATE_NM", \
-              "COUNTY_CD", \
-              "COUNTY_NM", \
-              "LOCAL_AQUIFER_CD", \
-              "LOCAL_AQUIFER_NAME", \
-              "SITE_TYPE", \
-              "AQFR_CHAR", \
-              "QW_SYS_NAME", \
-              "QW_SN_FLAG", \
-              "QW_SN_DESC", \
-              "QW_BASELINE_FLAG", \
-              "QW_BASELINE_DESC", \
-              "QW_WELL_CHARS", \
-              "QW_WELL_CHARS_DESC", \
-              "QW_WELL_TYPE", \
-              "QW_WELL_TYPE_DESC", \
-              "QW_WELL_PURPOSE", \
-              "QW_WELL_PURPOSE_DESC", \
-              "QW_WELL_PURPOSE_NOTES", \
-              "WL_SYS_NAME", \
-              "WL_SN_FLAG", \
-              "WL_SN_DESC", \
-              "WL_BASELINE_FLAG", \
-              "WL_BASELINE_DESC", \
-              "WL_WELL_CHARS", \
-              "WL_WELL_CHARS_DESC", \
-              "WL_WELL_TYPE", \
-              "WL_WELL_TYPE_DESC", \
-              "WL_WELL_PURPOSE", \
-              "WL_WELL_PURPOSE_DESC", \
-              "WL_WELL_PURPOSE_NOTES", \
-              "GEOM", \
-              "INSERT_DATE", \
-              "UPDATE_DATE", \
-              "DATA_PROVIDER", \
-              "WL_DATA_PROVIDER", \
-              "QW_DATA_PROVIDER", \
-              "LITH_DATA_PROVIDER", \
-              "CONST_DATA_PROVIDER", \
-              "WL_DATA_FLAG", \
-              "QW_DATA_FLAG", \
-              "LOG_DATA_FLAG", \
-              "LINK" \
-  from "GW_DATA_PORTAL"."WELL_REGISTRY";'
+INSERT_MV = f'insert into "GW_DATA_PORTAL"."WELL_REGISTRY_MV" ({_MV_COLUMN_LIST}) ' \
+    f'select {_MV_COLUMN_LIST} from "GW_DATA_PORTAL"."WELL_REGISTRY";'
+DELETE_MV_KEYS = f'delete from "GW_DATA_PORTAL"."WELL_REGISTRY_MV" mv using {PG_MV_KEYS_TABLE} k ' \
+    'where mv."AGENCY_CD" = k."AGENCY_CD" and mv."SITE_NO" = k."SITE_NO";'
+DELETE_MV_VANISHED = 'delete from "GW_DATA_PORTAL"."WELL_REGISTRY_MV" mv where not exists (' \
+    'select 1 from "GW_DATA_PORTAL"."WELL_REGISTRY" wr ' \
+    'where wr."AGENCY_CD" = mv."AGENCY_CD" and wr."SITE_NO" = mv."SITE_NO");'
+DELETE_MV_STALE = 'delete from "GW_DATA_PORTAL"."WELL_REGISTRY_MV" mv using "GW_DATA_PORTAL"."WELL_REGISTRY" wr ' \
+    'where wr."AGENCY_CD" = mv."AGENCY_CD" and wr."SITE_NO" = mv."SITE_NO" ' \
+    'and wr."UPDATE_DATE" is distinct from mv."UPDATE_DATE";'
+INSERT_MV_MISSING = f'insert into "GW_DATA_PORTAL"."WELL_REGISTRY_MV" ({_MV_COLUMN_LIST}) ' \
+    f'select {_MV_COLUMN_LIST} from "GW_DATA_PORTAL"."WELL_REGISTRY" wr where not exists (' \
+    'select 1 from "GW_DATA_PORTAL"."WELL_REGISTRY_MV" mv ' \
+    'where mv."AGENCY_CD" = wr."AGENCY_CD" and mv."SITE_NO" = wr."SITE_NO");'
+SELECT_MV_INDEXES = 'select i.relname, pg_get_indexdef(i.oid), c.contype from pg_index x ' \
+    'join pg_class i on i.oid = x.indexrelid ' \
+    "left join pg_constraint c on c.conindid = x.indexrelid and c.contype in ('p', 'u') " \
+    f"where x.indrelid = '{PG_MV_TABLE}'::regclass order by i.relname;"
+SELECT_MV_GRANTS = 'select grantee, privilege_type from information_schema.table_privileges ' \
+    "where table_schema = 'GW_DATA_PORTAL' and table_name = 'WELL_REGISTRY_MV' and grantee <> current_user;"
+SELECT_MV_DEPENDENTS = 'select distinct pg_describe_object(d.classid, d.objid, d.objsubid) from pg_depend d ' \
+    f"where d.refclassid = 'pg_class'::regclass and d.refobjid = '{PG_MV_TABLE}'::regclass and d.deptype = 'n' " \
+    'order by 1;'
+SELECT_MV_TRIGGERS = 'select pg_get_triggerdef(oid), tgrelid::regclass::text from pg_trigger ' \
+    f"where tgrelid = '{PG_MV_TABLE}'::regclass and not tgisinternal order by tgname;"
+SELECT_MV_POLICIES = 'select policyname, permissive, roles::text[], cmd, qual, with_check from pg_policies ' \
+    "where schemaname = 'GW_DATA_PORTAL' and tablename = 'WELL_REGISTRY_MV' order by policyname;"
+SELECT_MV_TABLE_OPTIONS = 'select pg_get_userbyid(relowner), relrowsecurity, relforcerowsecurity, current_user ' \
+    f"from pg_class where oid = '{PG_MV_TABLE}'::regclass;"
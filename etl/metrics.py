@@ -0,0 +1,241 @@
+"""
+Timing and throughput of a run, as a JSON summary and as a Prometheus textfile collector file
+"""
+
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from bisect import bisect_left
+
+PREFIX = 'ngwmn_etl'
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+class Histogram:
+    """
+    Counts of observed durations by upper bucket bound, safe to update from several threads.
+    """
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        with self.lock:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+
+    def cumulative(self):
+        """
+        (upper bound, number of observations at or below it) of every bucket, ending with '+Inf'.
+        """
+        with self.lock:
+            counts = list(self.counts)
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets + ('+Inf',), counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def summary(self):
+        return {'count': self.count, 'sum': round(self.sum, 6),
+                'buckets': {str(bound): count for bound, count in self.cumulative()}}
+
+
+class RequestMetrics:
+    """
+    Requests to the registry: their latency, outcome and the bytes of their responses.
+    """
+    def __init__(self):
+        self.latency = Histogram()
+        self.outcomes = {}
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    def record(self, seconds, error=None):
+        self.latency.observe(seconds)
+        outcome = 'ok' if error is None else type(error).__name__
+        with self.lock:
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+
+    def record_bytes(self, count):
+        with self.lock:
+            self.bytes += count
+
+    def record_response(self, response, *args, **kwargs):
+        """
+        Response hook of a requests Session.
+        """
+        if response.content is not None:
+            self.record_bytes(len(response.content))
+
+
+def _rate(items, seconds):
+    return round(items / seconds, 3) if seconds > 0 else 0.0
+
+
+class RunReport:
+    """
+    The metrics of one run, gathered from the extract, the pipeline and the sinks once they are done.
+    Either may be None, a replay of dead letters has no pipeline. success is whether every row loaded
+    and the run ended normally, None when it is not known.
+    """
+    def __init__(self, extract=None, pipeline=None, sinks=(), finished=None, success=None):
+        self.extract = extract
+        self.pipeline = pipeline
+        self.sinks = list(sinks)
+        self.finished = time.time() if finished is None else finished
+        self.success = success
+
+    def summary(self):
+        """
+        The run summary as a structure of plain values, ready for json.dump.
+        """
+        summary = {'finished': self.finished, 'stages': {}}
+        if self.success is not None:
+            summary['success'] = self.success
+        if self.pipeline is not None:
+            pipeline = self.pipeline
+            summary['wall_seconds'] = round(pipeline.wall_seconds, 3)
+            summary['transform'] = {
+                'records': pipeline.count, 'skipped': pipeline.skipped, 'rejected': len(pipeline.rejected),
+                'records_per_second': _rate(pipeline.count, pipeline.transform_stats.busy_seconds),
+            }
+            for stats in pipeline.stats():
+                summary['stages'][stats.name] = self._stage(stats)
+        else:
+            for sink in self.sinks:
+                summary['stages'][sink.name] = self._stage(sink.stats)
+        requests = getattr(self.extract, 'FETCH_METRICS', None)
+        if requests is not None:
+            retry_policy = self.extract.retry_policy()
+            summary['extract'] = {
+                'requests': dict(requests.outcomes), 'response_bytes': requests.bytes,
+                'request_seconds': requests.latency.summary(),
+                'retries': retry_policy.retries, 'retry_wait_seconds': round(retry_policy.seconds_slept, 3),
+            }
+        summary['sinks'] = {sink.name: {
+            'received': sink.received, 'loaded': sink.loaded, 'failed': len(sink.failed_locations),
+            'unchanged': sink.unchanged, 'seconds': round(sink.seconds, 3),
+            'rows_per_second': _rate(sink.loaded, sink.seconds),
+            'refreshed': sink.refreshed, 'refresh_seconds': round(sink.refresh_seconds, 3),
+        } for sink in self.sinks}
+        return summary
+
+    @staticmethod
+    def _stage(stats):
+        return {'items': stats.items, 'busy_seconds': round(stats.busy_seconds, 3),
+                'queue_depth_mean': round(stats.mean_depth, 3), 'queue_depth_max': stats.max_depth,
+                'latency_seconds': stats.latency.summary()}
+
+    def prometheus(self):
+        """
+        The metrics in the Prometheus text exposition format. Every value is of the last run, so they are gauges.
+        """
+        lines = []
+
+        def gauge(name, help_text, samples):
+            lines.append(f'# HELP {PREFIX}_{name} {help_text}')
+            lines.append(f'# TYPE {PREFIX}_{name} gauge')
+            for labels, value in samples:
+                lines.append(f'{PREFIX}_{name}{_labels(labels)} {_number(value)}')
+
+        def histogram(name, help_text, samples):
+            lines.append(f'# HELP {PREFIX}_{name} {help_text}')
+            lines.append(f'# TYPE {PREFIX}_{name} histogram')
+            for labels, hist in samples:
+                for bound, count in hist.cumulative():
+                    lines.append(f'{PREFIX}_{name}_bucket{_labels(dict(labels, le=str(bound)))} {count}')
+                lines.append(f'{PREFIX}_{name}_sum{_labels(labels)} {_number(hist.sum)}')
+                lines.append(f'{PREFIX}_{name}_count{_labels(labels)} {hist.count}')
+
+        summary = self.summary()
+        gauge('last_run_finished_timestamp_seconds', 'Unix time the run ended.', [({}, summary['finished'])])
+        if 'success' in summary:
+            gauge('last_run_success', '1 when the run ended normally and every row loaded, 0 when it failed.',
+                  [({}, int(summary['success']))])
+        if 'wall_seconds' in summary:
+            gauge('run_seconds', 'Wall clock seconds of the run.', [({}, summary['wall_seconds'])])
+        stages = summary['stages']
+        gauge('stage_items', 'Items the stage worked on: pages, records or rows.',
+              [({'stage': name}, stage['items']) for name, stage in stages.items()])
+        gauge('stage_busy_seconds', 'Seconds the stage spent working.',
+              [({'stage': name}, stage['busy_seconds']) for name, stage in stages.items()])
+        gauge('stage_queue_depth_max', 'Largest depth of the queue feeding the stage.',
+              [({'stage': name}, stage['queue_depth_max']) for name, stage in stages.items()])
+        stage_stats = self.pipeline.stats() if self.pipeline is not None else [sink.stats for sink in self.sinks]
+        histogram('stage_latency_seconds', 'Seconds per page fetched, page transformed or batch loaded.',
+                  [({'stage': stats.name}, stats.latency) for stats in stage_stats])
+        if 'transform' in summary:
+            transform = summary['transform']
+            gauge('transform_records', 'Monitoring locations transformed.', [({}, transform['records'])])
+            gauge('transform_skipped', 'Monitoring locations not updated since the watermark.',
+                  [({}, transform['skipped'])])
+            gauge('transform_rejected', 'Monitoring locations with malformed timestamps.',
+                  [({}, transform['rejected'])])
+            gauge('transform_records_per_second', 'Records transformed per second of transform work.',
+                  [({}, transform['records_per_second'])])
+        if 'extract' in summary:
+            extract = summary['extract']
+            gauge('registry_requests', 'Requests to the registry by outcome.',
+                  [({'outcome': outcome}, count) for outcome, count in extract['requests'].items()])
+            gauge('registry_response_bytes', 'Bytes of registry responses.', [({}, extract['response_bytes'])])
+            gauge('registry_retries', 'Requests to the registry retried.', [({}, extract['retries'])])
+            gauge('registry_retry_wait_seconds', 'Seconds spent waiting to retry.',
+                  [({}, extract['retry_wait_seconds'])])
+            histogram('registry_request_seconds', 'Seconds per request to the registry.',
+                      [({}, self.extract.FETCH_METRICS.latency)])
+        sinks = summary['sinks']
+        gauge('sink_rows', 'Rows of the run by database and result.',
+              [({'sink': name, 'result': result}, sink[result])
+               for name, sink in sinks.items() for result in ('loaded', 'failed', 'unchanged')])
+        gauge('sink_rows_per_second', 'Rows loaded per second of the sink.',
+              [({'sink': name}, sink['rows_per_second']) for name, sink in sinks.items()])
+        gauge('mv_refreshed', '1 when the materialized view was refreshed.',
+              [({'sink': name}, int(sink['refreshed'])) for name, sink in sinks.items()])
+        gauge('mv_refresh_seconds', 'Seconds the materialized view refresh took.',
+              [({'sink': name}, sink['refresh_seconds']) for name, sink in sinks.items()])
+        return '\n'.join(lines) + '\n'
+
+    def write_json(self, path):
+        _replace(path, json.dumps(self.summary(), indent=2))
+        logging.info(f'Wrote the run summary to {path}')
+
+    def write_textfile(self, path):
+        """
+        Write the Prometheus file in one step, so the textfile collector never reads half of it.
+        """
+        _replace(path, self.prometheus())
+        logging.info(f'Wrote the run metrics to {path}')
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items())
+    return '{' + pairs + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _replace(path, text):
+    directory = os.path.dirname(os.path.abspath(path))
+    handle, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(handle, 'w') as temp_file:
+        temp_file.write(text)
+    os.chmod(temp_path, 0o644)
+    os.replace(temp_path, path)
@@ -0,0 +1,210 @@
+"""
+Parallel loading of one database by worker processes, each owning the rows of a hash partition of the keys
+"""
+
+import logging
+import multiprocessing
+import queue
+import threading
+import zlib
+
+from time import monotonic
+
+from .pool import is_transient
+from .sink import Sink
+
+
+def partition_of(mon_loc, partitions):
+    """
+    The partition of a monitoring location. A key always lands in the same partition,
+    so no two workers ever upsert the same row.
+    """
+    key = f"{mon_loc['AGENCY_CD']}\x00{mon_loc['SITE_NO']}"
+    return zlib.crc32(key.encode('utf-8')) % partitions
+
+
+class RemoteLoadError(Exception):
+    """
+    An error raised in a load worker process, rebuilt in the parent from its class name and message,
+    or read back from the dead letter file of an earlier run.
+    """
+    def __init__(self, error_class, message, transient=False):
+        Exception.__init__(self, error_class, message)
+        self.error_class = error_class
+        self.message = message
+        self.transient = transient
+
+    def __str__(self):
+        return f'{self.error_class}: {self.message}'
+
+
+def _describe(error):
+    return type(error).__name__, str(error), is_transient(error)
+
+
+def _load_partition(partition, sink_class, make, connect_args, batch_size, load, inbox, outbox):
+    """
+    Body of a worker process. Loads the batches of its partition on a connection of its own
+    and reports the committed keys and rejected rows of every batch back to the parent.
+    """
+    connect = None
+    error = None
+    try:
+        connect = make(*connect_args)
+    except Exception as err:  # pylint: disable=broad-except
+        error = err
+    sink = sink_class(connect, batch_size, load)
+    sink.error = error
+    try:
+        for batch in iter(inbox.get, None):
+            reported = len(sink.failed_locations)
+            sink.load_batch(batch)
+            failed = sink.failed_locations[reported:]
+            failed_keys = {(agency_cd, site_no) for agency_cd, site_no, _ in failed}
+            committed = [(mon_loc['AGENCY_CD'], mon_loc['SITE_NO'], digest) for mon_loc, digest in batch
+                         if (mon_loc['AGENCY_CD'], mon_loc['SITE_NO']) not in failed_keys]
+            rejected = [(agency_cd, site_no, _describe(err), sink.failed_rows[(agency_cd, site_no)])
+                        for agency_cd, site_no, err in failed]
+            outbox.put(('batch', partition, committed, rejected))
+    finally:
+        if connect is not None and hasattr(connect, 'close'):
+            connect.close()
+        outbox.put(('done', partition, None if sink.error is None else _describe(sink.error)))
+
+
+class PartitionedSink(Sink):
+    """
+    Loads a database through several worker processes instead of the single connection of a sink.
+    Rows are hash partitioned by (AGENCY_CD, SITE_NO) across the workers, each of which opens its own
+    connection with make(*connect_args). The parent collects the failures and counts of every worker
+    and refreshes the materialized view once, on its own connection, after all of them are done.
+    The parent keeps the rows it sent until a worker reports them, so the rows a worker took with it
+    when it exited unexpectedly are failed with a transient error and loaded again.
+    """
+    POLL_SECONDS = 1.0
+
+    def __init__(self, sink_class, connect, make, connect_args, workers, batch_size,
+                 load=None, index=None, queue_size=None):
+        self.name = sink_class.name
+        self.errors = sink_class.errors
+        Sink.__init__(self, connect, batch_size * workers, sink_class.default_load if load is None else load,
+                      index, queue_size)
+        self.target = sink_class(connect, batch_size)
+        self.workers = workers
+        context = multiprocessing.get_context('spawn')  # the parent runs threads, which do not survive a fork
+        self.outbox = context.Queue()
+        self.inboxes = [context.Queue(maxsize=2) for _ in range(workers)]
+        self.processes = [
+            context.Process(target=_load_partition, name=f'{self.name}-load-{partition}', daemon=True,
+                            args=(partition, sink_class, make, connect_args, batch_size, load, inbox, self.outbox))
+            for partition, inbox in enumerate(self.inboxes)
+        ]
+        self.collector = threading.Thread(target=self.collect, name=f'{self.name}-collect', daemon=True)
+        self.worker_errors = []
+        self.in_flight = [{} for _ in range(workers)]
+        self.in_flight_lock = threading.Lock()
+
+    def start(self):
+        for process in self.processes:
+            process.start()
+        self.collector.start()
+        return Sink.start(self)
+
+    def load_batch(self, batch):
+        """
+        Hand every row of the batch to the worker of its partition. Results arrive through collect().
+        """
+        dispatch_start = monotonic()
+        parts = [[] for _ in range(self.workers)]
+        for mon_loc, digest in batch:
+            parts[partition_of(mon_loc, self.workers)].append((mon_loc, digest))
+        for partition, part in enumerate(parts):
+            if part:
+                with self.in_flight_lock:
+                    self.in_flight[partition].update(
+                        ((mon_loc['AGENCY_CD'], mon_loc['SITE_NO']), (mon_loc, digest)) for mon_loc, digest in part)
+                self._send(partition, part)
+        self.stats.worked(monotonic() - dispatch_start, len(batch))
+
+    def _send(self, partition, item):
+        """
+        Queue an item for the worker of a partition. An item for a worker that exited is dropped,
+        its rows stay in flight until drain() fails them.
+        """
+        while self.processes[partition].is_alive():
+            try:
+                self.inboxes[partition].put(item, timeout=self.POLL_SECONDS)
+                return
+            except queue.Full:
+                pass
+
+    def collect(self):
+        """
+        Merge the results reported by the workers until every one of them is done.
+        """
+        done = set()
+        while len(done) < self.workers:
+            try:
+                message = self.outbox.get(timeout=self.POLL_SECONDS)
+            except queue.Empty:
+                if not any(process.is_alive() for process in self.processes):
+                    for partition in sorted(set(range(self.workers)) - done):
+                        self.worker_errors.append(RemoteLoadError(
+                            'WorkerExited', f'load worker {partition} exited unexpectedly', transient=True))
+                    return
+                continue
+            if message[0] == 'done':
+                _, partition, error = message
+                done.add(partition)
+                if error is not None:
+                    self.worker_errors.append(RemoteLoadError(*error))
+                continue
+            _, partition, committed, failed = message
+            with self.in_flight_lock:
+                for agency_cd, site_no, _ in committed:
+                    self.in_flight[partition].pop((agency_cd, site_no), None)
+                for agency_cd, site_no, _, _ in failed:
+                    self.in_flight[partition].pop((agency_cd, site_no), None)
+            self.loaded += len(committed)
+            self.touched.update((agency_cd, site_no) for agency_cd, site_no, _ in committed)
+            for agency_cd, site_no, error, row in failed:
+                self.failed_locations.append((agency_cd, site_no, RemoteLoadError(*error)))
+                self.failed_rows[(agency_cd, site_no)] = row
+            self.record_fingerprints(({'AGENCY_CD': agency_cd, 'SITE_NO': site_no}, digest)
+                                     for agency_cd, site_no, digest in committed)
+
+    def drain(self):
+        if self.cancelled.is_set():
+            for process in self.processes:
+                process.terminate()
+        else:
+            for partition in range(self.workers):
+                self._send(partition, None)
+        for process in self.processes:
+            process.join()
+        self.collector.join()
+        if self.worker_errors and self.error is None:
+            self.error = self.worker_errors[0]
+        if not self.cancelled.is_set():
+            self.fail_in_flight()
+
+    def fail_in_flight(self):
+        """
+        Fail the rows no worker reported, the ones a worker that exited unexpectedly took with it
+        or never received, with a transient error so that they are loaded again.
+        """
+        with self.in_flight_lock:
+            lost = [row for in_flight in self.in_flight for row in in_flight.values()]
+            self.in_flight = [{} for _ in range(self.workers)]
+        if not lost:
+            return
+        logging.error(f'{self.name}: {len(lost)} monitoring locations were lost by a load worker that exited')
+        error = RemoteLoadError('WorkerExited', 'the load worker of the row exited unexpectedly', transient=True)
+        for mon_loc, digest in lost:
+            key = (mon_loc['AGENCY_CD'], mon_loc['SITE_NO'])
+            self.failed_locations.append(key + (error,))
+            self.failed_rows[key] = (mon_loc, digest)
+
+    def refresh(self, keys):
+        self.target.view_stale = self.view_stale
+        self.target.refresh(keys)
@@ -0,0 +1,203 @@
+"""
+Staged extract, transform and load of the monitoring locations, connected by bounded queues
+"""
+
+import logging
+import queue
+import threading
+
+from time import monotonic
+
+from requests.exceptions import RequestException
+
+from .metrics import Histogram
+from .record import InternPool, MonitoringLocation
+from .transform import MalformedDateError, transform_mon_loc_values
+
+_DONE = object()
+
+
+class StageStats:
+    """
+    Work done by one stage of the pipeline and the depth of the queue it takes its work from.
+    A stage that is busy most of the run while the queue before it stays full is the bottleneck.
+    The latency histogram holds the seconds of every unit of work with items in it.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.busy_seconds = 0.0
+        self.depth_samples = 0
+        self.depth_total = 0
+        self.max_depth = 0
+        self.latency = Histogram()
+        self.lock = threading.Lock()
+
+    def sample_depth(self, depth):
+        with self.lock:
+            self.depth_samples += 1
+            self.depth_total += depth
+            self.max_depth = max(self.max_depth, depth)
+
+    def worked(self, seconds, items=1):
+        with self.lock:
+            self.busy_seconds += seconds
+            self.items += items
+        if items:
+            self.latency.observe(seconds)
+
+    @property
+    def mean_depth(self):
+        return self.depth_total / self.depth_samples if self.depth_samples else 0.0
+
+    def utilization(self, wall_seconds):
+        return min(1.0, self.busy_seconds / wall_seconds) if wall_seconds > 0 else 0.0
+
+    def summary(self, wall_seconds):
+        return f'{self.name}: {self.items} items, {self.utilization(wall_seconds):.0%} busy, ' \
+               f'queue depth mean {self.mean_depth:.1f} max {self.max_depth}'
+
+
+class Pipeline:
+    """
+    Fetches pages of the registry on one thread, transforms their records on the calling thread
+    and hands the rows to the sinks, which load them on threads of their own.
+    Every stage is connected to the next by a bounded queue, so a slow stage holds back the ones
+    before it and memory stays bounded. When a stage fails the whole pipeline is cancelled:
+    the fetching stops, the sinks discard what is still queued and the error is raised by run().
+    The pipeline is also cancelled when every sink has failed, since nothing can be loaded anymore.
+    Transformed rows are MonitoringLocation records sharing the values of their low cardinality columns,
+    so the rows queued for the sinks, kept as failed or sent to load worker processes stay small.
+    """
+    POLL_SECONDS = 0.1
+
+    def __init__(self, extract, endpoint, sinks, page_queue_size=4, accept=None, fingerprint=None):
+        self.extract = extract
+        self.endpoint = endpoint
+        self.sinks = sinks
+        self.accept = accept
+        self.fingerprint = fingerprint
+        self.pages = queue.Queue(maxsize=page_queue_size)
+        self.cancelled = threading.Event()
+        self.error = None
+        self.extract_complete = True
+        self.count = 0
+        self.skipped = 0
+        self.rejected = []
+        self.intern = InternPool()
+        self.wall_seconds = 0.0
+        self.extract_stats = StageStats('extract')
+        self.transform_stats = StageStats('transform')
+
+    def run(self):
+        start = monotonic()
+        extractor = threading.Thread(target=self.run_extract, name='extract', daemon=True)
+        for sink in self.sinks:
+            sink.start()
+        extractor.start()
+        try:
+            self.run_transform()
+        except BaseException as err:
+            self.cancel(err)
+            raise
+        finally:
+            extractor.join()
+            for sink in self.sinks:
+                if self.cancelled.is_set():
+                    sink.cancel()
+                sink.close()
+            for sink in self.sinks:  # each sink refreshes its materialized view once its queue drains
+                sink.join()
+            self.wall_seconds = monotonic() - start
+            for line in self.summary():
+                logging.info(line)
+        if self.error is not None:
+            raise self.error
+
+    def cancel(self, error=None):
+        if error is not None and self.error is None:
+            self.error = error
+        self.extract_complete = False
+        self.cancelled.set()
+
+    def run_extract(self):
+        """
+        Fetch the pages into the page queue until the registry has no more or the pipeline is cancelled.
+        """
+        pages = self.extract.iter_pages(self.endpoint)
+        try:
+            while not self.cancelled.is_set():
+                fetch_start = monotonic()
+                try:
+                    page = next(pages)
+                except StopIteration:
+                    break
+                self.extract_stats.worked(monotonic() - fetch_start)
+                if not self._put(page):
+                    break
+        except RequestException:
+            self.extract_complete = False
+        except Exception as err:  # pylint: disable=broad-except
+            logging.exception('Extraction failed, cancelling the pipeline')
+            self.cancel(err)
+        finally:
+            pages.close()
+            self._put(_DONE)
+
+    def run_transform(self):
+        """
+        Transform every record of the fetched pages and hand it to each sink.
+        """
+        while True:
+            page = self._get()
+            if page is _DONE:
+                return
+            transform_start = monotonic()
+            for mon_loc in page:
+                if self.accept is not None and not self.accept(mon_loc):
+                    self.skipped += 1
+                    continue
+                try:
+                    transformed_data = MonitoringLocation.from_values(transform_mon_loc_values(mon_loc), self.intern)
+                except MalformedDateError as err:  # reported with the failed rows, never sent to a database
+                    self.rejected.append((mon_loc['agency']['agency_cd'], mon_loc['site_no'], err))
+                    continue
+                digest = None if self.fingerprint is None else self.fingerprint(transformed_data)
+                for sink in self.sinks:
+                    sink.put(transformed_data, digest)
+                if self.count % 1000 == 1:
+                    logging.info(f'Transformed monitoring locations: {self.count}')
+                self.count += 1
+            self.transform_stats.worked(monotonic() - transform_start, len(page))
+            if self.sinks and all(sink.error is not None for sink in self.sinks):
+                logging.error('Every sink failed, cancelling the pipeline')
+                self.cancel()
+                return
+
+    def _put(self, item):
+        """
+        Put an item in the page queue, waiting while it is full. False when the pipeline was cancelled meanwhile.
+        """
+        while not self.cancelled.is_set():
+            try:
+                self.pages.put(item, timeout=self.POLL_SECONDS)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _get(self):
+        while not self.cancelled.is_set():
+            try:
+                self.transform_stats.sample_depth(self.pages.qsize())
+                return self.pages.get(timeout=self.POLL_SECONDS)
+            except queue.Empty:
+                pass
+        return _DONE
+
+    def stats(self):
+        return [self.extract_stats, self.transform_stats] + [sink.stats for sink in self.sinks]
+
+    def summary(self):
+        return [f'Pipeline ran {self.wall_seconds:.1f} s, {self.count} monitoring locations transformed'] + \
+            [stats.summary(self.wall_seconds) for stats in self.stats()]
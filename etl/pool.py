@@ -0,0 +1,237 @@
+"""
+Pooled database connections that reconnect and run the work again when the connection drops
+"""
+
+import logging
+import threading
+
+from time import monotonic
+
+import cx_Oracle
+import psycopg2
+import psycopg2.errors
+import psycopg2.pool
+
+from .load import NoDb, ORACLE_STATEMENT_CACHE_SIZE
+from .retry import ExponentialBackoff
+
+ORACLE_TRANSIENT_CODES = frozenset([
+    1012,   # not logged on
+    1033,   # initialization or shutdown in progress
+    1034,   # not available
+    1089,   # immediate shutdown in progress
+    3113,   # end-of-file on communication channel
+    3114,   # not connected
+    3135,   # connection lost contact
+    12170,  # connect timeout
+    12514,  # listener does not know of the service
+    12528,  # all instances are blocking new connections
+    12537,  # connection closed
+    12541,  # no listener
+    12543,  # destination host unreachable
+    12571,  # packet writer failure
+    25408,  # can not safely replay call
+    28547,  # connection to server failed
+])
+PG_TIMEOUT_ERRORS = (psycopg2.errors.LockNotAvailable, psycopg2.errors.QueryCanceled)
+"""
+Operational errors of a statement that ran out of its lock_timeout or statement_timeout, on a healthy connection.
+"""
+
+
+def is_transient(error):
+    """
+    Whether an error means the connection was lost or the database is briefly unavailable,
+    so the same work can succeed on a new connection.
+    """
+    if getattr(error, 'transient', False):  # raised in a load worker process
+        return True
+    if isinstance(error, cx_Oracle.DatabaseError):
+        code = getattr(error.args[0], 'code', None) if error.args else None
+        return code in ORACLE_TRANSIENT_CODES
+    if isinstance(error, PG_TIMEOUT_ERRORS):  # running the work again would wait as long again
+        return False
+    return isinstance(error, (psycopg2.OperationalError, psycopg2.InterfaceError))
+
+
+class ConnectionPool:
+    """
+    A pool of connections to one database, safe to share between threads. run(work) calls work(connection)
+    on a healthy connection: one idle for longer than PING_AFTER_SECONDS is checked first and replaced when
+    it is dead. When work fails with a transient error the connection is discarded and work runs again on a
+    new one, up to RECONNECT_RETRIES times with exponential backoff, so work must be safe to repeat.
+    Every load and refresh commits its own work and upserts, so they are. reconnect_retries overrides
+    RECONNECT_RETRIES for one pool; it is an argument so that pools made in load worker processes get it too.
+    """
+    name = None
+    RECONNECT_RETRIES = 3
+    PING_AFTER_SECONDS = 60.0
+
+    def __init__(self, size, backoff=None, reconnect_retries=None):
+        self.size = size
+        if reconnect_retries is not None:
+            self.RECONNECT_RETRIES = reconnect_retries
+        self.backoff = ExponentialBackoff(1.0, 30.0) if backoff is None else backoff
+        self.last_used = {}
+        self.lock = threading.Lock()
+        self.reconnects = 0
+
+    def _acquire(self):
+        raise NotImplementedError
+
+    def _release(self, connect, discard):
+        raise NotImplementedError
+
+    def _ping(self, connect):
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def acquire(self):
+        """
+        A connection from the pool, checked first when it has been idle for a while.
+        """
+        while True:
+            connect = self._acquire()
+            with self.lock:
+                used = self.last_used.get(id(connect))
+            if used is None or monotonic() - used < self.PING_AFTER_SECONDS:
+                return connect
+            try:
+                self._ping(connect)
+                return connect
+            except (cx_Oracle.Error, psycopg2.Error) as err:
+                logging.warning(f'{self.name} discarding a dead pooled connection: {err}')
+                self.release(connect, discard=True)
+
+    def release(self, connect, discard=False):
+        with self.lock:
+            if discard:
+                self.last_used.pop(id(connect), None)
+            else:
+                self.last_used[id(connect)] = monotonic()
+        self._release(connect, discard)
+
+    def run(self, work):
+        """
+        Call work(connection) and return its result, reconnecting and calling it again after transient errors.
+        """
+        attempt = 0
+        while True:
+            connect = None
+            try:
+                connect = self.acquire()
+                result = work(connect)
+            except Exception as err:  # pylint: disable=broad-except
+                transient = is_transient(err)
+                if connect is not None:
+                    self.release(connect, discard=transient)
+                if not transient or attempt >= self.RECONNECT_RETRIES:
+                    raise
+                attempt += 1
+                delay = self.backoff.delay(attempt)
+                if delay is None:
+                    raise
+                logging.warning(f'{self.name} connection lost: {err}, reconnecting in {delay:.1f} s '
+                                f'and running again, attempt {attempt} of {self.RECONNECT_RETRIES}')
+                self.backoff.sleep(delay)
+                with self.lock:
+                    self.reconnects += 1
+                continue
+            self.release(connect)
+            return result
+
+
+class OraclePool(ConnectionPool):
+    """
+    A cx_Oracle SessionPool.
+    """
+    name = 'oracle'
+
+    def __init__(self, host, port, database, user, password, size=2, backoff=None, reconnect_retries=None):
+        ConnectionPool.__init__(self, size, backoff, reconnect_retries)
+        self.pool = cx_Oracle.SessionPool(user, password, f'{host}:{port}/{database}', min=1, max=size,
+                                          increment=1, threaded=True, getmode=cx_Oracle.SPOOL_ATTRVAL_WAIT,
+                                          encoding='UTF-8')
+
+    def _acquire(self):
+        connect = self.pool.acquire()
+        connect.stmtcachesize = ORACLE_STATEMENT_CACHE_SIZE
+        return connect
+
+    def _release(self, connect, discard):
+        try:
+            if discard:
+                self.pool.drop(connect)
+            else:
+                self.pool.release(connect)
+        except cx_Oracle.Error as err:
+            logging.warning(f'{self.name} could not return a connection to the pool: {err}')
+
+    def _ping(self, connect):
+        connect.ping()
+
+    def close(self):
+        self.pool.close(force=True)
+
+
+class PostgresPool(ConnectionPool):
+    """
+    A psycopg2 ThreadedConnectionPool of UTC sessions, like make_postgres.
+    """
+    name = 'postgres'
+
+    def __init__(self, host, port, database, user, password, size=2, backoff=None, reconnect_retries=None):
+        ConnectionPool.__init__(self, size, backoff, reconnect_retries)
+        self.pool = psycopg2.pool.ThreadedConnectionPool(1, size, host=host, port=port, database=database,
+                                                         user=user, password=password, options='-c timezone=UTC')
+
+    def _acquire(self):
+        return self.pool.getconn()
+
+    def _release(self, connect, discard):
+        self.pool.putconn(connect, close=discard or bool(connect.closed))
+
+    def _ping(self, connect):
+        if connect.closed:
+            raise psycopg2.InterfaceError('connection already closed')
+        cursor = connect.cursor()
+        cursor.execute('SELECT 1')
+        connect.rollback()
+
+    def close(self):
+        self.pool.closeall()
+
+
+def make_oracle_pool(host, port, database, user, password, size=2, reconnect_retries=None):
+    """
+    Pool connections to Oracle database.
+    """
+    if host is None:
+        return NoDb()
+    return OraclePool(host, port, database, user, password, size, reconnect_retries=reconnect_retries)
+
+
+def make_postgres_pool(host, port, database, user, password, size=2, reconnect_retries=None):
+    """
+    Pool connections to Postgres database.
+    """
+    if host is None:
+        return NoDb()
+    return PostgresPool(host, port, database, user, password, size, reconnect_retries=reconnect_retries)
+
+
+def run_on(connect, work):
+    """
+    Call work(connection) on a pool, reconnecting as needed, or on a single connection.
+    """
+    if isinstance(connect, ConnectionPool):
+        return connect.run(work)
+    return work(connect)
@@ -0,0 +1,97 @@
+"""
+Compact in memory form of transformed monitoring locations
+"""
+
+from collections.abc import Mapping
+
+from .transform import COLUMNS
+
+INTERNED_COLUMNS = (
+    'AGENCY_CD', 'AGENCY_NM', 'AGENCY_MED', 'HORZ_DATUM', 'ALT_DATUM_CD', 'NAT_AQUIFER_CD', 'NAT_AQFR_DESC',
+    'LOCAL_AQUIFER_NAME', 'AQFR_CHAR', 'QW_SYS_NAME', 'WL_SYS_NAME', 'INSERT_USER_ID', 'UPDATE_USER_ID',
+    'STATE_CD', 'COUNTY_CD', 'COUNTRY_CD', 'WELL_DEPTH_UNITS', 'ALT_UNITS', 'SITE_TYPE',
+    'HORZ_METHOD', 'HORZ_ACY', 'ALT_METHOD', 'ALT_ACY',
+)
+"""
+Columns with few distinct values across the registry, shared between records through an InternPool.
+"""
+_INTERNED_POSITIONS = tuple(COLUMNS.index(name) for name in INTERNED_COLUMNS)
+_COLUMN_SET = frozenset(COLUMNS)
+
+
+class InternPool:
+    """
+    One shared copy of every distinct value of the low cardinality columns.
+    Unlike sys.intern it also shares numbers and is released with the pool.
+    """
+    def __init__(self):
+        self.values = {}
+
+    def __call__(self, value):
+        if value is None:
+            return None
+        return self.values.setdefault(value, value)
+
+    def __len__(self):
+        return len(self.values)
+
+
+class MonitoringLocation(Mapping):
+    """
+    A transformed monitoring location with one slot per column instead of a dict.
+    It reads like the dict transform_mon_loc_data returns, keys in COLUMNS order,
+    and supports item assignment of existing columns, so the loaders take either.
+    """
+    __slots__ = COLUMNS
+
+    def __init__(self, values):
+        for name, value in zip(COLUMNS, values):
+            setattr(self, name, value)
+
+    @classmethod
+    def from_mapping(cls, mapped_data, pool=None):
+        return cls.from_values([mapped_data[name] for name in COLUMNS], pool)
+
+    @classmethod
+    def from_values(cls, values, pool=None):
+        """
+        The record of values in COLUMNS order, like transform_mon_loc_values returns,
+        with the low cardinality columns shared through the pool.
+        """
+        if pool is not None:
+            values = list(values)
+            for position in _INTERNED_POSITIONS:
+                values[position] = pool(values[position])
+        return cls(values)
+
+    def __getitem__(self, key):
+        if key not in _COLUMN_SET:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in _COLUMN_SET:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __iter__(self):
+        return iter(COLUMNS)
+
+    def __len__(self):
+        return len(COLUMNS)
+
+    def keys(self):
+        return COLUMNS
+
+    def values(self):
+        return tuple(getattr(self, name) for name in COLUMNS)
+
+    def items(self):
+        return tuple(zip(COLUMNS, self.values()))
+
+    def __reduce__(self):
+        return MonitoringLocation, (self.values(),)
+
+    def __repr__(self):
+        return f"MonitoringLocation({self['AGENCY_CD']!r}, {self['SITE_NO']!r})"
+
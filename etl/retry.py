@@ -0,0 +1,91 @@
+"""
+Retry policy for requests to the Well Registry API
+"""
+
+import logging
+import random
+import threading
+import time
+
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+
+class Clock:
+    """
+    The real clock. Tests substitute an object with the same methods so that no real sleeping happens.
+    """
+    @staticmethod
+    def sleep(seconds):
+        time.sleep(seconds)
+
+    @staticmethod
+    def now():
+        return datetime.now(timezone.utc)
+
+
+class ExponentialBackoff:
+    """
+    Exponential backoff with full jitter, capped at a maximum delay and limited by a run-wide retry budget.
+    A Retry-After header on the failed response is honored, up to the maximum delay.
+    One instance is shared by every request of a run, so the counters are safe to update from several threads.
+    """
+    def __init__(self, base_delay, max_delay, retry_budget=None, clock=None, rand=None):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_budget = retry_budget
+        self.clock = Clock() if clock is None else clock
+        self.rand = random.Random() if rand is None else rand
+        self.retries = 0
+        self.seconds_slept = 0.0
+        self.lock = threading.Lock()
+
+    def delay(self, attempt, response=None):
+        """
+        Number of seconds to wait before retry number attempt (starting at 1) of a request,
+        or None when the run-wide retry budget has been spent.
+        """
+        with self.lock:
+            if self.retry_budget is not None and self.retries >= self.retry_budget:
+                return None
+            self.retries += 1
+
+        retry_after = self.retry_after(response)
+        if retry_after is not None:
+            return min(self.max_delay, retry_after)
+        return self.rand.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def sleep(self, seconds):
+        """
+        Wait with the policy's clock and count the time spent.
+        """
+        self.clock.sleep(seconds)
+        self.slept(seconds)
+
+    def slept(self, seconds):
+        """
+        Count time spent waiting elsewhere, for example in asyncio.sleep.
+        """
+        with self.lock:
+            self.seconds_slept += seconds
+
+    def retry_after(self, response):
+        """
+        Seconds requested by the Retry-After header of a response, in either of its formats, or None.
+        """
+        headers = getattr(response, 'headers', None)
+        value = headers.get('Retry-After') if headers else None
+        if value is None:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, (parsedate_to_datetime(value) - self.clock.now()).total_seconds())
+        except (TypeError, ValueError):
+            logging.warning(f'Ignoring malformed Retry-After header: {value}')
+            return None
+
+    def summary(self):
+        return f'Retries: {self.retries}, seconds spent waiting to retry: {self.seconds_slept:.1f}'
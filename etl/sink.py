@@ -0,0 +1,275 @@
+"""
+Databases the ETL loads into, each fed from its own bounded queue by its own thread
+"""
+
+import logging
+import queue
+import threading
+
+from time import monotonic
+
+import cx_Oracle
+import psycopg2
+
+from .load import load_monitoring_locations, load_monitoring_locations_pg, \
+    refresh_well_registry_mv, refresh_well_registry_pg, swap_well_registry_pg
+from .pipeline import StageStats
+from .pool import is_transient, run_on
+
+_DONE = object()
+
+
+class Sink:
+    """
+    Loads transformed monitoring locations into one database in batches, on a worker thread.
+    Rows are handed over with put() through a bounded queue, so a slow database holds the extract back
+    instead of filling memory, and each sink loads at its own pace. A sink that fails stops loading,
+    reports the rows it could not load and does not hold up the other sinks.
+    When its queue drains the sink refreshes its own materialized view, given the keys of the rows it loaded.
+    A cancelled sink discards the rows still queued and leaves its materialized view alone.
+    connect is a connection or a ConnectionPool, which reconnects and loads the batch again when
+    the connection drops. view_stale is whether the materialized view may be out of date before the run,
+    true unless the state of the last run says its refresh succeeded.
+    """
+    name = None
+    errors = ()
+
+    def __init__(self, connect, batch_size, load=None, index=None, queue_size=None):
+        self.connect = connect
+        self.batch_size = batch_size
+        self.load = self.default_load if load is None else load
+        self.index = index
+        self.queue = queue.Queue(maxsize=2 * batch_size if queue_size is None else queue_size)
+        self.thread = threading.Thread(target=self.run, name=f'{self.name}-sink', daemon=True)
+        self.cancelled = threading.Event()
+        self.stats = StageStats(self.name)
+        self.failed_locations = []
+        self.failed_rows = {}
+        self.error = None
+        self.received = 0
+        self.loaded = 0
+        self.unchanged = 0
+        self.touched = set()
+        self.refreshed = False
+        self.view_stale = True
+        self.refresh_seconds = 0.0
+        self.seconds = 0.0
+
+    @staticmethod
+    def default_load(connect, mon_locs):
+        raise NotImplementedError
+
+    def refresh(self, keys):
+        raise NotImplementedError
+
+    def drain(self):
+        """
+        Wait for rows handed to other workers, before the materialized view is refreshed.
+        """
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def put(self, mon_loc, digest=None):
+        """
+        Queue a row for loading, unless the fingerprint index knows the database already holds it.
+        Blocks while the queue is full.
+        """
+        if self.index is not None and self.index.unchanged(self.name, mon_loc, digest):
+            self.unchanged += 1
+            return
+        self.received += 1
+        self.queue.put((mon_loc, digest))
+
+    def close(self):
+        """
+        Tell the worker that no more rows are coming.
+        """
+        self.queue.put(_DONE)
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def join(self):
+        self.thread.join()
+        return self
+
+    def run(self):
+        start = monotonic()
+        batch = []
+        while True:
+            self.stats.sample_depth(self.queue.qsize())
+            item = self.queue.get()
+            if item is _DONE:
+                break
+            if self.cancelled.is_set():
+                continue
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                self.load_batch(batch)
+                batch = []
+        if batch and not self.cancelled.is_set():
+            self.load_batch(batch)
+        self.drain()
+        if self.error is None and not self.cancelled.is_set():
+            logging.info(f'updating {self.name} materialized view')
+            refresh_start = monotonic()
+            try:
+                self.refresh(self.touched)
+                self.refreshed = True
+            except self.errors as err:
+                logging.warning(f'{self.name} materialized view not refreshed: {err}')
+            self.refresh_seconds = monotonic() - refresh_start
+            self.stats.worked(self.refresh_seconds, 0)
+            logging.info(f'{self.name} materialized view refresh took {self.refresh_seconds:.1f} s')
+        self.seconds = monotonic() - start
+        logging.info(self.summary())
+
+    def load_batch(self, batch):
+        """
+        Upsert a batch of (row, fingerprint) and record the fingerprints of the rows that were committed.
+        After a failure of the sink itself, the remaining rows are reported as failed without being loaded.
+        """
+        load_start = monotonic()
+        mon_locs = [mon_loc for mon_loc, _ in batch]
+        if self.error is not None:
+            failed = [(mon_loc['AGENCY_CD'], mon_loc['SITE_NO'], self.error) for mon_loc in mon_locs]
+        else:
+            try:
+                failed = run_on(self.connect, lambda connect: self.load(connect, mon_locs))
+            except self.errors as err:
+                failed = [(mon_loc['AGENCY_CD'], mon_loc['SITE_NO'], err) for mon_loc in mon_locs]
+            except Exception as err:  # pylint: disable=broad-except
+                logging.exception(f'{self.name} sink stopped loading')
+                self.error = err
+                failed = [(mon_loc['AGENCY_CD'], mon_loc['SITE_NO'], err) for mon_loc in mon_locs]
+        self.failed_locations.extend(failed)
+        self.loaded += len(mon_locs) - len(failed)
+        failed_keys = {(agency_cd, site_no) for agency_cd, site_no, _ in failed}
+        committed = []
+        for mon_loc, digest in batch:
+            key = (mon_loc['AGENCY_CD'], mon_loc['SITE_NO'])
+            if key in failed_keys:
+                self.failed_rows[key] = (mon_loc, digest)
+            else:
+                self.touched.add(key)
+                committed.append((mon_loc, digest))
+        self.record_fingerprints(committed)
+        self.stats.worked(monotonic() - load_start, len(batch))
+        logging.info(f'{self.name}: loaded monitoring locations: {self.loaded}')
+
+    def record_fingerprints(self, committed):
+        """
+        Record the fingerprints of the (row, fingerprint) the database committed. An index that fails,
+        locked or out of disk, stops the sink like a load failure would, instead of ending its thread
+        and leaving put() blocked on a queue nobody drains.
+        """
+        if self.index is None or self.error is not None:
+            return
+        try:
+            for mon_loc, digest in committed:
+                self.index.record(self.name, mon_loc, digest)
+        except Exception as err:  # pylint: disable=broad-except
+            logging.exception(f'{self.name} sink stopped recording fingerprints')
+            self.error = err
+
+    def retry_failed(self):
+        """
+        Load the rows that failed with a transient error again, in one batch on this thread,
+        and refresh the materialized view when any of them loads. Meant for the end of a run,
+        once the sink was joined. Returns the number of rows loaded.
+        """
+        retry = [location for location in self.failed_locations if is_transient(location[2])]
+        if not retry:
+            return 0
+        self.failed_locations = [location for location in self.failed_locations if not is_transient(location[2])]
+        keys = dict.fromkeys((agency_cd, site_no) for agency_cd, site_no, _ in retry)
+        batch = [self.failed_rows.pop(key) for key in keys if key in self.failed_rows]
+        logging.info(f'{self.name}: loading {len(batch)} monitoring locations again after transient errors')
+        self.error = None
+        loaded = self.loaded
+        touched = set(self.touched)
+        Sink.load_batch(self, batch)  # a partitioned sink loads them itself, its workers are done
+        if self.loaded > loaded and self.error is None:
+            try:
+                self.refresh(self.touched - touched if self.refreshed else self.touched)
+                self.refreshed = True
+            except self.errors as err:
+                logging.warning(f'{self.name} materialized view not refreshed: {err}')
+        return self.loaded - loaded
+
+    def dead_letters(self):
+        """
+        The (sink name, row, error) of every row that failed to load.
+        """
+        errors = {(agency_cd, site_no): error for agency_cd, site_no, error in self.failed_locations}
+        return [(self.name, self.failed_rows[key][0], error)
+                for key, error in errors.items() if key in self.failed_rows]
+
+    def summary(self):
+        rate = self.received / self.seconds if self.seconds > 0 else 0.0
+        refreshed = f'refreshed in {self.refresh_seconds:.1f} s' if self.refreshed else 'not refreshed'
+        return f'{self.name}: {self.loaded} loaded, {len(self.failed_locations)} failed, ' \
+               f'{self.unchanged} unchanged in {self.seconds:.1f} s ({rate:.0f} rows/s), ' \
+               f'materialized view {refreshed}'
+
+
+class OracleSink(Sink):
+    """
+    The legacy Oracle database, loaded by array DML MERGE.
+    """
+    name = 'oracle'
+    errors = (cx_Oracle.IntegrityError, cx_Oracle.DatabaseError)
+    MV_METHOD = 'auto'
+    """
+    fast, complete or force refresh of WELL_REGISTRY_MV, or auto to force a refresh, fast when the view
+    logs allow it, of up to MV_FAST_MAX_ROWS loaded rows and refresh completely after larger loads.
+    """
+    MV_FAST_MAX_ROWS = 1000
+    MV_ATOMIC_REFRESH = True
+    MV_PARALLELISM = 0
+
+    @staticmethod
+    def default_load(connect, mon_locs):
+        # the whole batch is one array DML MERGE and commit, whatever its size
+        return load_monitoring_locations(connect, mon_locs, chunk_size=len(mon_locs))
+
+    def refresh(self, keys):
+        # the view logs still hold the changes a failed refresh did not apply
+        if not keys and not self.view_stale:
+            logging.info(f'{self.name} WELL_REGISTRY_MV refresh skipped, no rows were loaded')
+            return
+        method = self.MV_METHOD
+        if method == 'auto':
+            method = 'force' if len(keys) <= self.MV_FAST_MAX_ROWS else 'complete'
+        logging.info(f'{self.name} {method} refresh of WELL_REGISTRY_MV after {len(keys)} rows loaded')
+        run_on(self.connect, lambda connect: refresh_well_registry_mv(connect, method, self.MV_ATOMIC_REFRESH,
+                                                                      self.MV_PARALLELISM))
+
+
+class PostgisSink(Sink):
+    """
+    The PostGIS database, loaded by COPY into a staging table and a set based upsert.
+    """
+    name = 'postgres'
+    errors = (psycopg2.IntegrityError, psycopg2.DatabaseError)
+    MV_REFRESH = 'delta'
+    """
+    delta rewrites only the rows loaded during the run or stale, full rebuilds WELL_REGISTRY_MV in place
+    and swap rebuilds it as a new table renamed over the old one.
+    """
+
+    @staticmethod
+    def default_load(connect, mon_locs):
+        return load_monitoring_locations_pg(connect, mon_locs)
+
+    def refresh(self, keys):
+        if self.MV_REFRESH == 'swap':
+            inserted = run_on(self.connect, swap_well_registry_pg)
+            logging.info(f'{self.name} swap refresh of WELL_REGISTRY_MV: {inserted} rows')
+            return
+        keys = None if self.MV_REFRESH == 'full' else keys
+        deleted, inserted = run_on(self.connect, lambda connect: refresh_well_registry_pg(connect, keys))
+        logging.info(f'{self.name} {self.MV_REFRESH} refresh of WELL_REGISTRY_MV: '
+                     f'{deleted} rows deleted, {inserted} rows inserted')
@@ -0,0 +1,181 @@
+"""
+Tests for the async_extract.py module
+"""
+
+# unit testing modules
+from unittest import TestCase
+# modules referenced during testing
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from json import JSONDecodeError, dumps
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+import asyncio
+import logging
+import threading
+
+from requests import RequestException
+
+# file under test
+from ..async_extract import AsyncExtract
+
+
+class StubRegistryServer(ThreadingMixIn, HTTPServer):
+    """
+    Local HTTP server that serves a registry of numbered records by limit and offset.
+    Responses for an offset can be scripted as a list of status codes or 'bad json' that are used up in order.
+    """
+    daemon_threads = True
+
+    def __init__(self, total, count=True, max_page=None):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), StubRegistryHandler)
+        self.total = total
+        self.count = count
+        self.max_page = max_page
+        self.scripts = {}
+        self.requested = []
+        self.lock = threading.Lock()
+
+    @property
+    def endpoint(self):
+        return f'http://127.0.0.1:{self.server_address[1]}/registry/monitoring-locations/'
+
+
+class StubRegistryHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        limit = int(query['limit'][0])
+        if self.server.max_page is not None:
+            limit = min(limit, self.server.max_page)
+        offset = int(query['offset'][0])
+        with self.server.lock:
+            self.server.requested.append(offset)
+            script = self.server.scripts.get(offset, [])
+            scripted = script.pop(0) if script else None
+
+        if scripted == 'bad json':
+            self._reply(200, '{"results": [')
+        elif scripted is not None:
+            self._reply(scripted, '')
+        else:
+            payload = {
+                'results': list(range(offset, min(offset + limit, self.server.total))),
+                'next': 'more' if offset + limit < self.server.total else None,
+            }
+            if self.server.count:
+                payload['count'] = self.server.total
+            self._reply(200, dumps(payload))
+
+    def _reply(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def log_message(self, *args):
+        pass
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+class TestAsyncExtract(TestCase):
+
+    def setUp(self):
+        logging.getLogger().setLevel(level=logging.INFO)
+        self.servers = []
+        self.extract = AsyncExtract()
+        self.extract.FETCH_RETRY_DELAY = 0
+        self.extract.FETCH_WORKERS = 4
+
+    def tearDown(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+    def serve(self, total, count=True, max_page=None):
+        server = StubRegistryServer(total, count, max_page)
+        threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+        self.servers.append(server)
+        return server
+
+    def test_get_monitoring_locations(self):
+        server = self.serve(total=100)
+        records = run(self.extract.get_monitoring_locations(server.endpoint))
+        self.assertEqual(list(range(100)), records)
+        self.assertEqual(sorted(server.requested), list(range(0, 100, 8)))
+
+    def test_get_monitoring_locations_without_count(self):
+        server = self.serve(total=20, count=False)
+        records = run(self.extract.get_monitoring_locations(server.endpoint))
+        self.assertEqual(list(range(20)), records)
+        self.assertEqual([0, 8, 16], server.requested)
+
+    def test_iter_pages_from_synchronous_code(self):
+        server = self.serve(total=30)
+        pages = list(self.extract.iter_pages(server.endpoint))
+        self.assertEqual([list(range(0, 8)), list(range(8, 16)), list(range(16, 24)), list(range(24, 30))], pages)
+        self.assertEqual(list(range(30)), list(self.extract.iter_monitoring_locations(server.endpoint)))
+
+    def test_get_monitoring_locations_capped_by_registry(self):
+        server = self.serve(total=20, max_page=5)
+        records = run(self.extract.get_monitoring_locations(server.endpoint))
+        self.assertEqual(list(range(20)), records)
+        self.assertEqual([0, 5, 10, 15], server.requested)
+
+    def test_status_code_retried(self):
+        server = self.serve(total=24)
+        server.scripts[8] = [503]
+        records = run(self.extract.get_monitoring_locations(server.endpoint))
+        self.assertEqual(list(range(24)), records)
+        self.assertEqual(2, server.requested.count(8))
+
+    def test_status_code_exhausts_tries(self):
+        server = self.serve(total=24)
+        server.scripts[8] = [500, 500]
+        self.assertEqual([], run(self.extract.get_monitoring_locations(server.endpoint)))
+        self.assertEqual(self.extract.FETCH_TRIES_FOR_STATUS_CODE, server.requested.count(8))
+
+    def test_network_error_exhausts_tries(self):
+        server = self.serve(total=8)
+        endpoint = server.endpoint
+        self.tearDown()
+        self.servers = []
+        with self.assertRaises(RequestException):
+            run(_session_fetch(self.extract, self.extract.construct_url(endpoint)))
+
+    def test_bad_json_page_tolerated(self):
+        server = self.serve(total=24)
+        server.scripts[8] = ['bad json', 'bad json']
+        self.extract.FETCH_JSON_ERROR_TOLERANCE = 2
+        records = run(self.extract.get_monitoring_locations(server.endpoint))
+        self.assertEqual(list(range(0, 8)) + list(range(16, 24)), records)
+
+    def test_bad_json_beyond_tolerance(self):
+        server = self.serve(total=24)
+        server.scripts[8] = ['bad json', 'bad json']
+        server.scripts[16] = ['bad json', 'bad json']
+        with self.assertRaises(JSONDecodeError):
+            run(self.extract.get_monitoring_locations(server.endpoint))
+
+    def test_unsupported_settings_warned(self):
+        server = self.serve(total=8)
+        self.extract.FETCH_LIMIT_ADAPTIVE = True
+        self.extract.FETCH_CACHE_DIR = '/tmp/registry-cache'
+        with self.assertLogs(level=logging.WARNING) as logs:
+            records = run(self.extract.get_monitoring_locations(server.endpoint))
+        self.assertEqual(list(range(8)), records)
+        self.assertEqual(2, len([line for line in logs.output if 'async fetch engine' in line]))
+
+
+async def _session_fetch(extract, url):
+    # the session is opened inside the coroutine so that it belongs to the loop running the test
+    async with extract.session() as session:
+        return await extract.fetch_record_block(url, session)
+
@@ -0,0 +1,145 @@
+"""
+Tests for the cache.py module
+"""
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest import TestCase
+import os
+import tempfile
+import threading
+
+from ..cache import CachingSession, ResponseCache
+from ..extract import Extract
+
+
+class StubPageServer(HTTPServer):
+    """
+    Local HTTP server with one JSON page per path that honors If-None-Match when validators are enabled.
+    """
+    def __init__(self, validators=True):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), StubPageHandler)
+        self.validators = validators
+        self.version = 1
+        self.statuses = []
+        self.conditional = []
+
+    def url(self, path):
+        return f'http://127.0.0.1:{self.server_address[1]}{path}'
+
+
+class StubPageHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        etag = f'"{self.path}-{self.server.version}"'
+        self.server.conditional.append(self.headers.get('If-None-Match'))
+        if self.server.validators and self.headers.get('If-None-Match') == etag:
+            self.server.statuses.append(304)
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = f'{{"results": ["{self.path}", {self.server.version}], "next": null}}'.encode()
+        self.server.statuses.append(200)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if self.server.validators:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeTime:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestCachingSession(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.servers = []
+
+    def tearDown(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+        self.directory.cleanup()
+
+    def serve(self, validators=True):
+        server = StubPageServer(validators)
+        threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+        self.servers.append(server)
+        return server
+
+    def test_not_modified_served_from_disk(self):
+        server = self.serve()
+        url = server.url('/page?limit=8&offset=0')
+        with CachingSession(ResponseCache(self.directory.name, 1024 * 1024)) as session:
+            self.assertEqual({'results': ['/page?limit=8&offset=0', 1], 'next': None}, session.get(url).json())
+        # a later run revalidates and gets the body from disk
+        with CachingSession(ResponseCache(self.directory.name, 1024 * 1024)) as session:
+            response = session.get(url)
+            self.assertTrue(response.from_cache)
+            self.assertEqual({'results': ['/page?limit=8&offset=0', 1], 'next': None}, response.json())
+            self.assertEqual(1, session.cache.revalidated)
+        self.assertEqual([200, 304], server.statuses)
+        self.assertEqual([None, '"/page?limit=8&offset=0-1"'], server.conditional)
+
+    def test_changed_page_replaces_entry(self):
+        server = self.serve()
+        url = server.url('/page')
+        with CachingSession(ResponseCache(self.directory.name, 1024 * 1024)) as session:
+            session.get(url)
+            server.version = 2
+            self.assertEqual(['/page', 2], session.get(url).json()['results'])
+            self.assertEqual(['/page', 2], session.get(url).json()['results'])
+        self.assertEqual([200, 200, 304], server.statuses)
+
+    def test_ttl_without_validators(self):
+        server = self.serve(validators=False)
+        url = server.url('/page')
+        clock = FakeTime()
+        with CachingSession(ResponseCache(self.directory.name, 1024 * 1024, ttl=60, clock=clock)) as session:
+            session.get(url)
+            clock.now += 30
+            self.assertTrue(session.get(url).from_cache)
+            clock.now += 31
+            self.assertFalse(getattr(session.get(url), 'from_cache', False))
+        self.assertEqual([200, 200], server.statuses)
+
+    def test_no_validators_and_no_ttl_not_stored(self):
+        server = self.serve(validators=False)
+        cache = ResponseCache(self.directory.name, 1024 * 1024)
+        with CachingSession(cache) as session:
+            session.get(server.url('/page'))
+        self.assertEqual([], os.listdir(self.directory.name))
+
+    def test_least_recently_used_evicted(self):
+        server = self.serve()
+        # every body is 40 bytes, room for two of them
+        cache = ResponseCache(self.directory.name, 90)
+        with CachingSession(cache) as session:
+            session.get(server.url('/a'))
+            session.get(server.url('/b'))
+            session.get(server.url('/a'))  # /a becomes the most recently used
+            session.get(server.url('/c'))
+        self.assertIsNotNone(cache.get(server.url('/a')))
+        self.assertIsNone(cache.get(server.url('/b')))
+        self.assertIsNotNone(cache.get(server.url('/c')))
+        self.assertEqual(1, cache.evicted)
+        # a new run sees the same entries
+        self.assertEqual(2, len(ResponseCache(self.directory.name, 90).entries))
+
+    def test_extract_session_uses_cache(self):
+        server = self.serve()
+        extract = Extract()
+        extract.FETCH_CACHE_DIR = self.directory.name
+        endpoint = server.url('/registry/')
+        self.assertEqual(['/registry/?limit=8&offset=0', 1], extract.get_monitoring_locations(endpoint))
+        self.assertEqual(['/registry/?limit=8&offset=0', 1], extract.get_monitoring_locations(endpoint))
+        self.assertEqual([200, 304], server.statuses)
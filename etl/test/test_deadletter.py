@@ -0,0 +1,91 @@
+"""
+Tests for the deadletter.py module
+"""
+from datetime import datetime, timezone
+from unittest import TestCase, mock
+import os
+import tempfile
+
+import psycopg2
+
+from .fake_data import TEST_DATA
+from ..deadletter import carry_over_dead_letters, read_dead_letters, replay_dead_letters, write_dead_letters
+from ..partition import RemoteLoadError
+from ..sink import OracleSink
+from ..transform import transform_mon_loc_data
+
+
+class TestDeadLetters(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'dead_letters.ndjson')
+        self.mon_loc = transform_mon_loc_data(TEST_DATA)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        letters = [('postgres', self.mon_loc, psycopg2.IntegrityError('duplicate key')),
+                   ('oracle', self.mon_loc, RemoteLoadError('DatabaseError', 'ORA-01400: cannot insert NULL'))]
+
+        self.assertEqual(2, write_dead_letters(self.path, letters))
+        read = read_dead_letters(self.path)
+
+        self.assertEqual(['postgres', 'oracle'], [sink_name for sink_name, _, _ in read])
+        self.assertEqual(self.mon_loc, read[0][1])
+        self.assertEqual(datetime(2020, 9, 10, 20, 40, 3, 504235, tzinfo=timezone.utc), read[0][1]['INSERT_DATE'])
+        self.assertEqual(list(self.mon_loc), list(read[0][1]))
+        self.assertEqual('IntegrityError: duplicate key', str(read[0][2]))
+        self.assertEqual('DatabaseError: ORA-01400: cannot insert NULL', str(read[1][2]))
+
+    def test_unreadable_lines_skipped(self):
+        write_dead_letters(self.path, [('oracle', self.mon_loc, ValueError('rejected'))])
+        with open(self.path, 'a') as dead_letter_file:
+            dead_letter_file.write('{"sink": "oracle", \n\n')
+
+        self.assertEqual(1, len(read_dead_letters(self.path)))
+
+    @mock.patch('etl.sink.refresh_well_registry_mv')
+    def test_letters_kept_until_loaded(self, mock_refresh):
+        def run(site_nos, rejected_site_nos):
+            def load(connect, mon_locs):
+                return [(mon_loc['AGENCY_CD'], mon_loc['SITE_NO'], ValueError('rejected'))
+                        for mon_loc in mon_locs if mon_loc['SITE_NO'] in rejected_site_nos]
+            previous = read_dead_letters(self.path) if os.path.exists(self.path) else []
+            sink = OracleSink(mock.Mock(), batch_size=10, load=load).start()
+            for site_no in site_nos:
+                sink.put(dict(self.mon_loc, SITE_NO=site_no))
+            sink.close()
+            sink.join()
+            write_dead_letters(self.path, carry_over_dead_letters(previous, [sink]) + sink.dead_letters())
+            return sorted((sink_name, mon_loc['SITE_NO']) for sink_name, mon_loc, _ in read_dead_letters(self.path))
+
+        self.assertEqual([('oracle', 'CA-1'), ('oracle', 'CA-2')], run(['CA-1', 'CA-2', 'CA-3'], {'CA-1', 'CA-2'}))
+        # a run that does not touch CA-1 keeps its letter, CA-2 failing again is not written twice
+        self.assertEqual([('oracle', 'CA-1'), ('oracle', 'CA-2')], run(['CA-2', 'CA-4'], {'CA-2'}))
+        self.assertEqual([('oracle', 'CA-1')], run(['CA-2'], set()))
+
+    def test_letters_of_other_databases_carried_over(self):
+        letters = [('postgres', dict(self.mon_loc, SITE_NO='CA-1'), ValueError('rejected'))]
+        sink = OracleSink(mock.Mock(), batch_size=10)
+        sink.touched.add((self.mon_loc['AGENCY_CD'], 'CA-1'))
+
+        self.assertEqual(letters, carry_over_dead_letters(letters, [sink]))
+
+    @mock.patch('etl.sink.refresh_well_registry_mv')
+    def test_replay(self, mock_refresh):
+        loaded = []
+
+        def load(connect, mon_locs):
+            loaded.extend(mon_loc['SITE_NO'] for mon_loc in mon_locs)
+            return []
+        letters = [('oracle', dict(self.mon_loc, SITE_NO='CA-1'), ValueError('rejected')),
+                   ('postgres', dict(self.mon_loc, SITE_NO='CA-2'), ValueError('rejected'))]
+        sink = OracleSink(mock.Mock(), batch_size=10, load=load)
+
+        kept = replay_dead_letters(letters, [sink])
+
+        self.assertEqual(['CA-1'], loaded)
+        self.assertEqual(letters[1:], kept)
+        self.assertTrue(sink.refreshed)
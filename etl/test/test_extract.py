@@ -11,9 +11,13 @@ from requests import Response, Session, HTTPError, RequestException
 import logging
 import mockito
 import copy
+import threading
+import time
 
+from .test_retry import FakeClock
 # file under test
-from ..extract import Extract
+from ..extract import Extract, PageSizeTuner
+from ..retry import ExponentialBackoff
 
 
 class MockExtract(Extract):
@@ -48,6 +52,49 @@ class MockResponse:
         return {'next': None, 'count': 2, 'results': ['dummyone', 'dummytwo']}
 
 
+class FakePagedSession:
+    """
+    Thread safe stand in for a requests Session serving a fixed registry of records by offset.
+    Later pages answer sooner so that concurrent fetches complete out of order.
+    A max_page caps the records of every page whatever the limit asked for.
+    """
+    def __init__(self, total, count=True, fail_above=None, max_page=None):
+        self.total = total
+        self.count = count
+        self.fail_above = fail_above
+        self.max_page = max_page
+        self.lock = threading.Lock()
+        self.requested = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def get(self, url):
+        offset = int(url.split('offset=')[1])
+        limit = int(url.split('limit=')[1].split('&')[0])
+        with self.lock:
+            self.requested.append(offset)
+        if self.fail_above is not None and limit > self.fail_above:
+            response = mocki({'text': '', 'status_code': 503}, spec=Response)
+            when(response).raise_for_status().thenRaise(HTTPError('unavailable', response=response))
+            return response
+        time.sleep(max(0, (self.total - offset) / self.total) * 0.02)
+        if self.max_page is not None:
+            limit = min(limit, self.max_page)
+        payload = {
+            'results': list(range(offset, min(offset + limit, self.total))),
+            'next': 'more' if offset + limit < self.total else None,
+        }
+        if self.count:
+            payload['count'] = self.total
+        response = mocki({'text': '', 'status_code': 200}, spec=Response)
+        when(response).json().thenReturn(payload)
+        return response
+
+
 class TestGetMonitoringLocations(TestCase):
 
     def setUp(self):
@@ -122,6 +169,17 @@ class TestGetMonitoringLocations(TestCase):
             url = self.extract.construct_url(url)
         self.assertEqual(self.fake_endpoint + '?limit=8&offset=128', url)
 
+    def test_construct_url_with_changing_limit(self):
+        url = self.extract.construct_url(self.fake_endpoint, 16)
+        self.assertEqual(self.fake_endpoint + '?limit=16&offset=0', url)
+        url = self.extract.construct_url(url, 32)
+        self.assertEqual(self.fake_endpoint + '?limit=32&offset=16', url)
+        url = self.extract.construct_url(url, 8)
+        self.assertEqual(self.fake_endpoint + '?limit=8&offset=48', url)
+        url = self.extract.construct_url(url)
+        self.assertEqual(self.fake_endpoint + '?limit=8&offset=56', url)
+        self.assertEqual(self.fake_endpoint + '?limit=4&offset=56', self.extract.replace_limit(url, 4))
+
     def test_get_monitoring_locations_3_success(self):
         # with mock.patch.object(Session, 'get', return_value=self.MockResponse(200)):
         #     pass
@@ -345,3 +403,191 @@ class TestGetMonitoringLocations(TestCase):
         self.assertRaises(RequestException,
                           lambda: self.extract.fetch_record_block(self.fake_endpoint, self.mock_session))
         mockito.verify(self.mock_session, times=self.extract.FETCH_TRIES_FOR_NETWORK_ERROR).get(self.fake_endpoint)
+
+    def test_iter_pages_yields_each_page_before_fetching_the_next(self):
+        fake_first_url = self.fake_endpoint + '?limit=8&offset=0'
+        fake_second_url = self.fake_endpoint + '?limit=8&offset=8'
+
+        mock_response_a = mocki({'text': self.mock_json_good, 'status_code': 200}, spec=Response)
+        mock_payload_a = {'results': [{'site_no': 'a1'}, {'site_no': 'a2'}], 'next': fake_second_url}
+        when(mock_response_a).json().thenReturn(mock_payload_a)
+
+        mock_response_b = mocki({'text': self.mock_json_good, 'status_code': 200}, spec=Response)
+        mock_payload_b = {'results': [{'site_no': 'b1'}], 'next': None}
+        when(mock_response_b).json().thenReturn(mock_payload_b)
+
+        when(self.mock_session).get(fake_first_url).thenReturn(mock_response_a)
+        when(self.mock_session).get(fake_second_url).thenReturn(mock_response_b)
+
+        pages = self.extract.iter_pages(self.fake_endpoint)
+        self.assertEqual(mock_payload_a['results'], next(pages))
+        # the second page is only requested once the first one has been consumed
+        mockito.verify(self.mock_session, times=0).get(fake_second_url)
+        self.assertEqual(mock_payload_b['results'], next(pages))
+        self.assertRaises(StopIteration, lambda: next(pages))
+
+    def test_iter_monitoring_locations_raises_after_yielding_good_pages(self):
+        fake_first_url = self.fake_endpoint + '?limit=8&offset=0'
+        fake_second_url = self.fake_endpoint + '?limit=8&offset=8'
+
+        mock_response_a = mocki({'text': self.mock_json_good, 'status_code': 200}, spec=Response)
+        when(mock_response_a).json().thenReturn({'results': ['one', 'two'], 'next': fake_second_url})
+        when(self.mock_session).get(fake_first_url).thenReturn(mock_response_a)
+        when(self.mock_session).get(fake_second_url).thenReturn(None)
+
+        records = []
+        with self.assertRaises(RequestException):
+            for record in self.extract.iter_monitoring_locations(self.fake_endpoint):
+                records.append(record)
+        self.assertEqual(['one', 'two'], records)
+        # the list based API still reports nothing when extraction cannot complete
+        self.assertEqual([], self.extract.get_monitoring_locations(self.fake_endpoint))
+
+    def test_iter_pages_parallel_in_offset_order(self):
+        session = FakePagedSession(total=100)
+        extract = MockExtract(session)
+        extract.FETCH_WORKERS = 4
+
+        pages = list(extract.iter_pages(self.fake_endpoint))
+
+        self.assertEqual(13, len(pages))
+        self.assertEqual(list(range(100)), [record for page in pages for record in page])
+        self.assertEqual(sorted(session.requested), list(range(0, 100, 8)))
+
+    def test_iter_pages_parallel_without_count_falls_back_to_serial(self):
+        session = FakePagedSession(total=20, count=False)
+        extract = MockExtract(session)
+        extract.FETCH_WORKERS = 4
+
+        self.assertEqual(list(range(20)), extract.get_monitoring_locations(self.fake_endpoint))
+        self.assertEqual([0, 8, 16], session.requested)
+
+    def test_iter_pages_parallel_network_failure(self):
+        session = FakePagedSession(total=40)
+        extract = MockExtract(session)
+        extract.FETCH_WORKERS = 2
+        failing_url = self.fake_endpoint + '?limit=8&offset=16'
+        original_get = session.get
+        session.get = lambda url: None if url == failing_url else original_get(url)
+
+        records = []
+        with self.assertRaises(RequestException):
+            for page in extract.iter_pages(self.fake_endpoint):
+                records.extend(page)
+        self.assertEqual(list(range(16)), records)
+
+    def test_session_pool_sized_for_workers(self):
+        extract = Extract()
+        extract.FETCH_WORKERS = 6
+        with extract.session() as session:
+            self.assertEqual(6, session.get_adapter(self.fake_endpoint)._pool_maxsize)
+
+    def test_adaptive_page_size_grows_for_fast_responses(self):
+        session = FakePagedSession(total=200)
+        extract = MockExtract(session)
+        extract.FETCH_LIMIT_ADAPTIVE = True
+        extract.FETCH_LIMIT_MAX = 64
+
+        self.assertEqual(list(range(200)), extract.get_monitoring_locations(self.fake_endpoint))
+        # the limit doubles per page up to the maximum and the offsets stay contiguous
+        self.assertEqual([0, 8, 24, 56, 120, 184], session.requested)
+
+    def test_adaptive_page_size_backs_off_after_overload(self):
+        session = FakePagedSession(total=40, fail_above=16)
+        extract = MockExtract(session)
+        extract.FETCH_LIMIT = 32
+        extract.FETCH_LIMIT_ADAPTIVE = True
+        extract.FETCH_LIMIT_MAX = 32
+
+        self.assertEqual(list(range(40)), extract.get_monitoring_locations(self.fake_endpoint))
+        # both tries at 32 records fail, then the same offset succeeds at 16 records
+        self.assertEqual(extract.FETCH_TRIES_FOR_STATUS_CODE + 1, session.requested.count(0))
+        self.assertEqual([0, 0, 0, 16, 32], session.requested)
+
+    def test_adaptive_page_size_capped_by_registry(self):
+        session = FakePagedSession(total=100, max_page=20)
+        extract = MockExtract(session)
+        extract.FETCH_LIMIT_ADAPTIVE = True
+        extract.FETCH_LIMIT_MAX = 64
+
+        self.assertEqual(list(range(100)), extract.get_monitoring_locations(self.fake_endpoint))
+        # the short page of 20 records is not the end, the offsets advance by the records returned
+        self.assertEqual([0, 8, 24, 44, 64, 84], session.requested)
+
+    def test_iter_pages_parallel_capped_by_registry_falls_back_to_serial(self):
+        session = FakePagedSession(total=30, max_page=5)
+        extract = MockExtract(session)
+        extract.FETCH_WORKERS = 4
+
+        self.assertEqual(list(range(30)), extract.get_monitoring_locations(self.fake_endpoint))
+        self.assertEqual([0, 5, 10, 15, 20, 25], session.requested)
+
+    def test_next_offset(self):
+        url = self.fake_endpoint + '?limit=64&offset=40'
+        next_url = self.fake_endpoint + '?limit=20&offset=60'
+        self.assertEqual(60, self.extract.next_offset(url, {'results': [1] * 20, 'next': next_url}))
+        self.assertEqual(50, self.extract.next_offset(url, {'results': [1] * 10, 'next': 'more'}))
+        self.assertIsNone(self.extract.next_offset(url, {'results': [], 'next': 'more'}))
+        self.assertEqual(self.fake_endpoint + '?limit=64&offset=50', self.extract.construct_url(url, None, 50))
+
+    def test_page_size_tuner_targets_response_time(self):
+        tuner = PageSizeTuner(100, 10, 1000, target_seconds=2.0, max_bytes=1000)
+        self.assertEqual(200, tuner.observe(0.5, 100))  # growth is damped to double
+        self.assertEqual(160, tuner.observe(2.5, 200))
+        tuner.last_bytes = 3000
+        self.assertEqual(80, tuner.observe(1.0, 160))  # the body is 3 times the byte target, damped to half
+        self.assertEqual(80, tuner.observe(0.1, 20))  # a short last page does not change the limit
+        self.assertEqual('80 x1, 100 x1, 160 x1, 200 x1', tuner.summary())
+
+    def test_page_size_tuner_capped_by_registry(self):
+        tuner = PageSizeTuner(100, 10, 1000, target_seconds=2.0)
+        self.assertEqual(50, tuner.observe(0.5, 50, more=True))
+        self.assertEqual(50, tuner.observe(0.1, 50, more=True))  # never asks for more than the cap again
+
+    def test_fetch_record_block_rate_limited_waits_retry_after(self):
+        clock = FakeClock()
+        self.extract.FETCH_RETRY_POLICY = ExponentialBackoff(10, 120, retry_budget=10, clock=clock)
+
+        mock_response_a = mocki({'text': '', 'status_code': 429, 'headers': {'Retry-After': '30'}}, spec=Response)
+        mock_response_b = mocki({'text': 'place holder', 'status_code': 200}, spec=Response)
+        when(mock_response_a).raise_for_status().thenRaise(HTTPError('too many', response=mock_response_a))
+        when(mock_response_b).json().thenReturn(self.mock_json_payload)
+        # more 429 responses than FETCH_TRIES_FOR_STATUS_CODE allows for other status codes
+        when(self.mock_session).get(self.fake_endpoint).thenReturn(mock_response_a).thenReturn(mock_response_a)\
+            .thenReturn(mock_response_a).thenReturn(mock_response_b)
+
+        json_response = self.extract.fetch_record_block(self.fake_endpoint, self.mock_session)
+
+        self.assertEqual(self.mock_json_payload, json_response)
+        self.assertEqual([30, 30, 30], clock.sleeps)
+        self.assertEqual(3, self.extract.retry_policy().retries)
+        self.assertEqual(90, self.extract.retry_policy().seconds_slept)
+
+    def test_fetch_record_block_rate_limited_exhausts_tries(self):
+        clock = FakeClock()
+        self.extract.FETCH_RETRY_POLICY = ExponentialBackoff(10, 120, retry_budget=None, clock=clock)
+
+        mock_response = mocki({'text': '', 'status_code': 429, 'headers': {'Retry-After': '30'}}, spec=Response)
+        when(mock_response).raise_for_status().thenRaise(HTTPError('too many', response=mock_response))
+        when(self.mock_session).get(self.fake_endpoint).thenReturn(mock_response)
+
+        with self.assertRaises(RequestException) as context:
+            self.extract.fetch_record_block(self.fake_endpoint, self.mock_session)
+        self.assertIs(mock_response, context.exception.response)
+        mockito.verify(self.mock_session, times=self.extract.FETCH_TRIES_FOR_RATE_LIMIT).get(self.fake_endpoint)
+        self.assertEqual([30] * (self.extract.FETCH_TRIES_FOR_RATE_LIMIT - 1), clock.sleeps)
+
+    def test_fetch_record_block_retry_budget_spent(self):
+        clock = FakeClock()
+        self.extract.FETCH_RETRY_POLICY = ExponentialBackoff(10, 120, retry_budget=1, clock=clock)
+        self.extract.FETCH_TRIES_FOR_NETWORK_ERROR = 5
+
+        when(self.mock_session).get(self.fake_endpoint).thenReturn(None)
+
+        # the first request may retry once, the second has no budget left
+        self.assertRaises(RequestException,
+                          lambda: self.extract.fetch_record_block(self.fake_endpoint, self.mock_session))
+        self.assertRaises(RequestException,
+                          lambda: self.extract.fetch_record_block(self.fake_endpoint, self.mock_session))
+        mockito.verify(self.mock_session, times=3).get(self.fake_endpoint)
+        self.assertEqual(1, len(clock.sleeps))
@@ -0,0 +1,72 @@
+"""
+Tests for the fingerprint.py module
+"""
+from unittest import TestCase
+import os
+import tempfile
+
+from .fake_data import TEST_DATA
+from ..fingerprint import FingerprintIndex, row_fingerprint
+from ..transform import transform_mon_loc_data
+
+
+class TestRowFingerprint(TestCase):
+
+    def setUp(self):
+        self.test_data = transform_mon_loc_data(TEST_DATA)
+
+    def test_key_order_does_not_matter(self):
+        reordered = dict(reversed(list(self.test_data.items())))
+        self.assertEqual(row_fingerprint(self.test_data), row_fingerprint(reordered))
+
+    def test_any_change_changes_fingerprint(self):
+        changed = dict(self.test_data, SITE_NAME='Charmeleon')
+        self.assertNotEqual(row_fingerprint(self.test_data), row_fingerprint(changed))
+        changed = dict(self.test_data, WELL_DEPTH='')
+        self.assertNotEqual(row_fingerprint(self.test_data), row_fingerprint(changed))
+
+
+class TestFingerprintIndex(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'index.sqlite')
+        self.test_data = transform_mon_loc_data(TEST_DATA)
+        self.digest = row_fingerprint(self.test_data)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_recorded_rows_are_unchanged_in_the_next_run(self):
+        with FingerprintIndex(self.path) as index:
+            self.assertFalse(index.unchanged('oracle', self.test_data, self.digest))
+            index.record('oracle', self.test_data, self.digest)
+
+        with FingerprintIndex(self.path) as index:
+            self.assertTrue(index.unchanged('oracle', self.test_data, self.digest))
+            # each sink has its own fingerprints
+            self.assertFalse(index.unchanged('postgres', self.test_data, self.digest))
+            changed = dict(self.test_data, SITE_NAME='Charmeleon')
+            self.assertFalse(index.unchanged('oracle', changed, row_fingerprint(changed)))
+
+    def test_records_are_batched(self):
+        index = FingerprintIndex(self.path, flush_every=2)
+        index.record('oracle', self.test_data, self.digest)
+        self.assertFalse(FingerprintIndex(self.path).unchanged('oracle', self.test_data, self.digest))
+        other = dict(self.test_data, SITE_NO='CA-192903')
+        index.record('oracle', other, row_fingerprint(other))
+        self.assertTrue(FingerprintIndex(self.path).unchanged('oracle', self.test_data, self.digest))
+        index.close()
+
+    def test_clear_forgets_the_sink(self):
+        other = dict(self.test_data, SITE_NO='CA-192903')
+        with FingerprintIndex(self.path) as index:
+            index.record('oracle', self.test_data, self.digest)
+            index.record('oracle', other, row_fingerprint(other))
+            index.record('postgres', other, row_fingerprint(other))
+
+            self.assertEqual(2, index.clear('oracle'))
+
+            self.assertFalse(index.unchanged('oracle', self.test_data, self.digest))
+            self.assertFalse(index.unchanged('oracle', other, row_fingerprint(other)))
+            self.assertTrue(index.unchanged('postgres', other, row_fingerprint(other)))
@@ -1,60 +1,350 @@
 """
 Tests for the load.py module
 """
+import re
+from datetime import datetime, timezone
 from unittest import TestCase, mock
 
+import cx_Oracle
+import psycopg2
+
 from .fake_data import TEST_DATA
 from ..transform import transform_mon_loc_data
-from ..load import load_monitoring_location, refresh_well_registry_mv
+from ..load import load_monitoring_location, load_monitoring_locations, load_monitoring_location_pg, \
+    load_monitoring_locations_by_row, load_monitoring_locations_pg_by_row, \
+    load_monitoring_locations_pg, refresh_well_registry_mv, refresh_well_registry_pg, swap_well_registry_pg, \
+    oracle_upsert_template, pg_upsert_template, pg_columns, \
+    TIME_COLUMNS
 
 
 class TestLoadMonitoringLocation(TestCase):
 
     def setUp(self):
-        self.test_user = 'stealthy_squid'
-        self.test_password = 'barnacles'
-        self.test_connect_str = 'fakedb.usgs.gov:1521/unterseeboot'
         self.test_data = transform_mon_loc_data(TEST_DATA)
 
-    @mock.patch('etl.load.cx_Oracle', autospec=True)
-    def test_load_monitoring_location(self, mock_ora):
+    def test_load_monitoring_location(self):
         mock_cursor = mock.MagicMock()
         mock_cursor.execute.return_value = mock.Mock()
 
         mock_client = mock.MagicMock()
         mock_client.cursor.return_value = mock_cursor
-        # override the context manager's `__enter__` method to make sure the mock object is returned
-        mock_client.__enter__.return_value = mock_client
-        mock_ora.connect.return_value = mock_client
 
-        load_monitoring_location(self.test_user, self.test_password, self.test_connect_str, self.test_data)
+        load_monitoring_location(mock_client, self.test_data)
 
-        mock_ora.connect.assert_called()
         mock_client.cursor.assert_called()
         mock_cursor.execute.assert_called()
         mock_client.commit.assert_called()
+        statement, binds = mock_cursor.execute.call_args[0]
+        self.assertNotIn('CADWR', statement)
+        self.assertEqual('CADWR', binds[0])
 
 
-class TestRefreshWellRegistryMV(TestCase):
+class TestUpsertTemplates(TestCase):
 
     def setUp(self):
-        self.test_user = 'sticky_limpet'
-        self.test_password = 'clownfish'
-        self.test_connect_str = 'fakedb.usgs.gov:1521/catamaran'
+        self.test_data = transform_mon_loc_data(TEST_DATA)
 
-    @mock.patch('etl.load.cx_Oracle', autospec=True)
-    def test_refresh(self, mock_ora):
-        mock_cursor = mock.MagicMock()
-        mock_cursor.execute.return_value = mock.Mock()
+    def test_oracle_template_built_once_per_column_set(self):
+        columns = tuple(self.test_data.keys())
+        template = oracle_upsert_template(columns)
 
+        self.assertIs(template, oracle_upsert_template(tuple(dict(self.test_data).keys())))
+        self.assertEqual(len(columns), len(re.findall(r':\d+ ', template.statement)))
+        self.assertEqual(len(TIME_COLUMNS), template.input_sizes.count(cx_Oracle.TIMESTAMP))
+        self.assertEqual(len(columns), len(template.binds(self.test_data)))
+
+    def test_pg_template_binds_geometry(self):
+        template = pg_upsert_template(pg_columns(self.test_data))
+        binds = template.binds(self.test_data)
+
+        self.assertNotIn('INSERT_USER_ID', template.statement)
+        self.assertEqual(len(binds), template.statement.count('%s'))
+        self.assertEqual((self.test_data['DEC_LONG_VA'], self.test_data['DEC_LAT_VA']), binds[-2:])
+        self.assertIn(f'${len(binds)}::double precision', template.prepare)
+
+    def test_pg_statement_prepared_once_per_connection(self):
+        mock_cursor = mock.MagicMock()
         mock_client = mock.MagicMock()
         mock_client.cursor.return_value = mock_cursor
-        # override the context manager's `__enter__` method to make sure the mock object is returned
-        mock_client.__enter__.return_value = mock_client
-        mock_ora.connect.return_value = mock_client
 
-        refresh_well_registry_mv(self.test_user, self.test_password, self.test_connect_str)
+        load_monitoring_location_pg(mock_client, self.test_data)
+        load_monitoring_location_pg(mock_client, dict(self.test_data, SITE_NO='CA-1'))
 
-        mock_ora.connect.assert_called()
-        mock_client.cursor.assert_called()
-        mock_cursor.execute.assert_called()
\ No newline at end of file
+        statements = [call[0][0] for call in mock_cursor.execute.call_args_list]
+        self.assertEqual(1, len([statement for statement in statements if statement.startswith('PREPARE')]))
+        self.assertEqual(2, len([statement for statement in statements if statement.startswith('EXECUTE')]))
+
+
+class TestLoadMonitoringLocations(TestCase):
+
+    def setUp(self):
+        self.test_data = transform_mon_loc_data(TEST_DATA)
+        self.mon_locs = [dict(self.test_data, SITE_NO=f'CA-{site}') for site in range(5)]
+        self.mock_cursor = mock.MagicMock()
+        self.mock_cursor.getbatcherrors.return_value = []
+        self.mock_client = mock.MagicMock()
+        self.mock_client.cursor.return_value = self.mock_cursor
+
+    def test_one_merge_and_commit_per_chunk(self):
+        failed = load_monitoring_locations(self.mock_client, iter(self.mon_locs), chunk_size=2)
+
+        self.assertEqual([], failed)
+        self.assertEqual(3, self.mock_cursor.executemany.call_count)
+        self.assertEqual(3, self.mock_client.commit.call_count)
+        statement, rows = self.mock_cursor.executemany.call_args_list[0][0]
+        self.assertEqual({'batcherrors': True}, self.mock_cursor.executemany.call_args_list[0][1])
+        # one statement text with bind variables for every row
+        self.assertEqual(1, len({call[0][0] for call in self.mock_cursor.executemany.call_args_list}))
+        columns = list(self.test_data.keys())
+        self.assertIn('USING (SELECT :1 AGENCY_CD,:2 AGENCY_NM,', statement)
+        self.assertIn(f":{columns.index('SITE_NO') + 1} SITE_NO,", statement)
+        self.assertIn(f":{columns.index('INSERT_DATE') + 1} INSERT_DATE", statement)
+        self.assertNotIn('to_timestamp', statement)
+        self.assertEqual(datetime(2020, 9, 10, 20, 40, 3, 504235, timezone.utc), rows[0][columns.index('INSERT_DATE')])
+        input_sizes = self.mock_cursor.setinputsizes.call_args[0]
+        self.assertEqual(cx_Oracle.TIMESTAMP, input_sizes[columns.index('UPDATE_DATE')])
+        self.assertNotIn('CA-0', statement)
+        self.assertEqual(['CA-0', 'CA-1'], [row[columns.index('SITE_NO')] for row in rows])
+        self.assertEqual('0', rows[0][columns.index('DISPLAY_FLAG')])
+        self.assertEqual('', rows[0][columns.index('ALT_ACY')])
+
+    def test_batch_errors_mapped_to_keys(self):
+        batch_error = mock.Mock(offset=1, message='ORA-01400: cannot insert NULL')
+        self.mock_cursor.getbatcherrors.side_effect = [[batch_error], [], []]
+
+        failed = load_monitoring_locations(self.mock_client, self.mon_locs, chunk_size=2)
+
+        self.assertEqual([('CADWR', 'CA-1')], [(agency_cd, site_no) for agency_cd, site_no, _ in failed])
+        self.assertIs(batch_error, failed[0][2].args[0])
+        self.assertEqual(3, self.mock_client.commit.call_count)
+
+
+class TestLoadByRow(TestCase):
+
+    def setUp(self):
+        self.test_data = transform_mon_loc_data(TEST_DATA)
+        self.mon_locs = [dict(self.test_data, SITE_NO=f'CA-{site}') for site in range(5)]
+        self.mock_cursor = mock.MagicMock()
+        self.mock_client = mock.MagicMock()
+        self.mock_client.cursor.return_value = self.mock_cursor
+
+    def executed(self):
+        return [call[0][0] for call in self.mock_cursor.execute.call_args_list]
+
+    def test_commit_every_n_rows(self):
+        failed = load_monitoring_locations_by_row(self.mock_client, self.mon_locs, commit_every=2)
+
+        self.assertEqual([], failed)
+        self.assertEqual(5, self.executed().count('SAVEPOINT row_upsert'))
+        self.assertEqual(3, self.mock_client.commit.call_count)
+
+    def test_rejected_row_rolled_back_alone(self):
+        def execute(statement, params=None):
+            if statement.startswith('MERGE') and 'CA-3' in params:
+                raise cx_Oracle.DatabaseError('ORA-01400: cannot insert NULL')
+        self.mock_cursor.execute.side_effect = execute
+
+        failed = load_monitoring_locations_by_row(self.mock_client, self.mon_locs, commit_every=10)
+
+        self.assertEqual([('CADWR', 'CA-3')], [(agency_cd, site_no) for agency_cd, site_no, _ in failed])
+        self.assertEqual(1, self.executed().count('ROLLBACK TO SAVEPOINT row_upsert'))
+        self.mock_client.rollback.assert_not_called()
+        self.mock_client.commit.assert_called_once()
+
+    def test_pg_rows_share_a_transaction(self):
+        failed = load_monitoring_locations_pg_by_row(self.mock_client, self.mon_locs, commit_every=100)
+
+        self.assertEqual([], failed)
+        self.assertEqual(5, len([statement for statement in self.executed() if statement.startswith('EXECUTE')]))
+        self.mock_client.commit.assert_called_once()
+
+
+class TestLoadMonitoringLocationsPg(TestCase):
+
+    def setUp(self):
+        self.test_data = transform_mon_loc_data(TEST_DATA)
+        self.mon_locs = [dict(self.test_data, SITE_NO=f'CA-{site}') for site in range(3)]
+        self.mock_cursor = mock.MagicMock()
+        self.mock_client = mock.MagicMock()
+        self.mock_client.cursor.return_value = self.mock_cursor
+        self.copied = []
+        self.mock_cursor.copy_expert.side_effect = lambda sql, buffer: self.copied.append((sql, buffer.read()))
+
+    def executed(self):
+        return [call[0][0] for call in self.mock_cursor.execute.call_args_list]
+
+    def test_copy_then_one_set_based_upsert(self):
+        self.mon_locs[1]['SITE_NAME'] = 'Tab\there'
+        failed = load_monitoring_locations_pg(self.mock_client, self.mon_locs + [dict(self.mon_locs[0])])
+
+        self.assertEqual([], failed)
+        sql, data = self.copied[0]
+        self.assertTrue(sql.startswith('COPY "WELL_REGISTRY_LOAD" ("AGENCY_CD","AGENCY_NM"'))
+        self.assertNotIn('INSERT_USER_ID', sql)
+        lines = data.splitlines()
+        self.assertEqual(3, len(lines))  # the duplicate key is sent once
+        self.assertIn('Tab\\there', lines[1])
+        self.assertIn('\\N', lines[0])
+        statements = self.executed()
+        self.assertIn('ON COMMIT DROP AS SELECT', statements[0])
+        upsert = statements[-1]
+        self.assertTrue(upsert.startswith('INSERT INTO "GW_DATA_PORTAL"."WELL_REGISTRY_MAIN"'))
+        self.assertIn('ST_SetSRID(ST_MakePoint("DEC_LONG_VA"::double precision', upsert)
+        self.assertIn('"GEOM"=EXCLUDED."GEOM"', upsert)
+        self.mock_client.commit.assert_called_once()
+
+    def test_failed_rows_reported_by_key(self):
+        def execute(statement, params=None):
+            if statement.startswith('INSERT') and (params is None or params[1] == 'CA-1'):
+                raise psycopg2.IntegrityError('null value in column')
+        self.mock_cursor.execute.side_effect = execute
+
+        failed = load_monitoring_locations_pg(self.mock_client, self.mon_locs)
+
+        self.assertEqual([('CADWR', 'CA-1')], [(agency_cd, site_no) for agency_cd, site_no, _ in failed])
+        self.assertIn('ROLLBACK TO SAVEPOINT bulk_upsert', self.executed())
+        self.assertEqual(1, self.executed().count('ROLLBACK TO SAVEPOINT row_upsert'))
+        self.mock_client.commit.assert_called_once()
+
+    def test_copy_failure_falls_back_to_row_upserts(self):
+        self.mock_cursor.copy_expert.side_effect = psycopg2.DataError('invalid input syntax')
+
+        failed = load_monitoring_locations_pg(self.mock_client, self.mon_locs)
+
+        self.assertEqual([], failed)
+        self.mock_client.rollback.assert_called_once()
+        self.assertEqual(3, self.executed().count('SAVEPOINT row_upsert'))
+        self.mock_client.commit.assert_called_once()
+
+
+class TestRefreshWellRegistryPg(TestCase):
+
+    def setUp(self):
+        self.mock_cursor = mock.MagicMock()
+        self.mock_cursor.rowcount = 2
+        self.copied = []
+        self.mock_cursor.copy_expert.side_effect = lambda sql, buffer: self.copied.append((sql, buffer.read()))
+        self.mock_client = mock.MagicMock()
+        self.mock_client.cursor.return_value = self.mock_cursor
+
+    def executed(self):
+        return [call[0][0] for call in self.mock_cursor.execute.call_args_list]
+
+    def test_full_rebuild(self):
+        self.assertEqual((2, 2), refresh_well_registry_pg(self.mock_client))
+
+        statements = self.executed()
+        self.assertEqual(2, len(statements))
+        self.assertTrue(statements[0].startswith('delete from "GW_DATA_PORTAL"."WELL_REGISTRY_MV"'))
+        self.assertTrue(statements[1].endswith('from "GW_DATA_PORTAL"."WELL_REGISTRY";'))
+        self.assertEqual([], self.copied)
+        self.mock_client.commit.assert_called_once()
+
+    def test_delta(self):
+        self.assertEqual((6, 2), refresh_well_registry_pg(self.mock_client, {('USGS', '4300')}))
+
+        statements = self.executed()
+        self.assertEqual([('COPY "WELL_REGISTRY_MV_KEYS" ("AGENCY_CD", "SITE_NO") FROM STDIN', 'USGS\t4300\n')],
+                         self.copied)
+        self.assertNotIn('delete from "GW_DATA_PORTAL"."WELL_REGISTRY_MV";', statements)
+        self.assertIn('using "WELL_REGISTRY_MV_KEYS"', statements[2])
+        self.assertIn('not exists', statements[3])
+        # rows left stale by an earlier refresh that failed are rewritten as well
+        self.assertIn('wr."UPDATE_DATE" is distinct from mv."UPDATE_DATE"', statements[4])
+        self.assertTrue(statements[5].startswith('insert into "GW_DATA_PORTAL"."WELL_REGISTRY_MV"'))
+        self.assertIn('not exists', statements[5])
+        self.mock_client.commit.assert_called_once()
+
+
+class TestSwapWellRegistryPg(TestCase):
+
+    def setUp(self):
+        self.mock_cursor = mock.MagicMock()
+        self.mock_cursor.rowcount = 3
+        self.mock_cursor.fetchall.side_effect = [
+            [],
+            [('WELL_REGISTRY_MV_GEOM', 'CREATE INDEX "WELL_REGISTRY_MV_GEOM" ON "GW_DATA_PORTAL"."WELL_REGISTRY_MV" '
+                                       'USING gist ("GEOM")', None),
+             ('WELL_REGISTRY_MV_pkey', 'CREATE UNIQUE INDEX "WELL_REGISTRY_MV_pkey" ON '
+                                       '"GW_DATA_PORTAL"."WELL_REGISTRY_MV" USING btree ("AGENCY_CD", "SITE_NO")', 'p')],
+            [('PUBLIC', 'SELECT'), ('ngwmn_reader', 'SELECT')],
+            [('CREATE TRIGGER audit AFTER UPDATE ON "GW_DATA_PORTAL"."WELL_REGISTRY_MV" FOR EACH ROW '
+              'EXECUTE FUNCTION "GW_DATA_PORTAL".audit()', '"GW_DATA_PORTAL"."WELL_REGISTRY_MV"')],
+            [('by_agency', 'PERMISSIVE', ['ngwmn_reader', 'public'], 'SELECT', '("AGENCY_CD" = CURRENT_USER)', None)],
+        ]
+        self.mock_cursor.fetchone.return_value = ('ngwmn_owner', True, False, 'ngwmn_etl')
+        self.mock_client = mock.MagicMock()
+        self.mock_client.cursor.return_value = self.mock_cursor
+
+    def test_swap(self):
+        self.assertEqual(3, swap_well_registry_pg(self.mock_client))
+
+        statements = [call[0][0] for call in self.mock_cursor.execute.call_args_list]
+        insert = statements.index(next(sql for sql in statements if sql.startswith('insert')))
+        self.assertTrue(statements[insert].startswith('insert into "GW_DATA_PORTAL"."WELL_REGISTRY_MV_SWAP"'))
+        self.assertIn('CREATE INDEX "WELL_REGISTRY_MV_SWAP_0" ON "GW_DATA_PORTAL"."WELL_REGISTRY_MV_SWAP" '
+                      'USING gist ("GEOM")', statements[insert + 1:])
+        self.assertIn('ALTER TABLE "GW_DATA_PORTAL"."WELL_REGISTRY_MV_SWAP" ADD CONSTRAINT "WELL_REGISTRY_MV_SWAP_1" '
+                      'PRIMARY KEY USING INDEX "WELL_REGISTRY_MV_SWAP_1"', statements)
+        self.assertIn('GRANT SELECT ON "GW_DATA_PORTAL"."WELL_REGISTRY_MV_SWAP" TO PUBLIC', statements)
+        self.assertIn('GRANT SELECT ON "GW_DATA_PORTAL"."WELL_REGISTRY_MV_SWAP" TO "ngwmn_reader"', statements)
+        # indexes are built once the rows are in and the swap comes last
+        self.assertLess(statements.index('ANALYZE "GW_DATA_PORTAL"."WELL_REGISTRY_MV_SWAP"'),
+                        statements.index('DROP TABLE "GW_DATA_PORTAL"."WELL_REGISTRY_MV"'))
+        self.assertEqual(['DROP TABLE "GW_DATA_PORTAL"."WELL_REGISTRY_MV"',
+                          'ALTER TABLE "GW_DATA_PORTAL"."WELL_REGISTRY_MV_SWAP" RENAME TO "WELL_REGISTRY_MV"',
+                          'ALTER INDEX "GW_DATA_PORTAL"."WELL_REGISTRY_MV_SWAP_0" RENAME TO "WELL_REGISTRY_MV_GEOM"',
+                          'ALTER INDEX "GW_DATA_PORTAL"."WELL_REGISTRY_MV_SWAP_1" RENAME TO "WELL_REGISTRY_MV_pkey"'],
+                         statements[-4:])
+        self.mock_client.commit.assert_called_once()
+
+    def test_swap_copies_triggers_policies_and_owner(self):
+        swap_well_registry_pg(self.mock_client)
+
+        statements = [call[0][0] for call in self.mock_cursor.execute.call_args_list]
+        shadow_statements = statements[:statements.index('DROP TABLE "GW_DATA_PORTAL"."WELL_REGISTRY_MV"')]
+        self.assertIn('CREATE TRIGGER audit AFTER UPDATE ON "GW_DATA_PORTAL"."WELL_REGISTRY_MV_SWAP" FOR EACH ROW '
+                      'EXECUTE FUNCTION "GW_DATA_PORTAL".audit()', shadow_statements)
+        self.assertIn('CREATE POLICY "by_agency" ON "GW_DATA_PORTAL"."WELL_REGISTRY_MV_SWAP" AS PERMISSIVE '
+                      'FOR SELECT TO "ngwmn_reader", PUBLIC USING (("AGENCY_CD" = CURRENT_USER))', shadow_statements)
+        self.assertIn('ALTER TABLE "GW_DATA_PORTAL"."WELL_REGISTRY_MV_SWAP" ENABLE ROW LEVEL SECURITY',
+                      shadow_statements)
+        self.assertNotIn('ALTER TABLE "GW_DATA_PORTAL"."WELL_REGISTRY_MV_SWAP" FORCE ROW LEVEL SECURITY',
+                         shadow_statements)
+        self.assertIn('ALTER TABLE "GW_DATA_PORTAL"."WELL_REGISTRY_MV_SWAP" OWNER TO "ngwmn_owner"', shadow_statements)
+
+    def test_swap_refused_when_objects_depend_on_table(self):
+        self.mock_cursor.fetchall.side_effect = [[('rule _RETURN on view "GW_DATA_PORTAL".well_summary',),
+                                                  ('constraint site_fk on table "GW_DATA_PORTAL".site_notes',)]]
+
+        with self.assertRaises(psycopg2.ProgrammingError) as context:
+            swap_well_registry_pg(self.mock_client)
+
+        self.assertIn('view "GW_DATA_PORTAL".well_summary', str(context.exception))
+        self.assertIn('constraint site_fk', str(context.exception))
+        self.assertEqual(1, self.mock_cursor.execute.call_count)
+        self.mock_client.rollback.assert_called_once()
+        self.mock_client.commit.assert_not_called()
+
+
+class TestRefreshWellRegistryMV(TestCase):
+
+    def setUp(self):
+        self.mock_cursor = mock.MagicMock()
+        self.mock_client = mock.MagicMock()
+        self.mock_client.cursor.return_value = self.mock_cursor
+
+    def test_refresh(self):
+        refresh_well_registry_mv(self.mock_client)
+
+        self.mock_client.cursor.assert_called()
+        statement = self.mock_cursor.execute.call_args[0][0]
+        self.assertIn("list => 'GW_DATA_PORTAL.WELL_REGISTRY_MV'", statement)
+        self.assertIn('atomic_refresh => TRUE', statement)
+        self.assertEqual({'method': None, 'parallelism': 0}, self.mock_cursor.execute.call_args[1])
+
+    def test_refresh_options(self):
+        refresh_well_registry_mv(self.mock_client, 'fast', atomic_refresh=False, parallelism=4)
+
+        self.assertIn('atomic_refresh => FALSE', self.mock_cursor.execute.call_args[0][0])
+        self.assertEqual({'method': 'F', 'parallelism': 4}, self.mock_cursor.execute.call_args[1])
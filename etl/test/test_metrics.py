@@ -0,0 +1,123 @@
+"""
+Tests for the metrics.py module
+"""
+from unittest import TestCase, mock
+import json
+import os
+import tempfile
+
+from requests.exceptions import HTTPError
+
+from .test_pipeline import FakeExtract, make_pages
+from ..extract import Extract
+from ..metrics import Histogram, RequestMetrics, RunReport
+from ..pipeline import Pipeline
+from ..sink import OracleSink
+
+
+class TestHistogram(TestCase):
+
+    def test_cumulative(self):
+        histogram = Histogram(buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 3.0):
+            histogram.observe(value)
+
+        self.assertEqual([(0.1, 2), (1.0, 3), ('+Inf', 4)], histogram.cumulative())
+        self.assertEqual({'count': 4, 'sum': 3.65, 'buckets': {'0.1': 2, '1.0': 3, '+Inf': 4}}, histogram.summary())
+
+
+class TestRequestMetrics(TestCase):
+
+    def test_timed_fetch(self):
+        extract = Extract()
+        extract.FETCH_METRICS = RequestMetrics()
+        extract.try_fetch = mock.Mock(side_effect=[{'results': []}, HTTPError('503 Server Error')])
+
+        extract.timed_fetch('url', mock.Mock())
+        with self.assertRaises(HTTPError):
+            extract.timed_fetch('url', mock.Mock())
+
+        self.assertEqual({'ok': 1, 'HTTPError': 1}, extract.FETCH_METRICS.outcomes)
+        self.assertEqual(2, extract.FETCH_METRICS.latency.count)
+
+    def test_response_hook(self):
+        extract = Extract()
+        extract.FETCH_METRICS = RequestMetrics()
+        session = extract.session()
+
+        for hook in session.hooks['response']:
+            hook(mock.Mock(content=b'{"results": []}'))
+
+        self.assertEqual(15, extract.FETCH_METRICS.bytes)
+
+
+@mock.patch('etl.sink.refresh_well_registry_mv')
+class TestRunReport(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def run_pipeline(self):
+        def load(connect, mon_locs):
+            return [(mon_loc['AGENCY_CD'], mon_loc['SITE_NO'], ValueError('rejected'))
+                    for mon_loc in mon_locs if mon_loc['SITE_NO'] == 'CA-1-1']
+        sink = OracleSink(mock.Mock(), batch_size=2, load=load)
+        pipeline = Pipeline(FakeExtract(make_pages(3)), 'endpoint', [sink])
+        pipeline.run()
+        extract = Extract()
+        extract.FETCH_METRICS = RequestMetrics()
+        extract.FETCH_METRICS.record(0.2)
+        extract.FETCH_METRICS.record_bytes(2048)
+        return RunReport(extract, pipeline, [sink], finished=1600000000.0)
+
+    def test_summary(self, mock_refresh):
+        summary = self.run_pipeline().summary()
+
+        self.assertEqual(9, summary['transform']['records'])
+        self.assertEqual(['extract', 'transform', 'oracle'], list(summary['stages']))
+        self.assertEqual(5, summary['stages']['oracle']['latency_seconds']['count'])
+        self.assertEqual({'ok': 1}, summary['extract']['requests'])
+        self.assertEqual(2048, summary['extract']['response_bytes'])
+        self.assertEqual(8, summary['sinks']['oracle']['loaded'])
+        self.assertEqual(1, summary['sinks']['oracle']['failed'])
+        self.assertTrue(summary['sinks']['oracle']['refreshed'])
+        json.dumps(summary)
+
+    def test_prometheus_textfile(self, mock_refresh):
+        path = os.path.join(self.directory.name, 'ngwmn_etl.prom')
+
+        self.run_pipeline().write_textfile(path)
+
+        with open(path) as textfile:
+            lines = textfile.read().splitlines()
+        self.assertIn('# TYPE ngwmn_etl_registry_request_seconds histogram', lines)
+        self.assertIn('ngwmn_etl_registry_request_seconds_bucket{le="0.25"} 1', lines)
+        self.assertIn('ngwmn_etl_registry_request_seconds_count 1', lines)
+        self.assertIn('ngwmn_etl_sink_rows{sink="oracle",result="failed"} 1', lines)
+        self.assertIn('ngwmn_etl_mv_refreshed{sink="oracle"} 1', lines)
+        self.assertIn('ngwmn_etl_last_run_finished_timestamp_seconds 1600000000.0', lines)
+        self.assertEqual([], [line for line in lines if not line.startswith('#') and len(line.split(' ')) != 2])
+        self.assertFalse(any(line.startswith('ngwmn_etl_last_run_success') for line in lines))
+
+    def test_failed_run_marked(self, mock_refresh):
+        report = self.run_pipeline()
+        report.success = False
+
+        self.assertFalse(report.summary()['success'])
+        self.assertIn('ngwmn_etl_last_run_success 0', report.prometheus().splitlines())
+
+    def test_report_of_a_run_that_raised(self, mock_refresh):
+        sink = OracleSink(mock.Mock(), batch_size=2, load=lambda connect, mon_locs: [])
+        pipeline = Pipeline(FakeExtract(make_pages(3)), 'endpoint', [sink],
+                            accept=mock.Mock(side_effect=RuntimeError('transform failed')))
+        with self.assertRaises(RuntimeError):
+            pipeline.run()
+
+        summary = RunReport(None, pipeline, [sink], success=False).summary()
+
+        self.assertFalse(summary['success'])
+        self.assertEqual(0, summary['sinks']['oracle']['loaded'])
+        json.dumps(summary)
@@ -0,0 +1,109 @@
+"""
+Tests for the partition.py module
+"""
+from unittest import TestCase, mock
+import os
+
+import cx_Oracle
+
+from .fake_data import TEST_DATA
+from ..partition import PartitionedSink, RemoteLoadError, partition_of
+from ..sink import OracleSink
+from ..transform import transform_mon_loc_data
+
+
+def make_connection(name):
+    if name == 'unreachable':
+        raise cx_Oracle.DatabaseError('ORA-12541: TNS:no listener')
+    return name
+
+
+def load_in_worker(connect, mon_locs):
+    """
+    Rejects CA-3 and otherwise accepts every row, like load_monitoring_locations.
+    """
+    return [(mon_loc['AGENCY_CD'], mon_loc['SITE_NO'], cx_Oracle.DatabaseError('ORA-01400: cannot insert NULL'))
+            for mon_loc in mon_locs if mon_loc['SITE_NO'] == 'CA-3']
+
+
+def crash_in_worker(connect, mon_locs):
+    """
+    Kills the worker process that is sent CA-5, without reporting anything to the parent.
+    """
+    if any(mon_loc['SITE_NO'] == 'CA-5' for mon_loc in mon_locs):
+        os._exit(1)
+    return []
+
+
+class TestPartitionOf(TestCase):
+
+    def test_stable_and_spread(self):
+        mon_locs = [{'AGENCY_CD': 'USGS', 'SITE_NO': f'{site}'} for site in range(1000)]
+        partitions = [partition_of(mon_loc, 4) for mon_loc in mon_locs]
+
+        self.assertEqual(partitions, [partition_of(dict(mon_loc), 4) for mon_loc in mon_locs])
+        self.assertEqual({0, 1, 2, 3}, set(partitions))
+        self.assertGreater(min(partitions.count(partition) for partition in range(4)), 150)
+
+
+class TestRemoteLoadError(TestCase):
+
+    def test_keeps_error_class(self):
+        error = RemoteLoadError('IntegrityError', 'duplicate key')
+
+        self.assertEqual('IntegrityError', error.error_class)
+        self.assertEqual('IntegrityError: duplicate key', str(error))
+
+
+@mock.patch('etl.sink.refresh_well_registry_mv')
+class TestPartitionedSink(TestCase):
+
+    def setUp(self):
+        self.mon_locs = [dict(transform_mon_loc_data(TEST_DATA), SITE_NO=f'CA-{site}') for site in range(20)]
+        self.index = mock.Mock()
+        self.index.unchanged.return_value = False
+
+    def run_sink(self, sink):
+        sink.start()
+        for mon_loc in self.mon_locs:
+            sink.put(mon_loc, mon_loc['SITE_NO'])
+        sink.close()
+        return sink.join()
+
+    def test_workers_load_and_parent_refreshes_once(self, mock_refresh):
+        sink = self.run_sink(PartitionedSink(OracleSink, 'parent', make_connection, ('worker',), 3, 4,
+                                             load=load_in_worker, index=self.index))
+
+        self.assertEqual(19, sink.loaded)
+        self.assertEqual([('CADWR', 'CA-3')], [(agency_cd, site_no) for agency_cd, site_no, _ in sink.failed_locations])
+        self.assertEqual('DatabaseError', sink.failed_locations[0][2].error_class)
+        self.assertEqual(['CA-3'], [mon_loc['SITE_NO'] for _, mon_loc, _ in sink.dead_letters()])
+        self.assertEqual(19, self.index.record.call_count)
+        mock_refresh.assert_called_once_with('parent', 'force', True, 0)
+        self.assertTrue(sink.refreshed)
+        self.assertTrue(all(process.exitcode == 0 for process in sink.processes))
+
+    def test_worker_connection_failure(self, mock_refresh):
+        sink = self.run_sink(PartitionedSink(OracleSink, 'parent', make_connection, ('unreachable',), 2, 4,
+                                             load=load_in_worker))
+
+        self.assertEqual(0, sink.loaded)
+        self.assertEqual(20, len(sink.failed_locations))
+        self.assertEqual('DatabaseError', sink.error.error_class)
+        mock_refresh.assert_not_called()
+        self.assertFalse(sink.refreshed)
+
+    def test_rows_of_exited_worker_fail_transiently(self, mock_refresh):
+        sink = self.run_sink(PartitionedSink(OracleSink, 'parent', make_connection, ('worker',), 2, 2,
+                                             load=crash_in_worker))
+
+        crashed = partition_of(self.mon_locs[5], 2)
+        lost = [mon_loc['SITE_NO'] for mon_loc in self.mon_locs if partition_of(mon_loc, 2) == crashed]
+        failed = {site_no: error for _, site_no, error in sink.failed_locations}
+        self.assertIn('CA-5', failed)
+        self.assertTrue(set(failed) <= set(lost))
+        self.assertEqual(20, sink.loaded + len(failed))
+        self.assertTrue(all(error.error_class == 'WorkerExited' and error.transient for error in failed.values()))
+        self.assertEqual(sorted(failed), sorted(mon_loc['SITE_NO'] for _, mon_loc, _ in sink.dead_letters()))
+        self.assertEqual('WorkerExited', sink.error.error_class)
+        mock_refresh.assert_not_called()
@@ -0,0 +1,176 @@
+"""
+Tests for the pipeline.py module
+"""
+from unittest import TestCase, mock
+import time
+
+from requests.exceptions import RequestException
+
+from .fake_data import TEST_DATA
+from ..fingerprint import row_fingerprint
+from ..pipeline import Pipeline, StageStats
+from ..record import MonitoringLocation
+from ..sink import OracleSink
+from ..transform import transform_mon_loc_data
+
+
+class FakeExtract:
+
+    def __init__(self, pages, fail_after=None, error=RequestException):
+        self.pages = pages
+        self.fail_after = fail_after
+        self.error = error
+        self.fetched = 0
+        self.closed = False
+
+    def iter_pages(self, endpoint):
+        try:
+            for page in self.pages:
+                if self.fetched == self.fail_after:
+                    raise self.error('registry unavailable')
+                self.fetched += 1
+                yield page
+        finally:
+            self.closed = True
+
+
+def make_pages(pages, per_page=3):
+    return [[dict(TEST_DATA, site_no=f'CA-{page}-{site}') for site in range(per_page)] for page in range(pages)]
+
+
+@mock.patch('etl.sink.refresh_well_registry_mv')
+class TestPipeline(TestCase):
+
+    def setUp(self):
+        self.loaded = []
+
+    def load(self, seconds=0.0):
+        def load(connect, mon_locs):
+            time.sleep(seconds)
+            self.loaded.extend(mon_loc['SITE_NO'] for mon_loc in mon_locs)
+            return []
+        return load
+
+    def test_every_record_loaded(self, mock_refresh):
+        sink = OracleSink(mock.Mock(), batch_size=4, load=self.load())
+        pipeline = Pipeline(FakeExtract(make_pages(5)), 'endpoint', [sink], page_queue_size=2)
+
+        pipeline.run()
+
+        self.assertEqual(15, pipeline.count)
+        self.assertEqual(15, len(self.loaded))
+        self.assertTrue(pipeline.extract_complete)
+        self.assertTrue(sink.refreshed)
+        self.assertEqual([5, 15, 15], [stats.items for stats in pipeline.stats()])
+
+    def test_accept_and_fingerprint(self, mock_refresh):
+        sink = OracleSink(mock.Mock(), batch_size=4, load=self.load())
+        sink.put = mock.Mock()
+        pipeline = Pipeline(FakeExtract(make_pages(2)), 'endpoint', [sink],
+                            accept=lambda mon_loc: mon_loc['site_no'].endswith('-0'),
+                            fingerprint=lambda mon_loc: mon_loc['SITE_NO'])
+
+        pipeline.run()
+
+        self.assertEqual(4, pipeline.skipped)
+        self.assertEqual(['CA-0-0', 'CA-1-0'], [call[0][1] for call in sink.put.call_args_list])
+
+    def test_rows_are_compact_records(self, mock_refresh):
+        sink = OracleSink(mock.Mock(), batch_size=4, load=self.load())
+        sink.put = mock.Mock()
+        pages = make_pages(2)
+        pipeline = Pipeline(FakeExtract(pages), 'endpoint', [sink], fingerprint=row_fingerprint)
+
+        pipeline.run()
+
+        rows = [call[0][0] for call in sink.put.call_args_list]
+        self.assertTrue(all(isinstance(row, MonitoringLocation) for row in rows))
+        self.assertEqual(transform_mon_loc_data(pages[1][2]), rows[-1])
+        self.assertIs(rows[0]['AGENCY_NM'], rows[-1]['AGENCY_NM'])
+        # the fingerprint of a record is the fingerprint of the dict it replaces
+        self.assertEqual(row_fingerprint(transform_mon_loc_data(pages[1][2])), sink.put.call_args_list[-1][0][1])
+
+    def test_malformed_dates_rejected_per_record(self, mock_refresh):
+        pages = make_pages(2)
+        pages[1][1]['update_date'] = 'not a date'
+        sink = OracleSink(mock.Mock(), batch_size=4, load=self.load())
+        pipeline = Pipeline(FakeExtract(pages), 'endpoint', [sink])
+
+        pipeline.run()
+
+        self.assertEqual(5, len(self.loaded))
+        self.assertEqual([('CADWR', 'CA-1-1')], [(agency_cd, site_no) for agency_cd, site_no, _ in pipeline.rejected])
+        self.assertEqual('UPDATE_DATE', pipeline.rejected[0][2].column)
+
+    def test_extract_failure_keeps_loaded_pages(self, mock_refresh):
+        sink = OracleSink(mock.Mock(), batch_size=4, load=self.load())
+        pipeline = Pipeline(FakeExtract(make_pages(5), fail_after=2), 'endpoint', [sink])
+
+        pipeline.run()
+
+        self.assertFalse(pipeline.extract_complete)
+        self.assertEqual(6, len(self.loaded))
+        self.assertTrue(sink.refreshed)
+
+    def test_unexpected_extract_error_cancels(self, mock_refresh):
+        sink = OracleSink(mock.Mock(), batch_size=100, load=self.load())
+        pipeline = Pipeline(FakeExtract(make_pages(5), fail_after=2, error=RuntimeError), 'endpoint', [sink])
+
+        with self.assertRaises(RuntimeError):
+            pipeline.run()
+
+        self.assertFalse(pipeline.extract_complete)
+        self.assertEqual([], self.loaded)
+        self.assertFalse(sink.refreshed)
+        mock_refresh.assert_not_called()
+
+    def test_transform_error_cancels_extract(self, mock_refresh):
+        pages = make_pages(50)
+        pages[1] = [{}]
+        extract = FakeExtract(pages)
+        sink = OracleSink(mock.Mock(), batch_size=100, load=self.load())
+        pipeline = Pipeline(extract, 'endpoint', [sink], page_queue_size=2)
+
+        with self.assertRaises(KeyError):
+            pipeline.run()
+
+        self.assertTrue(extract.closed)
+        self.assertLess(extract.fetched, 50)
+        self.assertFalse(sink.refreshed)
+        self.assertEqual([], self.loaded)
+
+    def test_bounded_page_queue(self, mock_refresh):
+        extract = FakeExtract(make_pages(30, per_page=1))
+        sink = OracleSink(mock.Mock(), batch_size=1, queue_size=1, load=self.load(seconds=0.002))
+        pipeline = Pipeline(extract, 'endpoint', [sink], page_queue_size=2)
+
+        pipeline.run()
+
+        self.assertEqual(30, len(self.loaded))
+        self.assertLessEqual(pipeline.transform_stats.max_depth, 2)
+        self.assertLessEqual(sink.stats.max_depth, 1)
+        self.assertGreater(sink.stats.utilization(pipeline.wall_seconds), 0.5)
+
+    def test_every_sink_failed_cancels(self, mock_refresh):
+        def load(connect, mon_locs):
+            raise RuntimeError('connection lost')
+        sink = OracleSink(mock.Mock(), batch_size=1, load=load)
+        extract = FakeExtract(make_pages(200))
+        pipeline = Pipeline(extract, 'endpoint', [sink], page_queue_size=2)
+
+        pipeline.run()
+
+        self.assertFalse(pipeline.extract_complete)
+        self.assertLess(extract.fetched, 200)
+
+
+class TestStageStats(TestCase):
+
+    def test_summary(self):
+        stats = StageStats('transform')
+        stats.worked(1.5, 10)
+        stats.sample_depth(2)
+        stats.sample_depth(4)
+
+        self.assertEqual(0.5, stats.utilization(3.0))
+        self.assertEqual('transform: 10 items, 50% busy, queue depth mean 3.0 max 4', stats.summary(3.0))
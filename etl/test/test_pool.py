@@ -0,0 +1,151 @@
+"""
+Tests for the pool.py module
+"""
+from random import Random
+from unittest import TestCase, mock
+
+import cx_Oracle
+import psycopg2
+import psycopg2.errors
+
+from .test_retry import FakeClock
+from ..pool import ConnectionPool, PostgresPool, is_transient, make_postgres_pool, run_on
+from ..retry import ExponentialBackoff
+
+
+def oracle_error(code):
+    error = mock.Mock()
+    error.code = code
+    return cx_Oracle.DatabaseError(error)
+
+
+class FakePool(ConnectionPool):
+    """
+    Hands out numbered connections and records the ones discarded.
+    """
+    name = 'fake'
+
+    def __init__(self, dead=()):
+        self.clock = FakeClock()
+        ConnectionPool.__init__(self, 2, ExponentialBackoff(1, 30, clock=self.clock, rand=Random(42)))
+        self.idle = []
+        self.opened = 0
+        self.discarded = []
+        self.dead = set(dead)
+
+    def _acquire(self):
+        if self.idle:
+            return self.idle.pop()
+        self.opened += 1
+        return f'connection-{self.opened}'
+
+    def _release(self, connect, discard):
+        if discard:
+            self.discarded.append(connect)
+        else:
+            self.idle.append(connect)
+
+    def _ping(self, connect):
+        if connect in self.dead:
+            raise psycopg2.OperationalError('server closed the connection unexpectedly')
+
+    def close(self):
+        self.idle = []
+
+
+class TestIsTransient(TestCase):
+
+    def test_errors(self):
+        self.assertTrue(is_transient(oracle_error(3113)))
+        self.assertTrue(is_transient(psycopg2.InterfaceError('connection already closed')))
+        self.assertTrue(is_transient(psycopg2.OperationalError('server closed the connection unexpectedly')))
+        self.assertFalse(is_transient(oracle_error(1400)))
+        self.assertFalse(is_transient(cx_Oracle.DatabaseError('ORA-00942')))
+        self.assertFalse(is_transient(psycopg2.IntegrityError('duplicate key')))
+        self.assertFalse(is_transient(ValueError('not a database error')))
+
+    def test_timeouts_are_not_transient(self):
+        self.assertFalse(is_transient(psycopg2.errors.LockNotAvailable('canceling statement due to lock timeout')))
+        self.assertFalse(is_transient(psycopg2.errors.QueryCanceled('canceling statement due to statement timeout')))
+
+
+class TestConnectionPool(TestCase):
+
+    def setUp(self):
+        self.pool = FakePool()
+        self.calls = []
+
+    def work(self, *errors):
+        errors = list(errors)
+
+        def work(connect):
+            self.calls.append(connect)
+            if errors:
+                raise errors.pop(0)
+            return 'loaded'
+        return work
+
+    def test_reuses_connection(self):
+        self.assertEqual('loaded', self.pool.run(self.work()))
+        self.assertEqual('loaded', self.pool.run(self.work()))
+
+        self.assertEqual(['connection-1', 'connection-1'], self.calls)
+        self.assertEqual(0, self.pool.reconnects)
+
+    def test_reconnects_after_transient_error(self):
+        self.assertEqual('loaded', self.pool.run(self.work(oracle_error(3113), oracle_error(3114))))
+
+        self.assertEqual(['connection-1', 'connection-2', 'connection-3'], self.calls)
+        self.assertEqual(['connection-1', 'connection-2'], self.pool.discarded)
+        self.assertEqual(2, self.pool.reconnects)
+        self.assertEqual(2, len(self.pool.clock.sleeps))
+
+    def test_gives_up_after_retries(self):
+        with self.assertRaises(psycopg2.OperationalError):
+            self.pool.run(self.work(*[psycopg2.OperationalError('connection lost')] * 5))
+
+        self.assertEqual(4, len(self.calls))
+
+    def test_other_errors_are_not_retried(self):
+        with self.assertRaises(psycopg2.IntegrityError):
+            self.pool.run(self.work(psycopg2.IntegrityError('duplicate key')))
+
+        self.assertEqual(1, len(self.calls))
+        self.assertEqual([], self.pool.discarded)
+        self.assertEqual(['connection-1'], self.pool.idle)
+
+    def test_idle_connection_checked(self):
+        self.pool.run(self.work())
+        self.pool.dead.add('connection-1')
+        self.pool.PING_AFTER_SECONDS = 0.0
+
+        self.pool.run(self.work())
+
+        self.assertEqual(['connection-1'], self.pool.discarded)
+        self.assertEqual(['connection-1', 'connection-2'], self.calls)
+
+    def test_run_on_single_connection(self):
+        self.assertEqual('loaded', run_on('connection', self.work()))
+        self.assertEqual(['connection'], self.calls)
+
+
+class TestPostgresPool(TestCase):
+
+    @mock.patch('etl.pool.psycopg2.pool.ThreadedConnectionPool')
+    def test_closed_connection_discarded(self, mock_pool_class):
+        pool = PostgresPool('host', '5432', 'ngwmn', 'user', 'password')
+        connect = mock.Mock(closed=2)
+
+        pool.release(connect)
+
+        self.assertEqual('-c timezone=UTC', mock_pool_class.call_args[1]['options'])
+        mock_pool_class.return_value.putconn.assert_called_once_with(connect, close=True)
+
+    @mock.patch('etl.pool.psycopg2.pool.ThreadedConnectionPool')
+    def test_reconnect_retries_passed_as_argument(self, mock_pool_class):
+        # load worker processes make their pools from the same arguments, class attributes set here do not reach them
+        pool = make_postgres_pool('host', '5432', 'ngwmn', 'user', 'password', 2, 9)
+
+        self.assertEqual(9, pool.RECONNECT_RETRIES)
+        self.assertEqual(3, ConnectionPool.RECONNECT_RETRIES)
+        self.assertEqual(3, make_postgres_pool('host', '5432', 'ngwmn', 'user', 'password').RECONNECT_RETRIES)
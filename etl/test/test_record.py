@@ -0,0 +1,66 @@
+"""
+Tests for the record.py module
+"""
+from unittest import TestCase
+import pickle
+
+from .fake_data import TEST_DATA
+from ..fingerprint import row_fingerprint
+from ..load import oracle_upsert_template, pg_upsert_template, pg_columns
+from ..record import InternPool, MonitoringLocation
+from ..transform import transform_mon_loc_data, transform_mon_loc_values
+
+
+class TestMonitoringLocation(TestCase):
+
+    def setUp(self):
+        self.mapped_data = transform_mon_loc_data(TEST_DATA)
+        self.record = MonitoringLocation.from_mapping(self.mapped_data)
+
+    def test_reads_like_the_dict(self):
+        self.assertEqual(self.mapped_data, dict(self.record))
+        self.assertEqual(self.record, self.mapped_data)
+        self.assertEqual(tuple(self.mapped_data.keys()), tuple(self.record.keys()))
+        self.assertEqual('CADWR', self.record['AGENCY_CD'])
+        self.assertEqual('CA-1', dict(self.record, SITE_NO='CA-1')['SITE_NO'])
+        with self.assertRaises(KeyError):
+            self.record['keys']  # pylint: disable=pointless-statement
+        self.assertFalse(hasattr(self.record, '__dict__'))
+
+    def test_assignment(self):
+        self.record['SITE_NAME'] = 'Charmeleon'
+
+        self.assertEqual('Charmeleon', self.record['SITE_NAME'])
+        with self.assertRaises(KeyError):
+            self.record['GEOM'] = 'POINT(0 0)'
+
+    def test_loaders_and_fingerprint(self):
+        self.assertEqual(oracle_upsert_template(tuple(self.mapped_data.keys())).binds(self.mapped_data),
+                         oracle_upsert_template(tuple(self.record.keys())).binds(self.record))
+        self.assertEqual(pg_upsert_template(pg_columns(self.mapped_data)).binds(self.mapped_data),
+                         pg_upsert_template(pg_columns(self.record)).binds(self.record))
+        self.assertEqual(row_fingerprint(self.mapped_data), row_fingerprint(self.record))
+
+    def test_pickle(self):
+        self.assertEqual(self.record, pickle.loads(pickle.dumps(self.record)))
+
+
+class TestInterning(TestCase):
+
+    def test_repeated_values_shared(self):
+        pool = InternPool()
+        records = [MonitoringLocation.from_mapping(transform_mon_loc_data(dict(TEST_DATA, site_no=f'CA-{site}')), pool)
+                   for site in range(3)]
+
+        self.assertIs(records[0]['AGENCY_NM'], records[2]['AGENCY_NM'])
+        self.assertIsNone(pool(None))
+        self.assertEqual(pool('CADWR'), 'CADWR')
+
+    def test_from_values(self):
+        pool = InternPool()
+        ml_data = [dict(TEST_DATA, site_no=f'CA-{site}') for site in range(3)]
+
+        records = [MonitoringLocation.from_values(transform_mon_loc_values(ml), pool) for ml in ml_data]
+
+        self.assertEqual([transform_mon_loc_data(ml) for ml in ml_data], [dict(record) for record in records])
+        self.assertIs(records[0]['AGENCY_MED'], pool.values[records[1]['AGENCY_MED']])
@@ -0,0 +1,74 @@
+"""
+Tests for the retry.py module
+"""
+from datetime import datetime, timezone
+from random import Random
+from unittest import TestCase
+
+from requests import Response
+
+from ..retry import ExponentialBackoff
+
+
+class FakeClock:
+    """
+    Clock that records the requested sleeps instead of sleeping.
+    """
+    def __init__(self, now=None):
+        self.sleeps = []
+        self.current = now or datetime(2020, 9, 10, 20, 40, 0, tzinfo=timezone.utc)
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+
+    def now(self):
+        return self.current
+
+
+def response_with_headers(status_code, headers):
+    response = Response()
+    response.status_code = status_code
+    response.headers.update(headers)
+    return response
+
+
+class TestExponentialBackoff(TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.backoff = ExponentialBackoff(1, 30, retry_budget=5, clock=self.clock, rand=Random(42))
+
+    def test_delay_is_full_jitter_below_the_cap(self):
+        for attempt, ceiling in [(1, 1), (2, 2), (3, 4), (4, 8), (5, 16)]:
+            delay = self.backoff.delay(attempt)
+            self.assertGreaterEqual(delay, 0)
+            self.assertLessEqual(delay, ceiling)
+
+        backoff = ExponentialBackoff(1, 30, clock=self.clock, rand=Random(42))
+        self.assertTrue(all(backoff.delay(12) <= 30 for _ in range(50)))
+
+    def test_retry_budget(self):
+        delays = [self.backoff.delay(1) for _ in range(7)]
+        self.assertEqual(5, len([delay for delay in delays if delay is not None]))
+        self.assertEqual([None, None], delays[5:])
+        self.assertEqual(5, self.backoff.retries)
+
+    def test_retry_after_seconds(self):
+        self.assertEqual(7, self.backoff.delay(1, response_with_headers(429, {'Retry-After': '7'})))
+        # never longer than the cap
+        self.assertEqual(30, self.backoff.delay(1, response_with_headers(429, {'Retry-After': '3600'})))
+
+    def test_retry_after_http_date(self):
+        response = response_with_headers(503, {'Retry-After': 'Thu, 10 Sep 2020 20:40:12 GMT'})
+        self.assertEqual(12, self.backoff.delay(1, response))
+
+    def test_retry_after_malformed_falls_back_to_jitter(self):
+        delay = self.backoff.delay(1, response_with_headers(503, {'Retry-After': 'soon'}))
+        self.assertLessEqual(delay, 1)
+
+    def test_sleep_is_counted(self):
+        self.backoff.sleep(2.5)
+        self.backoff.slept(1.5)
+        self.assertEqual([2.5], self.clock.sleeps)
+        self.assertEqual(4.0, self.backoff.seconds_slept)
+        self.assertEqual('Retries: 0, seconds spent waiting to retry: 4.0', self.backoff.summary())
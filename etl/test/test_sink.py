@@ -0,0 +1,252 @@
+"""
+Tests for the sink.py module
+"""
+from unittest import TestCase, mock
+import sqlite3
+import time
+
+import cx_Oracle
+import psycopg2
+
+from .fake_data import TEST_DATA
+from .test_pool import FakePool, oracle_error
+from ..sink import OracleSink, PostgisSink
+from ..transform import transform_mon_loc_data
+
+
+class RecordingLoad:
+
+    def __init__(self, seconds=0.0, fail_site=None, raises=None):
+        self.seconds = seconds
+        self.fail_site = fail_site
+        self.raises = raises
+        self.batches = []
+
+    def __call__(self, connect, mon_locs):
+        if self.raises is not None:
+            raise self.raises
+        time.sleep(self.seconds)
+        self.batches.append(list(mon_locs))
+        return [(mon_loc['AGENCY_CD'], mon_loc['SITE_NO'], ValueError('rejected'))
+                for mon_loc in mon_locs if mon_loc['SITE_NO'] == self.fail_site]
+
+
+class TestSink(TestCase):
+
+    def setUp(self):
+        self.mon_locs = [dict(transform_mon_loc_data(TEST_DATA), SITE_NO=f'CA-{site}') for site in range(5)]
+
+    def run_sinks(self, *sinks):
+        for sink in sinks:
+            sink.start()
+        for mon_loc in self.mon_locs:
+            for sink in sinks:
+                sink.put(mon_loc)
+        for sink in sinks:
+            sink.close()
+        for sink in sinks:
+            sink.join()
+
+    @mock.patch('etl.sink.refresh_well_registry_mv')
+    def test_batches_then_refresh(self, mock_refresh):
+        load = RecordingLoad(fail_site='CA-2')
+        sink = OracleSink(mock.Mock(), batch_size=2, load=load)
+
+        self.run_sinks(sink)
+
+        self.assertEqual([2, 2, 1], [len(batch) for batch in load.batches])
+        self.assertEqual(['CA-2'], [site_no for _, site_no, _ in sink.failed_locations])
+        self.assertEqual(4, sink.loaded)
+        mock_refresh.assert_called_once_with(sink.connect, 'force', True, 0)
+        self.assertTrue(sink.refreshed)
+        self.assertIn('oracle: 4 loaded, 1 failed', sink.summary())
+
+    @mock.patch('etl.sink.refresh_well_registry_mv')
+    def test_oracle_refresh_method(self, mock_refresh):
+        sink = OracleSink(mock.Mock(), batch_size=2, load=RecordingLoad())
+        sink.MV_FAST_MAX_ROWS = 4
+
+        self.run_sinks(sink)
+
+        mock_refresh.assert_called_once_with(sink.connect, 'complete', True, 0)
+
+    @mock.patch('etl.sink.refresh_well_registry_mv')
+    def test_oracle_refresh_skipped_without_changes(self, mock_refresh):
+        index = mock.Mock()
+        index.unchanged.return_value = True
+        sink = OracleSink(mock.Mock(), batch_size=2, load=RecordingLoad(), index=index)
+        sink.view_stale = False
+
+        self.run_sinks(sink)
+
+        mock_refresh.assert_not_called()
+        self.assertTrue(sink.refreshed)
+
+    @mock.patch('etl.sink.refresh_well_registry_mv')
+    def test_oracle_refresh_after_failed_refresh_without_changes(self, mock_refresh):
+        index = mock.Mock()
+        index.unchanged.return_value = True
+        sink = OracleSink(mock.Mock(), batch_size=2, load=RecordingLoad(), index=index)
+
+        self.run_sinks(sink)
+
+        mock_refresh.assert_called_once_with(sink.connect, 'force', True, 0)
+        self.assertTrue(sink.refreshed)
+
+    @mock.patch('etl.sink.refresh_well_registry_pg')
+    @mock.patch('etl.sink.refresh_well_registry_mv')
+    def test_sinks_load_concurrently(self, mock_refresh_mv, mock_refresh_pg):
+        mock_refresh_pg.return_value = (0, 5)
+        oracle = OracleSink(mock.Mock(), batch_size=1, load=RecordingLoad(seconds=0.02))
+        postgres = PostgisSink(mock.Mock(), batch_size=1, load=RecordingLoad(seconds=0.02))
+
+        start = time.monotonic()
+        self.run_sinks(oracle, postgres)
+
+        # five batches of 20 ms in each sink, well below the 200 ms of loading them one after the other
+        self.assertLess(time.monotonic() - start, 0.18)
+        self.assertEqual(5, oracle.loaded)
+        self.assertEqual(5, postgres.loaded)
+
+    @mock.patch('etl.sink.refresh_well_registry_pg')
+    @mock.patch('etl.sink.refresh_well_registry_mv')
+    def test_failed_sink_does_not_stop_the_other(self, mock_refresh_mv, mock_refresh_pg):
+        mock_refresh_pg.return_value = (0, 5)
+        oracle = OracleSink(mock.Mock(), batch_size=2, load=RecordingLoad(raises=RuntimeError('connection lost')))
+        postgres = PostgisSink(mock.Mock(), batch_size=2, load=RecordingLoad())
+
+        self.run_sinks(oracle, postgres)
+
+        self.assertEqual(5, len(oracle.failed_locations))
+        self.assertFalse(oracle.refreshed)
+        mock_refresh_mv.assert_not_called()
+        self.assertEqual(5, postgres.loaded)
+        self.assertTrue(postgres.refreshed)
+
+    @mock.patch('etl.sink.refresh_well_registry_pg')
+    def test_refresh_with_loaded_keys(self, mock_refresh):
+        mock_refresh.return_value = (4, 4)
+        sink = PostgisSink(mock.Mock(), batch_size=2, load=RecordingLoad(fail_site='CA-2'))
+
+        self.run_sinks(sink)
+
+        mock_refresh.assert_called_once_with(sink.connect, {('CADWR', f'CA-{site}') for site in (0, 1, 3, 4)})
+
+    @mock.patch('etl.sink.refresh_well_registry_pg')
+    def test_full_refresh(self, mock_refresh):
+        mock_refresh.return_value = (5, 5)
+        sink = PostgisSink(mock.Mock(), batch_size=2, load=RecordingLoad())
+        sink.MV_REFRESH = 'full'
+
+        self.run_sinks(sink)
+
+        mock_refresh.assert_called_once_with(sink.connect, None)
+
+    @mock.patch('etl.sink.swap_well_registry_pg')
+    @mock.patch('etl.sink.refresh_well_registry_pg')
+    def test_swap_refresh(self, mock_refresh, mock_swap):
+        mock_swap.return_value = 5
+        sink = PostgisSink(mock.Mock(), batch_size=2, load=RecordingLoad())
+        sink.MV_REFRESH = 'swap'
+
+        self.run_sinks(sink)
+
+        mock_swap.assert_called_once_with(sink.connect)
+        mock_refresh.assert_not_called()
+        self.assertTrue(sink.refreshed)
+
+    @mock.patch('etl.sink.refresh_well_registry_mv')
+    def test_database_error_rejects_batch_only(self, mock_refresh):
+        load = RecordingLoad(raises=cx_Oracle.DatabaseError('ORA-00942'))
+        sink = OracleSink(mock.Mock(), batch_size=10, load=load)
+
+        self.run_sinks(sink)
+
+        self.assertEqual(5, len(sink.failed_locations))
+        self.assertIsNone(sink.error)
+        self.assertTrue(sink.refreshed)
+
+    @mock.patch('etl.sink.refresh_well_registry_mv')
+    def test_dropped_connection_reloads_batch(self, mock_refresh):
+        load = RecordingLoad()
+        connections = []
+
+        def load_once_connected(connect, mon_locs):
+            connections.append(connect)
+            if len(connections) == 1:
+                raise oracle_error(3113)
+            return load(connect, mon_locs)
+        sink = OracleSink(FakePool(), batch_size=10, load=load_once_connected)
+
+        self.run_sinks(sink)
+
+        self.assertEqual(['connection-1', 'connection-2'], connections)
+        self.assertEqual(5, sink.loaded)
+        self.assertEqual([], sink.failed_locations)
+        self.assertEqual('connection-2', mock_refresh.call_args[0][0])
+
+    @mock.patch('etl.sink.refresh_well_registry_pg')
+    def test_retry_failed_after_transient_errors(self, mock_refresh):
+        mock_refresh.return_value = (0, 1)
+        attempts = []
+
+        def load(connect, mon_locs):
+            attempts.append([mon_loc['SITE_NO'] for mon_loc in mon_locs])
+            if len(attempts) == 1:
+                return [('CADWR', 'CA-1', psycopg2.OperationalError('server closed the connection unexpectedly')),
+                        ('CADWR', 'CA-2', psycopg2.IntegrityError('duplicate key'))]
+            return []
+        sink = PostgisSink(mock.Mock(), batch_size=10, load=load)
+        self.run_sinks(sink)
+
+        self.assertEqual(1, sink.retry_failed())
+
+        self.assertEqual(['CA-1'], attempts[1])
+        self.assertEqual(4, sink.loaded)
+        self.assertEqual(['CA-2'], [site_no for _, site_no, _ in sink.failed_locations])
+        self.assertEqual(['CA-2'], [mon_loc['SITE_NO'] for _, mon_loc, _ in sink.dead_letters()])
+        self.assertEqual({('CADWR', 'CA-1')}, mock_refresh.call_args[0][1])
+        self.assertEqual(0, sink.retry_failed())
+
+    @mock.patch('etl.sink.refresh_well_registry_mv')
+    def test_oracle_batch_is_one_merge(self, mock_refresh):
+        connect = mock.Mock()
+        connect.cursor.return_value.getbatcherrors.return_value = []
+        sink = OracleSink(connect, batch_size=600)
+        self.mon_locs = [dict(self.mon_locs[0], SITE_NO=f'CA-{site}') for site in range(700)]
+
+        self.run_sinks(sink)
+
+        cursor = connect.cursor.return_value
+        self.assertEqual([600, 100], [len(call[0][1]) for call in cursor.executemany.call_args_list])
+        self.assertEqual(2, connect.commit.call_count)
+        self.assertEqual(700, sink.loaded)
+
+    @mock.patch('etl.sink.refresh_well_registry_mv')
+    def test_failed_index_stops_the_sink(self, mock_refresh):
+        self.mon_locs = [dict(self.mon_locs[0], SITE_NO=f'CA-{site}') for site in range(20)]
+        index = mock.Mock()
+        index.unchanged.return_value = False
+        index.record.side_effect = sqlite3.OperationalError('database is locked')
+        load = RecordingLoad()
+        sink = OracleSink(mock.Mock(), batch_size=2, load=load, index=index, queue_size=2)
+
+        # more rows than the queue holds, so a dead sink thread would leave put() blocked
+        self.run_sinks(sink)
+
+        self.assertIsInstance(sink.error, sqlite3.OperationalError)
+        self.assertEqual(1, len(load.batches))
+        self.assertEqual(2, sink.loaded)
+        self.assertEqual(18, len(sink.failed_locations))
+        mock_refresh.assert_not_called()
+
+    def test_unchanged_rows_are_not_queued(self):
+        index = mock.Mock()
+        index.unchanged.side_effect = lambda sink, mon_loc, digest: mon_loc['SITE_NO'] != 'CA-1'
+        sink = OracleSink(mock.Mock(), batch_size=10, index=index)
+
+        for mon_loc in self.mon_locs:
+            sink.put(mon_loc, 'digest')
+
+        self.assertEqual(4, sink.unchanged)
+        self.assertEqual(1, sink.queue.qsize())
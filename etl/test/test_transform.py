@@ -2,10 +2,12 @@
 Tests for the transform.py module
 
 """
+from datetime import datetime, timezone
 from unittest import TestCase
 
 from .fake_data import TEST_DATA
-from ..transform import transform_mon_loc_data
+from ..transform import transform_mon_loc_data, parse_timestamp, transform_page, date_format, COLUMNS, \
+    compile_field_spec, transform_mon_loc_values, to_flag, MalformedDateError
 
 
 class TestTransformMonitoringLocationData(TestCase):
@@ -17,3 +19,129 @@ class TestTransformMonitoringLocationData(TestCase):
         result = transform_mon_loc_data(self.test_data)
         self.assertEqual(len(result.items()), 52)
         self.assertEqual(list(result.values()).count(None), 18)
+
+
+class TestFieldSpec(TestCase):
+
+    def setUp(self):
+        spec = (
+            ('SITE_NO', 'site_no', None, None),
+            ('FLAG', 'flag', to_flag, None),
+            ('STATE_CD', 'state?.state_cd', None, 'XX'),
+            ('DEEP', 'a.b?.c.d', None, None),
+            ('CONSTANT', None, None, 'N'),
+        )
+        source, namespace = compile_field_spec(spec)
+        exec(compile(source, '<test spec>', 'exec'), namespace)  # pylint: disable=exec-used
+        self.transform = namespace['transform_mon_loc_data']
+        self.values = namespace['transform_mon_loc_values']
+
+    def test_lookups(self):
+        record = {'site_no': '1', 'flag': True, 'state': {'state_cd': '06'}, 'a': {'b': {'c': {'d': 4}}}}
+
+        self.assertEqual({'SITE_NO': '1', 'FLAG': '1', 'STATE_CD': '06', 'DEEP': 4, 'CONSTANT': 'N'},
+                         self.transform(record))
+        self.assertEqual(('1', '1', '06', 4, 'N'), self.values(record))
+
+    def test_optional_paths_default(self):
+        for state, b_value in ((None, None), ('US', []), ({}, {'c': None}), ({'state_cd': None}, {'c': {}})):
+            record = {'site_no': '1', 'flag': 0, 'state': state, 'a': {'b': b_value}}
+            self.assertEqual(('1', '0', 'XX', None, 'N'), self.values(record))
+        self.assertEqual('XX', self.transform({'site_no': '1', 'flag': 0, 'a': {}})['STATE_CD'])
+
+    def test_required_paths(self):
+        with self.assertRaises(KeyError):
+            self.transform({'flag': 0, 'a': {}})
+        with self.assertRaises(KeyError):
+            self.transform({'site_no': '1', 'flag': 0})
+
+    def test_module_transform_matches_values(self):
+        self.assertEqual(tuple(transform_mon_loc_data(TEST_DATA).values()), transform_mon_loc_values(TEST_DATA))
+        self.assertEqual(COLUMNS, tuple(transform_mon_loc_data(TEST_DATA).keys()))
+
+
+class TestTransformPage(TestCase):
+
+    def setUp(self):
+        self.records = [
+            TEST_DATA,
+            dict(TEST_DATA, site_no='CA-1', qw_well_chars='Known Changes', wl_well_chars='UNKNOWN',
+                 qw_well_purpose='Other', wl_well_purpose=None, wl_well_type='Trend', qw_well_type='nonsense',
+                 qw_sn_flag=True, wl_baseline_flag=1, display_flag=None,
+                 well_depth_units={'unit_id': 1}, altitude_units={'unit_id': 2}),
+            dict(TEST_DATA, site_no='CA-2', nat_aqfr={'nat_aqfr_cd': 'N100'}, state=None, county={}, country='US'),
+            dict(TEST_DATA, site_no='CA-3', nat_aqfr=None, insert_date='2020-09-10T20:40:03Z'),
+        ]
+
+    def test_parity_with_row_transform(self):
+        batch = transform_page(self.records)
+
+        self.assertEqual(4, len(batch))
+        self.assertEqual(COLUMNS, batch.names)
+        self.assertEqual([transform_mon_loc_data(ml_data) for ml_data in self.records], batch.records())
+        self.assertEqual([tuple(transform_mon_loc_data(ml_data).values()) for ml_data in self.records],
+                         list(batch.rows()))
+
+    def test_rows_of_columns_and_positions(self):
+        batch = transform_page(self.records)
+
+        self.assertEqual([('CA-3', '0'), ('CA-1', '1')], list(batch.rows(('SITE_NO', 'QW_SN_FLAG'), [3, 1])))
+        self.assertEqual(['CA-3', 'CA-1'], [record['SITE_NO'] for record in batch.records([3, 1])])
+
+    def test_malformed_date(self):
+        self.records[2] = dict(self.records[2], update_date='2020-09-10 noon')
+
+        with self.assertRaises(MalformedDateError):
+            transform_page(self.records)
+
+    def test_empty_page(self):
+        batch = transform_page([])
+
+        self.assertEqual(0, len(batch))
+        self.assertEqual([], batch.records())
+
+
+class TestTimestamps(TestCase):
+
+    def test_parsed_once_in_utc(self):
+        result = transform_mon_loc_data(dict(TEST_DATA, update_date='2020-09-10T15:42:31-05:00'))
+
+        self.assertEqual(datetime(2020, 9, 10, 20, 40, 3, 504235, timezone.utc), result['INSERT_DATE'])
+        self.assertEqual(datetime(2020, 9, 10, 20, 42, 31, tzinfo=timezone.utc), result['UPDATE_DATE'])
+        self.assertIs(timezone.utc, result['UPDATE_DATE'].tzinfo)
+        self.assertIsNone(transform_mon_loc_data(dict(TEST_DATA, update_date=None))['UPDATE_DATE'])
+
+    def test_malformed(self):
+        with self.assertRaises(MalformedDateError) as context:
+            transform_mon_loc_data(dict(TEST_DATA, insert_date='09/10/2020'))
+
+        self.assertEqual('INSERT_DATE', context.exception.column)
+        self.assertEqual("Malformed INSERT_DATE: '09/10/2020'", str(context.exception))
+        self.assertIsInstance(context.exception, ValueError)
+
+    def test_date_format_does_not_mutate(self):
+        mapped_data = dict(transform_mon_loc_data(TEST_DATA), INSERT_DATE='2020-09-10T20:40:03Z')
+
+        formatted = date_format(mapped_data)
+
+        self.assertEqual('2020-09-10T20:40:03Z', mapped_data['INSERT_DATE'])
+        self.assertEqual(datetime(2020, 9, 10, 20, 40, 3, tzinfo=timezone.utc), formatted['INSERT_DATE'])
+        self.assertEqual(mapped_data['UPDATE_DATE'], formatted['UPDATE_DATE'])
+
+
+class TestParseTimestamp(TestCase):
+
+    def test_parse(self):
+        self.assertEqual(datetime(2020, 9, 10, 20, 40, 3, 504235, timezone.utc),
+                         parse_timestamp('2020-09-10T20:40:03.504235Z'))
+        self.assertEqual(datetime(2020, 9, 10, 20, 40, 3, 500000, timezone.utc),
+                         parse_timestamp('2020-09-10T20:40:03.5Z'))
+        self.assertEqual(datetime(2020, 9, 10, 20, 40, 3, tzinfo=timezone.utc),
+                         parse_timestamp('2020-09-10T20:40:03Z'))
+        self.assertEqual(datetime(2020, 9, 10, 20, 40, 3, tzinfo=timezone.utc),
+                         parse_timestamp('2020-09-10T15:40:03-05:00'))
+
+    def test_not_a_timestamp(self):
+        self.assertIsNone(parse_timestamp(None))
+        self.assertIsNone(parse_timestamp('yesterday'))
+        self.assertIsNone(parse_timestamp('2020-13-10T20:40:03Z'))
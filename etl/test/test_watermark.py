@@ -0,0 +1,118 @@
+"""
+Tests for the watermark.py module
+"""
+from datetime import datetime, timezone
+from unittest import TestCase, mock
+import os
+import tempfile
+
+from ..watermark import Watermark, filter_endpoint
+
+
+class TestWatermark(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'watermark.json')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_first_run_processes_everything(self):
+        watermark = Watermark(self.path)
+        self.assertIsNone(watermark.since)
+        self.assertTrue(watermark.is_newer({'update_date': '2020-09-10T20:42:31.844812Z'}))
+
+    def test_saved_mark_filters_older_records(self):
+        watermark = Watermark(self.path)
+        watermark.is_newer({'update_date': '2020-09-10T20:42:31.844812Z'})
+        watermark.is_newer({'update_date': '2020-09-09T10:00:00Z'})
+        watermark.save()
+
+        watermark = Watermark(self.path)
+        self.assertEqual(datetime(2020, 9, 10, 20, 42, 31, 844812, timezone.utc), watermark.since)
+        self.assertFalse(watermark.is_newer({'update_date': '2020-09-10T20:42:31.844812Z'}))
+        self.assertTrue(watermark.is_newer({'update_date': '2020-09-11T08:00:00Z'}))
+        self.assertTrue(watermark.is_newer({'update_date': None}))
+        watermark.save()
+        self.assertEqual(datetime(2020, 9, 11, 8, 0, 0, tzinfo=timezone.utc), Watermark(self.path).mark)
+
+    def test_overlap(self):
+        watermark = Watermark(self.path)
+        watermark.is_newer({'update_date': '2020-09-10T20:00:00Z'})
+        watermark.save()
+
+        watermark = Watermark(self.path, overlap_seconds=600)
+        self.assertTrue(watermark.is_newer({'update_date': '2020-09-10T19:55:00Z'}))
+        self.assertFalse(watermark.is_newer({'update_date': '2020-09-10T19:45:00Z'}))
+
+    def test_held_record_processed_again(self):
+        watermark = Watermark(self.path)
+        watermark.is_newer({'update_date': '2020-09-10T20:00:00Z'})
+        watermark.is_newer({'update_date': '2020-09-12T08:00:00Z'})
+        watermark.hold(datetime(2020, 9, 11, 8, 0, 0, tzinfo=timezone.utc))
+        watermark.hold(datetime(2020, 9, 11, 12, 0, 0, tzinfo=timezone.utc))
+        watermark.hold(None)
+        watermark.save()
+
+        watermark = Watermark(self.path)
+        self.assertTrue(watermark.is_newer({'update_date': '2020-09-11T08:00:00Z'}))
+        self.assertFalse(watermark.is_newer({'update_date': '2020-09-10T20:00:00Z'}))
+        # once the held record loads the mark moves on
+        watermark.save()
+        self.assertEqual(datetime(2020, 9, 11, 8, 0, 0, tzinfo=timezone.utc), Watermark(self.path).mark)
+
+    def test_hold_after_latest(self):
+        watermark = Watermark(self.path)
+        watermark.is_newer({'update_date': '2020-09-10T20:00:00Z'})
+        watermark.hold(datetime(2020, 9, 11, 8, 0, 0, tzinfo=timezone.utc))
+        watermark.save()
+        self.assertEqual(datetime(2020, 9, 10, 20, 0, 0, tzinfo=timezone.utc), Watermark(self.path).mark)
+
+    def test_failed_refresh_remembered(self):
+        def sink(name, refreshed):
+            mock_sink = mock.Mock(refreshed=refreshed)
+            mock_sink.name = name
+            return mock_sink
+
+        watermark = Watermark(self.path)
+        self.assertTrue(watermark.view_stale('oracle'))
+        watermark.record_refreshes([sink('oracle', False), sink('postgres', True)])
+        watermark.save(advance=False)
+
+        watermark = Watermark(self.path)
+        self.assertIsNone(watermark.mark)
+        self.assertTrue(watermark.view_stale('oracle'))
+        self.assertFalse(watermark.view_stale('postgres'))
+        # a run that loads only oracle keeps the state of postgres
+        watermark.record_refreshes([sink('oracle', True)])
+        watermark.save()
+
+        watermark = Watermark(self.path)
+        self.assertFalse(watermark.view_stale('oracle'))
+        self.assertFalse(watermark.view_stale('postgres'))
+
+    def test_mark_kept_without_advance(self):
+        watermark = Watermark(self.path)
+        watermark.is_newer({'update_date': '2020-09-10T20:00:00Z'})
+        watermark.save()
+
+        watermark = Watermark(self.path)
+        watermark.is_newer({'update_date': '2020-09-12T08:00:00Z'})
+        watermark.save(advance=False)
+        self.assertEqual(datetime(2020, 9, 10, 20, 0, 0, tzinfo=timezone.utc), Watermark(self.path).mark)
+
+    def test_unreadable_file(self):
+        with open(self.path, 'w') as state_file:
+            state_file.write('not json')
+        self.assertIsNone(Watermark(self.path).mark)
+
+    def test_filter_endpoint(self):
+        since = datetime(2020, 9, 10, 20, 0, 0, tzinfo=timezone.utc)
+        endpoint = 'https://fake.usgs.gov/registry/monitoring-locations/'
+        self.assertEqual(endpoint + '?update_date__gt=2020-09-10T20%3A00%3A00%2B00%3A00',
+                         filter_endpoint(endpoint, 'update_date__gt', since))
+        self.assertEqual(endpoint + '?format=json&update_date__gt=2020-09-10T20%3A00%3A00%2B00%3A00',
+                         filter_endpoint(endpoint + '?format=json', 'update_date__gt', since))
+        self.assertEqual(endpoint, filter_endpoint(endpoint, None, since))
+        self.assertEqual(endpoint, filter_endpoint(endpoint, 'update_date__gt', None))
@@ -4,6 +4,8 @@ works with the WELL_REGISTRY_STG table.
 """
 import re
 
+from datetime import datetime, timedelta, timezone
+
 
 def mapping_factory(mapping):
     def map_func(key):
@@ -12,6 +14,7 @@ def mapping_factory(mapping):
         else:
             ora_val = None
         return ora_val
+    map_func.mapping = mapping  # lets a whole column be mapped without a call per value
     return map_func
 
 
@@ -49,87 +52,323 @@ def to_flag(flag):
     return '1' if flag else '0'
 
 
-def transform_mon_loc_data(ml_data):
+TIMESTAMP_PATTERN = re.compile(
+    r'(\d{4})-(\d\d)-(\d\d)[T ](\d\d):(\d\d):(\d\d)(?:\.(\d{1,6})\d*)?(Z|[+-]\d\d:?\d\d)?$')
+
+_FROM_ISOFORMAT = getattr(datetime, 'fromisoformat', None)  # Python 3.7 and later
+
+
+def parse_timestamp(value):
+    """
+    Parse an ISO 8601 timestamp from the registry into a timezone aware datetime.
+    Timestamps without an offset are taken as UTC. Returns None for None or text that is not a timestamp.
+    """
+    if value is None:
+        return None
+    # fast path for the form the registry sends, 2020-09-10T20:40:03.504235Z
+    if len(value) == 27 and value[26] == 'Z' and value[19] == '.' and value[10] == 'T':
+        try:
+            if _FROM_ISOFORMAT is not None:
+                return _FROM_ISOFORMAT(value[:26] + '+00:00')
+            return datetime(int(value[0:4]), int(value[5:7]), int(value[8:10]), int(value[11:13]),
+                            int(value[14:16]), int(value[17:19]), int(value[20:26]), timezone.utc)
+        except ValueError:
+            pass
+    match = TIMESTAMP_PATTERN.match(value)
+    if match is None:
+        return None
+    year, month, day, hour, minute, second, fraction, offset = match.groups()
+    if offset is None or offset == 'Z':
+        tz = timezone.utc
+    else:
+        sign = -1 if offset[0] == '-' else 1
+        digits = offset[1:].replace(':', '')
+        tz = timezone(sign * timedelta(hours=int(digits[:2]), minutes=int(digits[2:])))
+    try:
+        return datetime(int(year), int(month), int(day), int(hour), int(minute), int(second),
+                        int(fraction.ljust(6, '0')) if fraction else 0, tz)
+    except ValueError:
+        return None
+
+
+class MalformedDateError(ValueError):
+    """
+    A timestamp of a monitoring location that is not ISO 8601.
+    """
+    def __init__(self, column, value):
+        ValueError.__init__(self, column, value)
+        self.column = column
+        self.value = value
+
+    def __str__(self):
+        return f'Malformed {self.column}: {self.value!r}'
+
+
+def timestamp_converter(column):
+    """
+    Converter of a timestamp column to an aware datetime in UTC, raising MalformedDateError for anything else.
+    """
+    def to_timestamp(value):
+        if value is None:
+            return None
+        timestamp = parse_timestamp(value)
+        if timestamp is None:
+            raise MalformedDateError(column, value)
+        if timestamp.tzinfo is not timezone.utc:
+            timestamp = timestamp.astimezone(timezone.utc)
+        return timestamp
+    return to_timestamp
+
+
+FIELD_SPEC = (
+    # target column, source path in the API JSON, converter, default
+    ('AGENCY_CD', 'agency.agency_cd', None, None),
+    ('AGENCY_NM', 'agency.agency_nm', None, None),
+    ('AGENCY_MED', 'agency.agency_med', None, None),
+    ('SITE_NO', 'site_no', None, None),
+    ('SITE_NAME', 'site_name', None, None),
+    ('DEC_LAT_VA', 'dec_lat_va', None, None),
+    ('DEC_LONG_VA', 'dec_long_va', None, None),
+    ('HORZ_DATUM', 'horizontal_datum', None, None),
+    ('ALT_VA', 'alt_va', None, None),
+    ('ALT_DATUM_CD', 'altitude_datum', None, None),
+    ('NAT_AQUIFER_CD', 'nat_aqfr?.nat_aqfr_cd', None, None),
+    ('NAT_AQFR_DESC', 'nat_aqfr?.nat_aqfr_desc', None, None),
+    ('LOCAL_AQUIFER_NAME', 'local_aquifer_name', None, None),
+    ('AQFR_CHAR', 'aqfr_type', None, None),
+    ('QW_SN_FLAG', 'qw_sn_flag', to_flag, None),
+    ('QW_BASELINE_FLAG', 'qw_baseline_flag', to_flag, None),
+    ('QW_WELL_CHARS', 'qw_well_chars', map_qw_well_chars, None),
+    ('QW_WELL_PURPOSE', 'qw_well_purpose', map_well_purpose, None),
+    ('QW_SYS_NAME', 'qw_network_name', None, None),
+    ('WL_SN_FLAG', 'wl_sn_flag', to_flag, None),
+    ('WL_BASELINE_FLAG', 'wl_baseline_flag', to_flag, None),
+    ('WL_WELL_CHARS', 'wl_well_chars', map_wl_well_chars, None),
+    ('WL_WELL_PURPOSE', 'wl_well_purpose', map_well_purpose, None),
+    ('WL_SYS_NAME', 'wl_network_name', None, None),
+    ('DATA_PROVIDER', None, None, None),
+    ('DISPLAY_FLAG', 'display_flag', to_flag, None),
+    ('WL_DATA_PROVIDER', None, None, None),
+    ('QW_DATA_PROVIDER', None, None, None),
+    ('LITH_DATA_PROVIDER', None, None, None),
+    ('CONST_DATA_PROVIDER', None, None, None),
+    ('WELL_DEPTH', 'well_depth', None, None),
+    ('LINK', 'link', None, None),
+    ('INSERT_DATE', 'insert_date', timestamp_converter('INSERT_DATE'), None),
+    ('UPDATE_DATE', 'update_date', timestamp_converter('UPDATE_DATE'), None),
+    ('WL_WELL_PURPOSE_NOTES', 'wl_well_purpose_notes', None, None),
+    ('QW_WELL_PURPOSE_NOTES', 'qw_well_purpose_notes', None, None),
+    ('INSERT_USER_ID', 'insert_user', None, None),
+    ('UPDATE_USER_ID', 'update_user', None, None),
+    ('WL_WELL_TYPE', 'wl_well_type', map_well_type, None),
+    ('QW_WELL_TYPE', 'qw_well_type', map_well_type, None),
+    ('LOCAL_AQUIFER_CD', None, None, None),
+    ('REVIEW_FLAG', None, None, None),
+    ('STATE_CD', 'state?.state_cd', None, None),
+    ('COUNTY_CD', 'county?.county_cd', None, None),
+    ('COUNTRY_CD', 'country?.country_cd', None, None),
+    ('WELL_DEPTH_UNITS', 'well_depth_units?.unit_id', None, None),
+    ('ALT_UNITS', 'altitude_units?.unit_id', None, None),
+    ('SITE_TYPE', 'site_type', None, None),
+    ('HORZ_METHOD', 'horz_method', None, None),
+    ('HORZ_ACY', 'horz_acy', None, None),
+    ('ALT_METHOD', 'alt_method', None, None),
+    ('ALT_ACY', 'alt_acy', None, None),
+)
+"""
+The mapping of the fields of the API JSON response to the columns of the WELL_REGISTRY_STG table.
+A source path names nested fields with dots and is required, except after a field marked with ?,
+which may be missing, null or not an object; the default is then used. A column without a source
+always takes its default. The converter, if any, is applied to the value found.
+"""
+
+COLUMNS = tuple(column for column, _, _, _ in FIELD_SPEC)
+"""
+The columns of a transformed monitoring location, in the order transform_mon_loc_data produces them.
+"""
+
+
+def compile_field_spec(spec):
+    """
+    Generate the source of the functions mapping one API record to a dict and to a tuple of the columns,
+    with a straight line lookup per column, and of the function mapping a page of records to a list per column.
+    Nested objects are looked up once into local variables, or local lists for a page.
+    Returns the source and the namespace of converters and defaults it refers to.
+    """
+    namespace = {}
+    lines = []
+    local_names = {(): 'ml_data'}
+
+    def lookup(segments):
+        """
+        Name of the local variable holding the value at the path of segments, declared on first use.
+        """
+        key = tuple(segments)
+        if key not in local_names:
+            parent = lookup(key[:-1])
+            name = key[-1].rstrip('?')
+            lenient = any(segment.endswith('?') for segment in key)
+            local_names[key] = f'_v{len(local_names)}'
+            lines.append(f'    {local_names[key]} = {access(parent, name, lenient, len(key) > 1)}')
+        return local_names[key]
+
+    def access(parent, name, lenient, nested):
+        if not lenient:
+            return f'{parent}[{name!r}]'
+        if not nested:
+            return f'{parent}.get({name!r})'
+        return f'({parent}.get({name!r}) if isinstance({parent}, dict) else None)'
+
+    values = []
+    for position, (column, source, convert, default) in enumerate(spec):
+        namespace[f'_default{position}'] = default
+        if source is None:
+            values.append(f'_default{position}')
+            continue
+        segments = source.split('.')
+        lenient = any(segment.endswith('?') for segment in segments)
+        value = access(lookup(segments[:-1]), segments[-1].rstrip('?'), lenient, len(segments) > 1)
+        if lenient and default is not None:
+            lines.append(f'    _value{position} = {value}')
+            value = f'(_default{position} if _value{position} is None else _value{position})'
+        if convert is not None:
+            namespace[f'_convert{position}'] = convert
+            value = f'_convert{position}({value})'
+        values.append(value)
+
+    # a copy of a dict already holding every column is filled faster than a dict display of many items is built
+    namespace['_template'] = dict.fromkeys(column for column, _, _, _ in spec)
+    body = '\n'.join(lines)
+    as_dict = '\n'.join(f'    mapped_data[{column!r}] = {value}' for (column, _, _, _), value in zip(spec, values))
+    as_tuple = ',\n'.join(f'        {value}' for value in values)
+    source = (
+        f'def transform_mon_loc_data(ml_data):\n{body}\n'
+        f'    mapped_data = _template.copy()\n{as_dict}\n    return mapped_data\n\n\n'
+        f'def transform_mon_loc_values(ml_data):\n{body}\n    return (\n{as_tuple},\n    )\n\n\n'
+        f'{_compile_page_spec(spec, access)}'
+    )
+    return source, namespace
+
+
+def _compile_page_spec(spec, access):
+    """
+    Source of transform_page_columns, which looks up and converts one column of a whole page at a time.
+    Enum mappings and flags are applied to a column in a single comprehension, without a call per value.
     """
+    lines = []
+    column_names = {(): 'records'}
+
+    def lookup(segments):
+        """
+        Name of the local list of the values at the path of segments in every record, declared on first use.
+        """
+        key = tuple(segments)
+        if key not in column_names:
+            parent = lookup(key[:-1])
+            lenient = any(segment.endswith('?') for segment in key)
+            column_names[key] = f'_c{len(column_names)}'
+            lines.append(f'    {column_names[key]} = '
+                         f'[{access("_r", key[-1].rstrip("?"), lenient, len(key) > 1)} for _r in {parent}]')
+        return column_names[key]
+
+    for position, (column, source, convert, default) in enumerate(spec):
+        name = f'_column{position}'
+        if source is None:
+            lines.append(f'    {name} = [_default{position}] * len(records)')
+            continue
+        segments = source.split('.')
+        lenient = any(segment.endswith('?') for segment in segments)
+        value = access('_r', segments[-1].rstrip('?'), lenient, len(segments) > 1)
+        lines.append(f'    {name} = [{value} for _r in {lookup(segments[:-1])}]')
+        if lenient and default is not None:
+            lines.append(f'    {name} = [_default{position} if _x is None else _x for _x in {name}]')
+        if convert is to_flag:
+            lines.append(f"    {name} = ['1' if _x else '0' for _x in {name}]")
+        elif getattr(convert, 'mapping', None) is not None:
+            lines.append(f'    _get{position} = _convert{position}.mapping.get')
+            lines.append(f'    {name} = [None if _x is None else _get{position}(_x.lower()) for _x in {name}]')
+        elif convert is not None:
+            lines.append(f'    {name} = list(map(_convert{position}, {name}))')
+
+    body = '\n'.join(lines)
+    as_columns = '\n'.join(f'        {column!r}: _column{position},'
+                           for position, (column, _, _, _) in enumerate(spec))
+    return f'def transform_page_columns(records):\n{body}\n    return {{\n{as_columns}\n    }}\n'
+
+
+TRANSFORM_SOURCE, _namespace = compile_field_spec(FIELD_SPEC)
+exec(compile(TRANSFORM_SOURCE, '<FIELD_SPEC>', 'exec'), _namespace)  # pylint: disable=exec-used
+
+transform_mon_loc_data = _namespace['transform_mon_loc_data']
+transform_mon_loc_data.__doc__ = """
     Map the fields from the API JSON response to
     the fields in the WELL_REGISTRY_STG table with
-    appropriate foreign key values.
+    appropriate foreign key values, as FIELD_SPEC describes.
     """
-    mapped_data = dict()
 
-    mapped_data['AGENCY_CD'] = ml_data['agency']['agency_cd']
-    mapped_data['AGENCY_NM'] = ml_data['agency']['agency_nm']
-    mapped_data['AGENCY_MED'] = ml_data['agency']['agency_med']
+transform_mon_loc_values = _namespace['transform_mon_loc_values']
+transform_mon_loc_values.__doc__ = """
+    The values transform_mon_loc_data maps a record to, as a tuple in COLUMNS order.
+    """
 
-    mapped_data['SITE_NO'] = ml_data['site_no']
-    mapped_data['SITE_NAME'] = ml_data['site_name']
-    mapped_data['DEC_LAT_VA'] = ml_data['dec_lat_va']
-    mapped_data['DEC_LONG_VA'] = ml_data['dec_long_va']
-    mapped_data['HORZ_DATUM'] = ml_data['horizontal_datum']
-    mapped_data['ALT_VA'] = ml_data['alt_va']
-    mapped_data['ALT_DATUM_CD'] = ml_data['altitude_datum']
-    try:
-        mapped_data['NAT_AQUIFER_CD'] = ml_data['nat_aqfr']['nat_aqfr_cd']
-        mapped_data['NAT_AQFR_DESC'] = ml_data['nat_aqfr']['nat_aqfr_desc']
-    except (AttributeError, KeyError, TypeError):
-        mapped_data['NAT_AQUIFER_CD'] = None
-        mapped_data['NAT_AQFR_DESC'] = None
-    mapped_data['LOCAL_AQUIFER_NAME'] = ml_data['local_aquifer_name']
-    mapped_data['AQFR_CHAR'] = ml_data['aqfr_type']
-    mapped_data['QW_SN_FLAG'] = to_flag(ml_data['qw_sn_flag'])
-    mapped_data['QW_BASELINE_FLAG'] = to_flag(ml_data['qw_baseline_flag'])
-    mapped_data['QW_WELL_CHARS'] = map_qw_well_chars(ml_data['qw_well_chars'])
-    mapped_data['QW_WELL_PURPOSE'] = map_well_purpose(ml_data['qw_well_purpose'])
-    mapped_data['QW_SYS_NAME'] = ml_data['qw_network_name']
-    mapped_data['WL_SN_FLAG'] = to_flag(ml_data['wl_sn_flag'])
-    mapped_data['WL_BASELINE_FLAG'] = to_flag(ml_data['wl_baseline_flag'])
-    mapped_data['WL_WELL_CHARS'] = map_wl_well_chars(ml_data['wl_well_chars'])
-    mapped_data['WL_WELL_PURPOSE'] = map_well_purpose(ml_data['wl_well_purpose'])
-    mapped_data['WL_SYS_NAME'] = ml_data['wl_network_name']
-    mapped_data['DATA_PROVIDER'] = None
-    mapped_data['DISPLAY_FLAG'] = to_flag(ml_data['display_flag'])
-    mapped_data['WL_DATA_PROVIDER'] = None
-    mapped_data['QW_DATA_PROVIDER'] = None
-    mapped_data['LITH_DATA_PROVIDER'] = None
-    mapped_data['CONST_DATA_PROVIDER'] = None
-    mapped_data['WELL_DEPTH'] = ml_data['well_depth']
-    mapped_data['LINK'] = ml_data['link']
-    mapped_data['INSERT_DATE'] = ml_data['insert_date']
-    mapped_data['UPDATE_DATE'] = ml_data['update_date']
-    mapped_data['WL_WELL_PURPOSE_NOTES'] = ml_data['wl_well_purpose_notes']
-    mapped_data['QW_WELL_PURPOSE_NOTES'] = ml_data['qw_well_purpose_notes']
-    mapped_data['INSERT_USER_ID'] = ml_data['insert_user']
-    mapped_data['UPDATE_USER_ID'] = ml_data['update_user']
-    mapped_data['WL_WELL_TYPE'] = map_well_type(ml_data['wl_well_type'])
-    mapped_data['QW_WELL_TYPE'] = map_well_type(ml_data['qw_well_type'])
-    mapped_data['LOCAL_AQUIFER_CD'] = None
-    mapped_data['REVIEW_FLAG'] = None
-    try:
-        mapped_data['STATE_CD'] = ml_data['state']['state_cd']
-    except (AttributeError, KeyError, TypeError):
-        mapped_data['STATE_CD'] = None
-    try:
-        mapped_data['COUNTY_CD'] = ml_data['county']['county_cd']
-    except (AttributeError, KeyError, TypeError):
-        mapped_data['COUNTY_CD'] = None
-    try:
-        mapped_data['COUNTRY_CD'] = ml_data['country']['country_cd']
-    except (AttributeError, KeyError, TypeError):
-        mapped_data['COUNTRY_CD'] = None
-    mapped_data['WELL_DEPTH_UNITS'] = ml_data['well_depth_units']['unit_id'] if ml_data['well_depth_units'] else None
-    mapped_data['ALT_UNITS'] = ml_data['altitude_units']['unit_id'] if ml_data['altitude_units'] else None
-    mapped_data['SITE_TYPE'] = ml_data['site_type']
-    mapped_data['HORZ_METHOD'] = ml_data['horz_method']
-    mapped_data['HORZ_ACY'] = ml_data['horz_acy']
-    mapped_data['ALT_METHOD'] = ml_data['alt_method']
-    mapped_data['ALT_ACY'] = ml_data['alt_acy']
+transform_page_columns = _namespace['transform_page_columns']
+transform_page_columns.__doc__ = """
+    The values transform_mon_loc_data maps each record of a page to, as a dict of one list per column.
+    """
+
+
+class ColumnBatch:
+    """
+    A transformed page of monitoring locations held as one list per column, in COLUMNS order.
+    Rows are zipped from the columns when asked for, so no dict is built per row.
+    """
+    def __init__(self, columns):
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.columns['SITE_NO']) if self.columns else 0
+
+    def __getitem__(self, column):
+        return self.columns[column]
+
+    @property
+    def names(self):
+        return tuple(self.columns.keys())
 
-    return mapped_data
+    def rows(self, names=None, positions=None):
+        """
+        Tuples of the values of the given columns, by default all of them, of every row or of the rows at positions.
+        """
+        rows = zip(*[self.columns[name] for name in (self.names if names is None else names)])
+        if positions is None:
+            return rows
+        rows = list(rows)
+        return (rows[position] for position in positions)
+
+    def records(self, positions=None):
+        """
+        The rows as the dicts transform_mon_loc_data returns, for code that still works one row at a time.
+        """
+        names = self.names
+        return [dict(zip(names, row)) for row in self.rows(positions=positions)]
+
+
+def transform_page(records):
+    """
+    Transform a page of monitoring locations from the API into a ColumnBatch,
+    with exactly the values transform_mon_loc_data gives for each record, a column at a time.
+    Raises MalformedDateError when a record of the page has a malformed timestamp.
+    """
+    return ColumnBatch(transform_page_columns(records))
 
 
 def date_format(mapped_data):
-    # fix missing fractions of a second
-    if re.match(r".*:\d\dZ$", mapped_data['INSERT_DATE']):
-        mapped_data['INSERT_DATE'] = mapped_data['INSERT_DATE'][:-1] + ".0Z"
-    if re.match(r".*:\d\dZ$", mapped_data['UPDATE_DATE']):
-        mapped_data['UPDATE_DATE'] = mapped_data['UPDATE_DATE'][:-1] + ".0Z"
+    """
+    A copy of a transformed monitoring location with its timestamps as datetimes,
+    for rows transformed before timestamps were parsed during the transform.
+    """
+    formatted = dict(mapped_data)
+    for column in ('INSERT_DATE', 'UPDATE_DATE'):
+        if isinstance(formatted[column], str):
+            formatted[column] = timestamp_converter(column)(formatted[column])
+    return formatted
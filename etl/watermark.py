@@ -0,0 +1,113 @@
+"""
+High-water mark of the registry update_date loaded by the last successful run
+"""
+
+import json
+import logging
+import os
+import tempfile
+
+from datetime import timedelta
+from urllib.parse import quote
+
+from .transform import parse_timestamp
+
+
+class Watermark:
+    """
+    The latest update_date of a successful run, kept in a local state file.
+    Records are newer than the mark when they were updated after it less the overlap,
+    which allows for registry updates that commit out of update_date order.
+    A record that failed can be held, so that the mark stops just before it and the next run processes it again.
+    The state file also keeps whether the last refresh of the materialized view of each sink succeeded.
+    """
+    def __init__(self, path, overlap_seconds=0):
+        self.path = path
+        self.overlap = timedelta(seconds=overlap_seconds)
+        self.mark, self.refreshed = self.load()
+        self.latest = self.mark
+        self.held = None
+
+    def load(self):
+        """
+        The mark saved by the last successful run, or None when there is none,
+        and whether the last refresh of each sink succeeded, by sink name.
+        """
+        try:
+            with open(self.path, 'r') as state_file:
+                state = json.load(state_file)
+            return parse_timestamp(state.get('update_date')), dict(state.get('refreshed', {}))
+        except FileNotFoundError:
+            return None, {}
+        except (OSError, ValueError, AttributeError, TypeError) as err:
+            logging.warning(f'Ignoring unreadable watermark file {self.path}: {err}')
+            return None, {}
+
+    @property
+    def since(self):
+        """
+        The update_date after which records are processed, or None to process all of them.
+        """
+        return None if self.mark is None else self.mark - self.overlap
+
+    def is_newer(self, ml_data):
+        """
+        True when the registry record needs to be processed. Records without a valid update_date always do.
+        """
+        update_date = parse_timestamp(ml_data.get('update_date'))
+        if update_date is None:
+            return True
+        if self.latest is None or update_date > self.latest:
+            self.latest = update_date
+        return self.since is None or update_date > self.since
+
+    def hold(self, update_date):
+        """
+        Keep the mark from passing a record updated at update_date, a datetime. None holds nothing,
+        since records without a valid update_date are always processed.
+        """
+        if update_date is not None and (self.held is None or update_date < self.held):
+            self.held = update_date
+
+    def view_stale(self, sink_name):
+        """
+        Whether the materialized view of the sink may be out of date: its last refresh failed or is not known.
+        """
+        return not self.refreshed.get(sink_name, False)
+
+    def record_refreshes(self, sinks):
+        """
+        Remember whether each sink of the run refreshed its materialized view. Other sinks keep their state.
+        """
+        for sink in sinks:
+            self.refreshed[sink.name] = sink.refreshed
+
+    def save(self, advance=True):
+        """
+        Record the latest update_date seen, or the moment before the oldest held record, whichever is earlier,
+        and the refresh of each sink, replacing the state file in one step. Without advance the mark stays.
+        """
+        mark = self.latest if advance else self.mark
+        if advance and self.held is not None and (mark is None or self.held <= mark):
+            mark = self.held - timedelta(microseconds=1)
+            logging.info(f'Watermark held before the failed record updated at {self.held.isoformat()}')
+        if mark is None and not self.refreshed:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        handle, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(handle, 'w') as temp_file:
+            json.dump({'update_date': None if mark is None else mark.isoformat(), 'refreshed': self.refreshed},
+                      temp_file)
+        os.replace(temp_path, self.path)
+        if advance and mark is not None:
+            logging.info(f'Watermark advanced to update_date {mark.isoformat()}')
+
+
+def filter_endpoint(endpoint, param, since):
+    """
+    Add a server side filter for records updated after since to the registry endpoint.
+    """
+    if param is None or since is None:
+        return endpoint
+    separator = '&' if '?' in endpoint else '?'
+    return f'{endpoint}{separator}{param}={quote(since.isoformat())}'
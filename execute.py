@@ -2,18 +2,25 @@
 Execute the ETL from the new well registry to NGWMN
 """
 
+import argparse
 import logging
 import os
 import sys
 import warnings
 
-import cx_Oracle
-import psycopg2
+from functools import partial
 
+from etl.async_extract import AsyncExtract
+from etl.deadletter import carry_over_dead_letters, read_dead_letters, replay_dead_letters, write_dead_letters
 from etl.extract import Extract
-from etl.transform import transform_mon_loc_data, date_format
-from etl.load import load_monitoring_location, load_monitoring_location_pg, \
-    refresh_well_registry_mv, refresh_well_registry_pg, make_oracle, make_postgres
+from etl.watermark import Watermark, filter_endpoint
+from etl.fingerprint import FingerprintIndex, row_fingerprint
+from etl.load import load_monitoring_locations_by_row, load_monitoring_locations_pg_by_row
+from etl.metrics import RequestMetrics, RunReport
+from etl.partition import PartitionedSink
+from etl.pipeline import Pipeline
+from etl.pool import make_oracle_pool, make_postgres_pool
+from etl.sink import OracleSink, PostgisSink
 
 registry_endpoint = os.getenv('REGISTRY_ML_ENDPOINT')
 database_host = os.getenv('DATABASE_HOST', None)
@@ -24,67 +31,215 @@ database_password = os.getenv('DATABASE_PASSWORD')
 pg_host = os.getenv('PG_HOST', None)
 pg_port = os.getenv('PG_PORT', '5432')
 pg_db_name = os.getenv('PG_DB_NAME', 'ngwmn')
+fetch_workers = os.getenv('FETCH_WORKERS', None)
+fetch_engine = os.getenv('FETCH_ENGINE', 'threads')
+fetch_limit = os.getenv('FETCH_LIMIT', None)
+fetch_limit_adaptive = os.getenv('FETCH_LIMIT_ADAPTIVE', 'false').lower() == 'true'
+fetch_limit_min = os.getenv('FETCH_LIMIT_MIN', None)
+fetch_limit_max = os.getenv('FETCH_LIMIT_MAX', None)
+fetch_target_seconds = os.getenv('FETCH_TARGET_SECONDS', None)
+fetch_retry_max_delay = os.getenv('FETCH_RETRY_MAX_DELAY', None)
+fetch_retry_budget = os.getenv('FETCH_RETRY_BUDGET', None)
+fetch_cache_dir = os.getenv('FETCH_CACHE_DIR', None)
+fetch_cache_max_bytes = os.getenv('FETCH_CACHE_MAX_BYTES', None)
+fetch_cache_ttl = os.getenv('FETCH_CACHE_TTL', None)
+watermark_file = os.getenv('WATERMARK_FILE', None)
+watermark_overlap_seconds = float(os.getenv('WATERMARK_OVERLAP_SECONDS', '300'))
+registry_updated_since_param = os.getenv('REGISTRY_UPDATED_SINCE_PARAM', None)
+fingerprint_index_file = os.getenv('FINGERPRINT_INDEX', None)
+oracle_batch_size = int(os.getenv('ORACLE_BATCH_SIZE', '500'))
+pg_batch_size = int(os.getenv('PG_BATCH_SIZE', '1000'))
+page_queue_size = int(os.getenv('PAGE_QUEUE_SIZE', '4'))
+load_workers = int(os.getenv('LOAD_WORKERS', '1'))
+load_mode = os.getenv('LOAD_MODE', 'bulk')
+load_commit_every = int(os.getenv('LOAD_COMMIT_EVERY', '100'))
+pg_mv_refresh = os.getenv('PG_MV_REFRESH', 'delta')
+oracle_mv_refresh = os.getenv('ORACLE_MV_REFRESH', 'auto')
+oracle_mv_fast_max_rows = int(os.getenv('ORACLE_MV_FAST_MAX_ROWS', '1000'))
+oracle_mv_atomic_refresh = os.getenv('ORACLE_MV_ATOMIC_REFRESH', 'true').lower() == 'true'
+oracle_mv_parallelism = int(os.getenv('ORACLE_MV_PARALLELISM', '0'))
+database_pool_size = int(os.getenv('DATABASE_POOL_SIZE', '2'))
+database_reconnect_retries = os.getenv('DATABASE_RECONNECT_RETRIES', None)
+dead_letter_file = os.getenv('DEAD_LETTER_FILE', None)
+metrics_json_file = os.getenv('METRICS_JSON_FILE', None)
+metrics_textfile = os.getenv('METRICS_TEXTFILE', None)
+
+
+def accept_since(watermark, since, mon_loc):
+    """
+    Whether a monitoring location is processed in an incremental run. Every record moves the watermark,
+    and older records are filtered here when the registry does not filter them.
+    """
+    return watermark.is_newer(mon_loc) or since is None
+
 
 if __name__ == '__main__':
     logging.getLogger().setLevel(logging.INFO)
 
+    parser = argparse.ArgumentParser(description='ETL monitoring locations from the well registry to NGWMN.')
+    parser.add_argument('--full', action='store_true',
+                        help='process every monitoring location even when WATERMARK_FILE holds a watermark')
+    parser.add_argument('--verify-index', action='store_true',
+                        help='clear the FINGERPRINT_INDEX so that every row is upserted and the index rebuilt')
+    parser.add_argument('--replay-dead-letters', action='store_true',
+                        help='only load the rows of the DEAD_LETTER_FILE again instead of extracting the registry')
+    args = parser.parse_args()
+
     if database_user is None or database_password is None:
         raise AssertionError('DATABASE_USER and DATABASE_PASSWORD environment variables must be specified.')
     if database_host is None and pg_host is None:
         raise AssertionError('One or both DATABASE_HOST and/or PG_HOST environment variables must be specified.')
-
-    mon_locs = Extract().get_monitoring_locations(registry_endpoint)
-    failed_locations = []
-    count = 0
-
-    with make_oracle(database_host, database_port, database_name, database_user, database_password) as oracle, \
-            make_postgres(pg_host, pg_port, pg_db_name, database_user, database_password) as postgres:
-
-        for mon_loc in mon_locs:
-            transformed_data = transform_mon_loc_data(mon_loc)
-
+    if args.replay_dead_letters and dead_letter_file is None:
+        raise AssertionError('DEAD_LETTER_FILE environment variable must be specified to replay dead letters.')
+
+    extract = AsyncExtract() if fetch_engine == 'async' else Extract()
+    if fetch_workers is not None:
+        extract.FETCH_WORKERS = int(fetch_workers)
+    if fetch_limit is not None:
+        extract.FETCH_LIMIT = int(fetch_limit)
+    extract.FETCH_LIMIT_ADAPTIVE = fetch_limit_adaptive
+    if fetch_limit_min is not None:
+        extract.FETCH_LIMIT_MIN = int(fetch_limit_min)
+    if fetch_limit_max is not None:
+        extract.FETCH_LIMIT_MAX = int(fetch_limit_max)
+    if fetch_target_seconds is not None:
+        extract.FETCH_TARGET_SECONDS = float(fetch_target_seconds)
+    if fetch_retry_max_delay is not None:
+        extract.FETCH_RETRY_MAX_DELAY = float(fetch_retry_max_delay)
+    if fetch_retry_budget is not None:
+        extract.FETCH_RETRY_BUDGET = int(fetch_retry_budget)
+    extract.FETCH_CACHE_DIR = fetch_cache_dir
+    if fetch_cache_max_bytes is not None:
+        extract.FETCH_CACHE_MAX_BYTES = int(fetch_cache_max_bytes)
+    if fetch_cache_ttl is not None:
+        extract.FETCH_CACHE_TTL = float(fetch_cache_ttl)
+    extract.FETCH_METRICS = RequestMetrics()
+
+    watermark = None if watermark_file is None else Watermark(watermark_file, watermark_overlap_seconds)
+    since = None if watermark is None or args.full else watermark.since
+    if since is not None:
+        logging.info(f'Incremental run for monitoring locations updated after {since.isoformat()}')
+    endpoint = filter_endpoint(registry_endpoint, registry_updated_since_param, since)
+
+    index = None if fingerprint_index_file is None else FingerprintIndex(fingerprint_index_file)
+    PostgisSink.MV_REFRESH = pg_mv_refresh
+    OracleSink.MV_METHOD = oracle_mv_refresh
+    OracleSink.MV_FAST_MAX_ROWS = oracle_mv_fast_max_rows
+    OracleSink.MV_ATOMIC_REFRESH = oracle_mv_atomic_refresh
+    OracleSink.MV_PARALLELISM = oracle_mv_parallelism
+
+    if load_mode == 'row':
+        load_oracle = partial(load_monitoring_locations_by_row, commit_every=load_commit_every)
+        load_postgres = partial(load_monitoring_locations_pg_by_row, commit_every=load_commit_every)
+    else:
+        load_oracle = None
+        load_postgres = None
+
+    # the arguments of the pools of load worker processes too, which do not share the classes of this process
+    reconnect_retries = None if database_reconnect_retries is None else int(database_reconnect_retries)
+    oracle_connect_args = (database_host, database_port, database_name, database_user, database_password,
+                           database_pool_size, reconnect_retries)
+    pg_connect_args = (pg_host, pg_port, pg_db_name, database_user, database_password, database_pool_size,
+                       reconnect_retries)
+    with make_oracle_pool(*oracle_connect_args) as oracle, make_postgres_pool(*pg_connect_args) as postgres:
+
+        if index is not None and args.verify_index:  # rows edited in the databases are only caught by loading again
             if database_host is not None:
-                try:  # ETL to legacy Oracle
-                    load_monitoring_location(oracle, transformed_data)
-                except (cx_Oracle.IntegrityError, cx_Oracle.DatabaseError) as err:
-                    failed_locations.append((transformed_data['AGENCY_CD'], transformed_data['SITE_NO'], err))
+                index.clear(OracleSink.name)
+            if pg_host is not None:
+                index.clear(PostgisSink.name)
 
+        sinks = []
+        if load_workers > 1:  # each database is loaded by worker processes with connections of their own
+            if database_host is not None:
+                sinks.append(PartitionedSink(OracleSink, oracle, make_oracle_pool, oracle_connect_args,
+                                             load_workers, oracle_batch_size, load_oracle, index))
             if pg_host is not None:
-                try:  # ETL to PostGIS
-                    date_format(transformed_data)
-                    load_monitoring_location_pg(postgres, transformed_data)
-                except (psycopg2.IntegrityError, psycopg2.DatabaseError) as err:
-                    failed_locations.append((transformed_data['AGENCY_CD'], transformed_data['SITE_NO'], err))
-
-            if count % 1000 == 1:
-                logging.info(f'Loaded monitoring locations: {count}')
-            count = count + 1
-
-        logging.info(f'Loaded monitoring locations: {count}')
-
-        if database_host is not None:
-            logging.info('updating Oracle materialized view')
-            try:  # ETL to legacy Oracle
-                refresh_well_registry_mv(oracle)
-                oracle_update = True
-            except (cx_Oracle.IntegrityError, cx_Oracle.DatabaseError) as err:
-                oracle_update = False
-
-        if pg_host is not None:
-            logging.info('updating postgres registry table')
-            try:  # ETL to PostGIS
-                refresh_well_registry_pg(postgres)
-                postgres_update = True
-            except (psycopg2.IntegrityError, psycopg2.DatabaseError) as err:
-                postgres_update = False
-
-    if len(failed_locations) > 0:
+                sinks.append(PartitionedSink(PostgisSink, postgres, make_postgres_pool, pg_connect_args,
+                                             load_workers, pg_batch_size, load_postgres, index))
+        else:
+            if database_host is not None:  # ETL to legacy Oracle, one array DML MERGE per batch
+                sinks.append(OracleSink(oracle, oracle_batch_size, load_oracle, index))
+            if pg_host is not None:  # ETL to PostGIS, one COPY and set based upsert per batch
+                sinks.append(PostgisSink(postgres, pg_batch_size, load_postgres, index))
+        if watermark is not None:  # a view whose last refresh failed is refreshed even when no row changed
+            for sink in sinks:
+                sink.view_stale = watermark.view_stale(sink.name)
+        pipeline = None
+        kept_letters = []
+        # the letters of earlier runs are kept until a run loads their rows or fails them again
+        previous_letters = []
+        if dead_letter_file is not None and not args.replay_dead_letters and os.path.exists(dead_letter_file):
+            previous_letters = read_dead_letters(dead_letter_file)
+        extract_complete = False
+        completed = False
+        try:
+            if args.replay_dead_letters:  # only the rows that failed before, the registry is not extracted
+                letters = read_dead_letters(dead_letter_file)
+                logging.info(f'Replaying {len(letters)} dead letters of {dead_letter_file}')
+                kept_letters = replay_dead_letters(letters, sinks, None if index is None else row_fingerprint)
+                extract_complete = True
+            else:
+                # pages are fetched, transformed and loaded concurrently, connected by bounded queues
+                pipeline = Pipeline(extract, endpoint, sinks, page_queue_size,
+                                    accept=None if watermark is None else partial(accept_since, watermark, since),
+                                    fingerprint=None if index is None else row_fingerprint)
+                pipeline.run()
+                extract_complete = pipeline.extract_complete
+
+                logging.info(f'Transformed monitoring locations: {pipeline.count}')
+                if pipeline.skipped > 0:
+                    logging.info(f'Skipped monitoring locations not updated since the watermark: {pipeline.skipped}')
+            completed = True
+        finally:
+            # also when the run raised, so that the rows it failed are retried, kept and reported
+            rejected = [] if pipeline is None else pipeline.rejected
+
+            # rows that failed because a database was briefly unavailable get one more chance, in one batch
+            for sink in sinks:
+                sink.retry_failed()
+            if index is not None:
+                index.close()
+
+            # a replay cut short leaves the file as it was, the letters it did not reach are only kept there
+            if dead_letter_file is not None and (completed or not args.replay_dead_letters):
+                if not args.replay_dead_letters:
+                    kept_letters = carry_over_dead_letters(previous_letters, sinks)
+                dead_letters = kept_letters + [letter for sink in sinks for letter in sink.dead_letters()]
+                write_dead_letters(dead_letter_file, dead_letters)
+
+            failed_locations = rejected + [failed_location for sink in sinks
+                                           for failed_location in sink.failed_locations]
+            success = completed and extract_complete and len(failed_locations) == 0 and \
+                all(sink.error is None for sink in sinks)
+            report = RunReport(None if args.replay_dead_letters else extract, pipeline, sinks, success=success)
+            if metrics_json_file is not None:
+                report.write_json(metrics_json_file)
+            if metrics_textfile is not None:
+                report.write_textfile(metrics_textfile)
+
+            # a complete run moves the watermark. Rows that failed to load hold it, so they are extracted again,
+            # unless they are kept in the dead letter file. Malformed records never hold it, they fail until
+            # corrected. Every run records which materialized views it refreshed
+            if watermark is not None:
+                advance = completed and extract_complete and not args.replay_dead_letters
+                if advance and dead_letter_file is None:
+                    for sink in sinks:
+                        for _, mon_loc, _ in sink.dead_letters():
+                            watermark.hold(mon_loc['UPDATE_DATE'])
+                watermark.record_refreshes(sinks)
+                watermark.save(advance)
+
+    if not success:
         warning_message = 'The following agency locations failed to insert/update:\n'
         for failed_location in failed_locations:
             warning_message += f'\t{failed_location}\n'
-        if not oracle_update:
-            warning_message += "\n Oracle Well_Registry_MV Not Updated.\n"
-        if not postgres_update:
-            warning_message += "\n Postgres Well_Registry_MV Not Updated.\n"
+        for sink in sinks:
+            if sink.error is not None:
+                warning_message += f"\n {sink.name} stopped loading: {sink.error}\n"
+            if not sink.refreshed:
+                warning_message += f"\n {sink.name} Well_Registry_MV Not Updated.\n"
+        if not extract_complete:
+            warning_message += "\n Extraction from the registry did not complete.\n"
         warnings.warn(warning_message)
         sys.exit(1)